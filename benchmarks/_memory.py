@@ -0,0 +1,26 @@
+'''
+Memory measurements for the benchmarks, read from /proc (Linux only).
+'''
+
+
+def status(field, pid='self'):
+    '''
+    Returns a field of /proc/<pid>/status given in kB (VmRSS, VmHWM...) in bytes,
+    or None if it can't be read.
+    '''
+    try:
+        with open('/proc/%s/status' % pid) as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak(pid='self'):
+    '''
+    Resets the peak RSS (VmHWM) of the process to its current RSS.
+    '''
+    with open('/proc/%s/clear_refs' % pid, 'w') as f:
+        f.write('5')
@@ -0,0 +1,142 @@
+'''
+Helpers shared by the registry benchmarks: creating a throwaway database,
+starting a local instance of the Flask app and summarizing latencies.
+'''
+import os
+import sys
+import math
+import time
+import socket
+import sqlite3
+import secrets
+import tempfile
+import subprocess
+import contextlib
+from datetime import datetime, timedelta
+
+import _memory
+
+FLASK_APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dockerflask', 'flask_app')
+
+
+def create_database(path, n_keys=1):
+    '''
+    Creates an empty registry database at the given path, with the same schema
+    the server uses, and seeds it with valid API keys.
+
+    Returns
+    -------
+    list
+        The generated API keys.
+    '''
+    os.environ['ML_FINGERPRINT_DATABASE'] = path
+    if FLASK_APP_DIR not in sys.path:
+        sys.path.insert(0, FLASK_APP_DIR)
+    import app
+    app.server.config['DATABASE'] = path
+    app.init_db()
+
+    conn = sqlite3.connect(path)
+    create_date = datetime.now()
+    expire_date = create_date + timedelta(days=1)
+    api_keys = []
+    for i in range(n_keys):
+        api_key = secrets.token_urlsafe(16)
+        conn.execute('insert into api_keys (email, key, create_date, expire_date, name) values (?,?,?,?,?)',
+            ('bench%d@localhost' % i, api_key, create_date.isoformat(), expire_date.isoformat(), 'Benchmark %d' % i))
+        api_keys.append(api_key)
+    conn.commit()
+    conn.close()
+    return api_keys
+
+
+def free_port():
+    with contextlib.closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def local_server(database, workers=1, threads=1, worker_class='sync', extra_env=None):
+    '''
+    Starts the registry with gunicorn on a free local port and stops it on exit.
+
+    Yields
+    ------
+    (str, subprocess.Popen)
+        Base URL of the server and the gunicorn master process.
+    '''
+    port = free_port()
+    env = dict(os.environ)
+    env.update({'ML_FINGERPRINT_DATABASE': database,
+                'GUNICORN_BIND': '127.0.0.1:%d' % port,
+                'GUNICORN_WORKERS': str(workers),
+                'GUNICORN_THREADS': str(threads),
+                'GUNICORN_WORKER_CLASS': worker_class})
+    if extra_env:
+        env.update(extra_env)
+    log = tempfile.TemporaryFile()
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:server'],
+                            cwd=FLASK_APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        deadline = time.time() + 30
+        while True:
+            if proc.poll() is not None:
+                log.seek(0)
+                raise RuntimeError("The server didn't start:\n" + log.read().decode(errors='replace'))
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                    break
+            except OSError:
+                if time.time() > deadline:
+                    raise RuntimeError("Timed out waiting for the server to start.")
+                time.sleep(0.1)
+        yield 'http://127.0.0.1:%d/' % port, proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        log.close()
+
+
+def process_tree_rss(pid):
+    '''
+    Returns the RSS in bytes of a process and of each of its children (e.g. the
+    gunicorn master and its workers), as {pid: bytes}. Linux only.
+    '''
+    rss = {pid: _memory.status('VmRSS', pid)}
+    try:
+        with open('/proc/%d/task/%d/children' % (pid, pid)) as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        children = []
+    for child in children:
+        rss[child] = _memory.status('VmRSS', child)
+    return {p: value for p, value in rss.items() if value is not None}
+
+
+def percentile(values, q):
+    '''
+    Nearest-rank percentile of a list of numbers (q between 0 and 100).
+    '''
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed):
+    '''
+    Turns a dict {operation: [seconds, ...]} into a dict of statistics in milliseconds.
+    '''
+    summary = {}
+    for op, values in latencies.items():
+        summary[op] = {'count': len(values),
+                       'throughput': len(values) / elapsed if elapsed > 0 else 0.0,
+                       'p50_ms': percentile(values, 50) * 1000,
+                       'p90_ms': percentile(values, 90) * 1000,
+                       'p99_ms': percentile(values, 99) * 1000}
+    return summary
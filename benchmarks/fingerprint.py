@@ -0,0 +1,190 @@
+'''
+Benchmark of sign() and verify() across estimator families and model sizes.
+
+For every family (the synthetic models of example_models: linear regressions,
+SVCs, KMeans, random forests, MLPs and TF-IDF text pipelines, plus a MinMaxScaler
++ forest pipeline) a model is built at every scale given in --scales. Each step
+then runs in a fresh process that loads the model:
+
+    sign     first signature of the model
+    resign   signing it again without changes (digests reused from the cache)
+    verify   verification of the signature
+
+and reports its wall time (best and median of --repeat runs), the peak memory
+on top of the loaded model and the number of bytes fed to SHA256. The results
+are written as JSON (--output) so they can be compared between versions.
+
+Example
+-------
+    python benchmarks/fingerprint.py --scales 1,4,16 --output fingerprint.json
+'''
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import _memory
+
+FAMILIES = ('LinearRegression', 'SVC', 'KMeans', 'RandomForest', 'MLP', 'Pipeline', 'TextPipeline')
+STEPS = ('sign', 'resign', 'verify')
+
+
+class _CountingHash():
+    """
+    Wraps a hashlib object, counting the bytes it is fed.
+    """
+    def __init__(self, h, counter):
+        self.h = h
+        self.counter = counter
+
+    def update(self, data):
+        self.counter[0] += memoryview(data).nbytes
+        self.h.update(data)
+
+    def hexdigest(self):
+        return self.h.hexdigest()
+
+
+class _CountingHashlib():
+    """
+    Stands in for the hashlib module in ml_fingerprint.digests.
+    """
+    def __init__(self):
+        self.counter = [0]
+
+    def sha256(self, data=b''):
+        h = _CountingHash(hashlib.sha256(), self.counter)
+        h.update(data)
+        return h
+
+
+def build_model(family, scale):
+    '''
+    Builds a fitted model of the given family. Its size grows linearly with scale.
+    '''
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import MinMaxScaler
+    from ml_fingerprint import example_models
+
+    if family == 'LinearRegression':
+        return example_models.large_linear_regression(n_features=10000 * scale)
+    if family == 'SVC':
+        return example_models.large_svc(n_support_vectors=1000 * scale)
+    if family == 'KMeans':
+        return example_models.large_kmeans(n_clusters=200 * scale)
+    if family == 'RandomForest':
+        return example_models.large_random_forest(n_trees=25 * scale)
+    if family == 'MLP':
+        return example_models.large_mlp(hidden_layer_sizes=(128 * scale, 128 * scale))
+    if family == 'Pipeline':
+        X, y = example_models.synthetic_classification()
+        return make_pipeline(MinMaxScaler(), RandomForestClassifier(n_estimators=25 * scale, random_state=0)).fit(X, y)
+    if family == 'TextPipeline':
+        return example_models.large_text_pipeline(vocabulary_size=20000 * scale)
+    raise ValueError("Unknown family: " + family)
+
+
+def measure(path, key_path, step, repeat):
+    '''
+    Runs in the child process. Prints a JSON object with the results.
+    '''
+    from Crypto.PublicKey import RSA
+    from ml_fingerprint import ml_fingerprint, serialization, digests
+    ml_fingerprint.decorate_base_estimator()
+    with open(key_path, 'rb') as f:
+        private_key = RSA.import_key(f.read())
+    public_key = private_key.publickey()
+    model = serialization.load(path, mmap_mode=None)
+
+    counting = _CountingHashlib()
+    digests.hashlib = counting
+    run = {'sign': lambda: model.sign(private_key),
+           'resign': lambda: model.sign(private_key),
+           'verify': lambda: model.verify(public_key)}[step]
+    with contextlib.redirect_stdout(io.StringIO()):
+        if step != 'sign':
+            model.sign(private_key)
+        times = []
+        for i in range(repeat):
+            if step == 'sign':
+                # Every run is a first signature
+                model.__dict__.pop('ml_fingerprint_data', None)
+                digests._caches.pop(model, None)
+            if i == 0:
+                _memory.reset_peak()
+                before = _memory.status('VmRSS')
+                counting.counter[0] = 0
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+            if i == 0:
+                peak = _memory.status('VmHWM')
+                hashed = counting.counter[0]
+    print(json.dumps({'seconds_best': min(times), 'seconds_median': statistics.median(times),
+                      'peak_extra_bytes': peak - before, 'bytes_hashed': hashed,
+                      'excluded': model.ml_fingerprint_data['excluded_data']}))
+
+
+def environment():
+    import numpy
+    import sklearn
+    return {'python': platform.python_version(), 'numpy': numpy.__version__, 'sklearn': sklearn.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--families', default=','.join(FAMILIES), help="Comma-separated list of families.")
+    parser.add_argument('--scales', default='1,4,16', help="Comma-separated list of model sizes.")
+    parser.add_argument('--steps', default=','.join(STEPS), help="Comma-separated list of steps.")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs of every step (the first one measures memory).")
+    parser.add_argument('--output', help="Write the results as JSON to this file.")
+    parser.add_argument('--child', nargs=4, metavar=('PATH', 'KEY', 'STEP', 'REPEAT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        path, key_path, step, repeat = args.child
+        measure(path, key_path, step, int(repeat))
+        return
+
+    from Crypto.PublicKey import RSA
+    from ml_fingerprint import serialization
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        key_path = os.path.join(tmp, 'key.pem')
+        with open(key_path, 'wb') as f:
+            f.write(RSA.generate(2048).export_key())
+        for family in args.families.split(','):
+            for scale in [int(s) for s in args.scales.split(',')]:
+                model = build_model(family, scale)
+                path = os.path.join(tmp, 'model.mlfp')
+                serialization.dump(model, path)
+                model_bytes = sum(buf.nbytes for buf in serialization.dumps_oob(model)[1])
+                del model
+                for step in args.steps.split(','):
+                    out = subprocess.check_output([sys.executable, __file__, '--child', path, key_path, step, str(args.repeat)])
+                    res = json.loads(out.decode().strip().splitlines()[-1])
+                    res.update({'family': family, 'scale': scale, 'model_bytes': model_bytes, 'step': step})
+                    results.append(res)
+                    print("%-16s x%-3d %-6s model %8.1f MB  hashed %8.1f MB  peak extra %7.1f MB  %8.4f s" % (
+                        family, scale, step, model_bytes / 1e6, res['bytes_hashed'] / 1e6,
+                        res['peak_extra_bytes'] / 1e6, res['seconds_best']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
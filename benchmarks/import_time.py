@@ -0,0 +1,106 @@
+'''
+Startup-time benchmark of the ml_fingerprint modules.
+
+Every module in --modules is imported in a fresh interpreter with
+``python -X importtime`` (best of --repeat runs). The script reports the total
+import time, the modules that cost the most (self time) and whether any of the
+modules the verification path must not load (requests, sqlite3, example_models
+and the sklearn estimators it uses) was imported anyway.
+
+With --check it exits with an error if one of them was imported, or if the
+import took more than --max-ms, so it can guard against regressions in CI.
+The results are written as JSON with --output.
+
+Example
+-------
+    python benchmarks/import_time.py --check --output import_time.json
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+MODULES = ('ml_fingerprint', 'ml_fingerprint.ml_fingerprint', 'ml_fingerprint.serialization', 'ml_fingerprint.remote')
+# Not needed to decode and verify a model
+FORBIDDEN = ('requests', 'sqlite3', 'ml_fingerprint.example_models', 'sklearn.svm', 'sklearn.cluster',
+             'sklearn.model_selection', 'sklearn.metrics')
+
+
+def import_profile(module):
+    '''
+    Imports module in a fresh interpreter with -X importtime.
+
+    Returns
+    -------
+    dict
+        Total import time, wall time of the process, self time of every imported
+        module (microseconds) and the names of the modules loaded at the end.
+    '''
+    code = 'import sys, json, %s; print(json.dumps(sorted(sys.modules)))' % module
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([REPO_DIR] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, env=env, check=True)
+    wall = time.perf_counter() - start
+    self_us = {}
+    total = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        self_us[name.strip()] = int(own)
+        if not name[1:].startswith(' '):
+            # Top-level import: its cumulative time includes everything below it
+            total += int(cumulative)
+    return {'total_us': total, 'wall_s': wall, 'self_us': self_us,
+            'loaded': json.loads(proc.stdout.strip().splitlines()[-1])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modules', default=','.join(MODULES), help="Comma-separated list of modules.")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per module (the best one is reported).")
+    parser.add_argument('--top', type=int, default=10, help="Number of most expensive modules shown.")
+    parser.add_argument('--check', action='store_true', help="Fail if a forbidden module is imported or --max-ms is exceeded.")
+    parser.add_argument('--max-ms', type=float, help="Largest import time accepted by --check.")
+    parser.add_argument('--output', help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    results = []
+    failed = False
+    for module in args.modules.split(','):
+        runs = [import_profile(module) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run['total_us'])
+        forbidden = [name for name in FORBIDDEN if name in best['loaded']]
+        top = sorted(best['self_us'].items(), key=lambda item: -item[1])[:args.top]
+        results.append({'module': module, 'total_ms': best['total_us'] / 1000,
+                        'median_total_ms': sorted(run['total_us'] for run in runs)[len(runs) // 2] / 1000,
+                        'wall_ms': min(run['wall_s'] for run in runs) * 1000,
+                        'modules_loaded': len(best['loaded']), 'forbidden_loaded': forbidden,
+                        'top_self_ms': [[name, us / 1000] for name, us in top]})
+        print("%-32s import %8.1f ms   process %8.1f ms   %5d modules" % (
+            module, best['total_us'] / 1000, results[-1]['wall_ms'], len(best['loaded'])))
+        for name, us in top:
+            print("    %-40s %8.1f ms" % (name, us / 1000))
+        if forbidden:
+            print("    loads modules it doesn't need: " + ', '.join(forbidden))
+            failed = True
+        if args.max_ms is not None and best['total_us'] / 1000 > args.max_ms:
+            print("    slower than --max-ms %.1f" % args.max_ms)
+            failed = True
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': {'python': platform.python_version(), 'machine': platform.machine(),
+                                       'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+                       'results': results}, f, indent=4)
+    if args.check and failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
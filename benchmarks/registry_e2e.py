@@ -0,0 +1,262 @@
+'''
+End-to-end benchmark of the registry with realistic clients.
+
+Starts the Flask app locally with gunicorn over a temporary SQLite database
+(no Google login is involved: the seeded API keys are used directly), fills it
+with --models models built with the example_models generators (with
+--model-scale, also large synthetic ones), and runs
+--clients concurrent clients, each one with its own RemoteServer and API key,
+doing a mix of:
+
+    get      RemoteServer.get_model() of a random model, including its verification
+    list     RemoteServer.get_list_models()
+    insert   RemoteServer.insert_model() of a new model
+    delete   RemoteServer.delete_model() of a model the client inserted
+
+It reports the throughput and latency percentiles of every operation and the
+RSS of the server processes (sampled during the run), and writes them as JSON
+with --output. Nothing outside this machine is needed.
+
+Example
+-------
+    python benchmarks/registry_e2e.py --models 10000 --clients 100 --workers 4 --threads 8
+'''
+import io
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+import contextlib
+from datetime import datetime
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import _registry
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def example_models(scale=0):
+    '''
+    Returns the models of example_models that can be built here, as a list of
+    (model, supervised, type). The ones whose dataset is missing are skipped.
+    With a scale, the synthetic models of that size are added too.
+    '''
+    from ml_fingerprint import example_models
+    models = []
+    if scale > 0:
+        models += [(example_models.large_random_forest(n_trees=25 * scale), True, 'classification'),
+                   (example_models.large_svc(n_support_vectors=1000 * scale), True, 'classification'),
+                   (example_models.large_mlp(hidden_layer_sizes=(128 * scale, 128 * scale)), True, 'classification'),
+                   (example_models.large_text_pipeline(vocabulary_size=20000 * scale), True, 'classification')]
+    models += [(example_models.vanderplas_regression(), True, 'regression'),
+               (example_models.vanderplas_classifier(), True, 'classification')]
+    cwd = os.getcwd()
+    os.chdir(REPO_DIR)
+    try:
+        models.append((example_models.boston_regression()[0], True, 'regression'))
+        models.append((example_models.pokemon_clustering()[0], False, 'clustering'))
+    except FileNotFoundError:
+        pass
+    finally:
+        os.chdir(cwd)
+    return models
+
+
+def populate(database, n_models, models, private_key, serializer, versions=3):
+    '''
+    Inserts n_models signed models straight into the database, cycling through the given
+    models and giving every name up to `versions` versions.
+
+    Returns
+    -------
+    list
+        Names of the inserted models.
+    '''
+    from ml_fingerprint import remote
+    encoded = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for model, supervised, model_type in models:
+            model.sign(private_key)
+            b64string_model, serializer_bytes, serializer_text = remote.encode_model(model, serializer)
+            encoded.append((b64string_model, serializer_bytes, serializer_text, int(supervised), model_type, type(model).__name__))
+    rows = []
+    names = []
+    date = datetime.now().isoformat()
+    for i in range(n_models):
+        b64string_model, serializer_bytes, serializer_text, supervised, model_type, estimator = encoded[i % len(encoded)]
+        name = 'model_%06d' % (i // versions)
+        if i % versions == 0:
+            names.append(name)
+        rows.append((name, b64string_model, serializer_bytes, serializer_text, supervised, model_type, estimator,
+                     json.dumps({'score': random.random()}), '1.0.%d' % (i % versions), json.dumps({}), date,
+                     'Benchmark model', 'Benchmark', 'bench@localhost', len(b64string_model)))
+    conn = sqlite3.connect(database)
+    conn.executemany('insert into models (name, serialized_model, serializer_bytes, serializer_text, supervised, type, estimator, scores, version, metadata, date, description, owner, email, payload_size) values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', rows)
+    conn.commit()
+    conn.close()
+    return names
+
+
+class RSSSampler(threading.Thread):
+    """
+    Samples the RSS of the server processes every `interval` seconds.
+    """
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.samples.append(_registry.process_tree_rss(self.pid))
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.samples.append(_registry.process_tree_rss(self.pid))
+
+    def summary(self):
+        totals = [sum(sample.values()) for sample in self.samples if sample]
+        last = self.samples[-1] if self.samples else {}
+        return {'peak_total_bytes': max(totals) if totals else None,
+                'final_total_bytes': totals[-1] if totals else None,
+                'final_per_process_bytes': {str(pid): rss for pid, rss in last.items()},
+                'processes': len(last)}
+
+
+def run_clients(url, api_keys, names, models, public_key, serializer, duration, mix):
+    '''
+    Runs one client thread per API key for `duration` seconds.
+
+    Returns
+    -------
+    (dict, dict)
+        {operation: [latency in seconds, ...]} of the successful operations and
+        {operation: number of errors}.
+    '''
+    from ml_fingerprint import remote
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    ops, weights = zip(*mix.items())
+    stop_at = time.time() + duration
+
+    def client(n):
+        server = remote.RemoteServer(url, api_keys[n], serializer_bytes=serializer)
+        rng = random.Random(n)
+        inserted = []
+        i = 0
+        while time.time() < stop_at:
+            op = rng.choices(ops, weights)[0]
+            if op == 'delete' and not inserted:
+                op = 'insert'
+            start = time.perf_counter()
+            try:
+                if op == 'get':
+                    ok = server.get_model(rng.choice(names), public_key) is not None
+                elif op == 'list':
+                    ok = server.get_list_models() is not None
+                elif op == 'insert':
+                    model, supervised, model_type = models[i % len(models)]
+                    name = 'client_%d_%d' % (n, i)
+                    i += 1
+                    ok = server.insert_model(model, name, supervised, model_type, {'score': rng.random()},
+                                             '1.0.0', {}, datetime.now(), 'Inserted by the benchmark').status_code == 200
+                    if ok:
+                        inserted.append(name)
+                else:
+                    ok = server.delete_model(inserted.pop(), '1.0.0').status_code == 200
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies[op].append(elapsed)
+                else:
+                    errors[op] += 1
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(len(api_keys))]
+    # RemoteServer prints every verification; keep the report readable.
+    with contextlib.redirect_stdout(io.StringIO()):
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    return dict(latencies), dict(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--models', type=int, default=10000, help="Models in the registry before the run.")
+    parser.add_argument('--clients', type=int, default=100, help="Concurrent clients, each with its own API key.")
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds of the run.")
+    parser.add_argument('--mix', default='get=6,list=1,insert=2,delete=1', help="Operation weights.")
+    parser.add_argument('--serializer', default='pickle', help="serializer_bytes used by the clients.")
+    parser.add_argument('--model-scale', type=int, default=0,
+                        help="Also store the synthetic models of example_models, of this size (1 is a few MB each).")
+    parser.add_argument('--workers', type=int, default=4, help="Gunicorn workers.")
+    parser.add_argument('--threads', type=int, default=8, help="Threads per gunicorn worker.")
+    parser.add_argument('--worker-class', default='gthread')
+    parser.add_argument('--output', help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    from Crypto.PublicKey import RSA
+    from ml_fingerprint import ml_fingerprint
+    ml_fingerprint.decorate_base_estimator()
+    private_key = RSA.generate(2048)
+    public_key = private_key.publickey()
+
+    mix = {}
+    for item in args.mix.split(','):
+        op, weight = item.split('=')
+        mix[op] = float(weight)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'registry.db')
+        api_keys = _registry.create_database(database, args.clients)
+        models = example_models(args.model_scale)
+        start = time.time()
+        names = populate(database, args.models, models, private_key, args.serializer)
+        print("Populated %d models (%d names) in %.1f s" % (args.models, len(names), time.time() - start))
+
+        with _registry.local_server(database, args.workers, args.threads, args.worker_class) as (url, proc):
+            sampler = RSSSampler(proc.pid)
+            sampler.start()
+            start = time.time()
+            latencies, errors = run_clients(url, api_keys, names, models, public_key,
+                                            args.serializer, args.duration, mix)
+            elapsed = time.time() - start
+            sampler.stop()
+
+    summary = _registry.summarize(latencies, elapsed)
+    rss = sampler.summary()
+    total = sum(s['count'] for s in summary.values())
+    print("workers=%d threads=%d class=%s clients=%d models=%d" % (args.workers, args.threads, args.worker_class, args.clients, args.models))
+    for op in sorted(summary):
+        s = summary[op]
+        print("  %-7s n=%-7d %8.1f op/s   p50 %8.2f ms   p90 %8.2f ms   p99 %8.2f ms   errors %d" % (
+            op, s['count'], s['throughput'], s['p50_ms'], s['p90_ms'], s['p99_ms'], errors.get(op, 0)))
+    print("  total   %.1f op/s" % (total / elapsed))
+    print("  server RSS: peak %.1f MB, final %.1f MB over %d processes" % (
+        (rss['peak_total_bytes'] or 0) / 1e6, (rss['final_total_bytes'] or 0) / 1e6, rss['processes']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'models': args.models, 'model_scale': args.model_scale, 'clients': args.clients, 'duration': elapsed, 'mix': mix,
+                       'workers': args.workers, 'threads': args.threads, 'worker_class': args.worker_class,
+                       'serializer': args.serializer, 'summary': summary, 'errors': errors,
+                       'throughput': total / elapsed, 'server_rss': rss}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
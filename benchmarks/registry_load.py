@@ -0,0 +1,151 @@
+'''
+Load generator for the registry server.
+
+It either targets an already running instance (--url and --api-key), or starts
+a local gunicorn instance over a temporary database for every worker count
+given in --workers, and reports p50/p99 latencies for listing, getting and
+uploading models.
+
+Examples
+--------
+    python benchmarks/registry_load.py --workers 1,2,4 --threads 4 --clients 16
+    python benchmarks/registry_load.py --url https://host/mlfingerprint/ --api-key KEY
+'''
+import os
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+
+import requests as req
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import _registry
+
+
+def run_load(url, api_key, clients, duration, payload_size, mix, verify_https=True):
+    '''
+    Runs `clients` threads against the server for `duration` seconds. Each thread
+    picks an operation at random following the weights in `mix`.
+
+    Returns
+    -------
+    dict
+        {operation: [latency in seconds, ...]}, plus the number of errors under 'errors'.
+    '''
+    payload = base64.b64encode(os.urandom(payload_size)).decode('ascii')
+    latencies = defaultdict(list)
+    errors = [0]
+    lock = threading.Lock()
+    uploaded = []
+    ops, weights = zip(*mix.items())
+    stop_at = time.time() + duration
+
+    def model_body(name):
+        return {'name': name, 'serialized_model': payload, 'serializer_bytes': 'pickle',
+                'serializer_text': 'base64', 'supervised': 1, 'type': 'regression',
+                'estimator': 'LinearRegression', 'scores': {'R2': random.random()},
+                'version': '1.0.0', 'metadata': {}, 'date': '2021-01-01T00:00:00',
+                'description': 'Load test model', 'api_key': api_key}
+
+    def worker(n):
+        session = req.Session()
+        session.verify = verify_https
+        rng = random.Random(n)
+        i = 0
+        while time.time() < stop_at:
+            op = rng.choices(ops, weights)[0]
+            if op == 'get' and not uploaded:
+                op = 'upload'
+            start = time.perf_counter()
+            if op == 'upload':
+                name = 'load_%d_%d' % (n, i)
+                i += 1
+                res = session.post(url + 'model/' + name, json=model_body(name))
+                if res.status_code == 200:
+                    with lock:
+                        uploaded.append(name)
+            elif op == 'get':
+                res = session.get(url + 'model/' + rng.choice(uploaded), params={'api_key': api_key})
+            else:
+                res = session.get(url + 'modellist', params={'api_key': api_key, 'format': 'json'})
+            elapsed = time.perf_counter() - start
+            with lock:
+                if res.status_code == 200:
+                    latencies[op].append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    result = dict(latencies)
+    result['errors'] = errors[0]
+    return result
+
+
+def print_summary(title, summary, errors):
+    print(title)
+    for op in sorted(summary):
+        s = summary[op]
+        print("  %-7s n=%-6d %8.1f req/s   p50 %8.2f ms   p99 %8.2f ms" % (op, s['count'], s['throughput'], s['p50_ms'], s['p99_ms']))
+    print("  errors: %d" % errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="URL of a running server. If not given, local instances are started.")
+    parser.add_argument('--api-key', help="API key for --url.")
+    parser.add_argument('--unsafe-https', action='store_true')
+    parser.add_argument('--workers', default='1,2,4', help="Comma separated gunicorn worker counts to try.")
+    parser.add_argument('--threads', type=int, default=4, help="Threads per gunicorn worker.")
+    parser.add_argument('--worker-class', default='gthread')
+    parser.add_argument('--clients', type=int, default=16, help="Concurrent client threads.")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per run.")
+    parser.add_argument('--payload-size', type=int, default=256 * 1024, help="Bytes of every uploaded model.")
+    parser.add_argument('--mix', default='list=1,get=4,upload=1', help="Operation weights.")
+    parser.add_argument('--output', help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    mix = {}
+    for item in args.mix.split(','):
+        op, weight = item.split('=')
+        mix[op] = float(weight)
+
+    results = []
+    if args.url:
+        url = args.url if args.url.endswith('/') else args.url + '/'
+        start = time.time()
+        lat = run_load(url, args.api_key, args.clients, args.duration, args.payload_size, mix, not args.unsafe_https)
+        errors = lat.pop('errors')
+        summary = _registry.summarize(lat, time.time() - start)
+        print_summary(url, summary, errors)
+        results.append({'url': url, 'summary': summary, 'errors': errors})
+    else:
+        for workers in [int(w) for w in args.workers.split(',')]:
+            with tempfile.TemporaryDirectory() as tmp:
+                database = os.path.join(tmp, 'registry.db')
+                api_key = _registry.create_database(database)[0]
+                with _registry.local_server(database, workers, args.threads, args.worker_class) as (url, proc):
+                    start = time.time()
+                    lat = run_load(url, api_key, args.clients, args.duration, args.payload_size, mix)
+                    errors = lat.pop('errors')
+                    summary = _registry.summarize(lat, time.time() - start)
+            print_summary("workers=%d threads=%d class=%s" % (workers, args.threads, args.worker_class), summary, errors)
+            results.append({'workers': workers, 'threads': args.threads, 'worker_class': args.worker_class,
+                            'summary': summary, 'errors': errors})
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+'''
+Peak memory of encoding and decoding large models with each serializer
+supported by remote.encode_model() ('pickle' and 'pickle5').
+
+Every measurement runs in a fresh process that loads the model, resets the
+peak RSS counter and then encodes (or encodes and decodes) the model, so the
+numbers are the extra memory used on top of the model itself.
+
+Example
+-------
+    python benchmarks/serialization_memory.py --svc-samples 4000 --features 2000
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import _memory
+
+
+def measure(path, serializer, step):
+    '''
+    Runs in the child process. Prints a JSON object with the results.
+    '''
+    from ml_fingerprint import serialization, remote
+    model = serialization.load(path, mmap_mode=None)
+    encoded = None
+    if step == 'decode':
+        encoded = remote.encode_model(model, serializer)[0]
+    _memory.reset_peak()
+    before = _memory.status('VmRSS')
+    start = time.perf_counter()
+    if step == 'encode':
+        encoded = remote.encode_model(model, serializer)[0]
+    else:
+        decoded = remote.decode_model(encoded, serializer)
+    elapsed = time.perf_counter() - start
+    peak = _memory.status('VmHWM')
+    print(json.dumps({'seconds': elapsed, 'peak_extra_bytes': peak - before, 'encoded_chars': len(encoded)}))
+
+
+def build_models(args):
+    from ml_fingerprint import example_models
+    yield 'SVC', example_models.large_svc(n_support_vectors=args.svc_samples, n_features=args.features)
+    yield 'KMeans', example_models.large_kmeans(n_clusters=args.clusters, n_features=args.features, n_samples=args.kmeans_samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--svc-samples', type=int, default=4000)
+    parser.add_argument('--kmeans-samples', type=int, default=4000)
+    parser.add_argument('--clusters', type=int, default=1000)
+    parser.add_argument('--features', type=int, default=2000)
+    parser.add_argument('--output', help="Write the results as JSON to this file.")
+    parser.add_argument('--child', nargs=3, metavar=('PATH', 'SERIALIZER', 'STEP'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure(*args.child)
+        return
+
+    from ml_fingerprint import serialization
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, model in build_models(args):
+            path = os.path.join(tmp, name + '.mlfp')
+            serialization.dump(model, path)
+            model_bytes = sum(buf.nbytes for buf in serialization.dumps_oob(model)[1])
+            del model
+            for serializer in ('pickle', 'pickle5'):
+                for step in ('encode', 'decode'):
+                    out = subprocess.check_output([sys.executable, __file__, '--child', path, serializer, step])
+                    res = json.loads(out.decode().strip().splitlines()[-1])
+                    res.update({'model': name, 'model_bytes': model_bytes, 'serializer': serializer, 'step': step})
+                    results.append(res)
+                    print("%-7s %-8s %-7s model %7.1f MB   peak extra %7.1f MB   %6.3f s" % (
+                        name, serializer, step, model_bytes / 1e6, res['peak_extra_bytes'] / 1e6, res['seconds']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+'''
+Throughput benchmark of serving predictions with ml_fingerprint.serving.
+
+Starts the registry locally (as registry_e2e.py does), uploads a signed model and
+loads it in a ModelPool. Then --clients threads send --requests small predict
+requests each (--rows rows per request), in every mode of --modes:
+
+    direct   model.predict(X) on the pool's model, one call per request
+    pooled   pool.predict(name, X): concurrent requests are coalesced into batches
+
+In pooled mode a new version of the model is uploaded halfway through, so the
+run also covers the polling thread, the verification of the new version and the
+hot swap. The script reports requests per second, latency percentiles, the mean
+batch size and the swaps, and writes them as JSON with --output.
+
+Example
+-------
+    python benchmarks/serving.py --model forest --clients 32 --requests 200 --output serving.json
+'''
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import _registry
+
+MODES = ('direct', 'pooled')
+
+
+def build_model(kind, seed):
+    '''
+    A model with 20 features: a linear regression or a random forest classifier.
+    '''
+    import numpy as np
+    from sklearn.linear_model import LinearRegression
+    from sklearn.ensemble import RandomForestClassifier
+    rng = np.random.RandomState(seed)
+    X = rng.rand(2000, 20)
+    y = X[:, 0] + X[:, 1] + 0.1 * rng.rand(2000)
+    if kind == 'linear':
+        return LinearRegression().fit(X, y)
+    return RandomForestClassifier(n_estimators=50, max_depth=10, random_state=seed).fit(X, y > 1)
+
+
+def run_clients(predict, n_clients, n_requests, rows, on_half=None):
+    '''
+    Runs n_clients threads sending n_requests requests each.
+
+    Returns
+    -------
+    (list, int, float)
+        Latencies in seconds, number of errors and elapsed time.
+    '''
+    import numpy as np
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    half = threading.Event()
+    done = [0]
+    total = n_clients * n_requests
+
+    def client(n):
+        X = np.random.RandomState(n).rand(n_requests, rows, 20)
+        own = []
+        for i in range(n_requests):
+            start = time.perf_counter()
+            try:
+                predict(X[i])
+                own.append(time.perf_counter() - start)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+            with lock:
+                done[0] += 1
+                if done[0] == total // 2:
+                    half.set()
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(n_clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    if on_half is not None:
+        half.wait()
+        on_half()
+    for t in threads:
+        t.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', choices=('linear', 'forest'), default='forest', help="Model served.")
+    parser.add_argument('--clients', type=int, default=32, help="Concurrent client threads.")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per client.")
+    parser.add_argument('--rows', type=int, default=1, help="Rows per request.")
+    parser.add_argument('--modes', default=','.join(MODES), help="Comma-separated list of modes.")
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-delay', type=float, default=0.001, help="Seconds a batch waits for more requests.")
+    parser.add_argument('--poll-interval', type=float, default=0.2, help="Seconds between checks for new versions.")
+    parser.add_argument('--output', help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    from Crypto.PublicKey import RSA
+    from ml_fingerprint import ml_fingerprint, remote, serving
+    ml_fingerprint.decorate_base_estimator()
+    private_key = RSA.generate(2048)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'registry.db')
+        api_key = _registry.create_database(database)[0]
+        with _registry.local_server(database, workers=1, threads=4, worker_class='gthread') as (url, proc):
+            server = remote.RemoteServer(url, api_key, serializer_bytes='manifest')
+
+            def upload(version, seed):
+                model = build_model(args.model, seed)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    model.sign(private_key)
+                    res = server.insert_model(model, 'served', True, 'classification', {}, version, {}, datetime.now(),
+                                              'Served by the benchmark')
+                if res.status_code != 200:
+                    raise RuntimeError("Couldn't upload the model: " + res.text)
+
+            upload('1.0', 0)
+            with contextlib.redirect_stdout(io.StringIO()):
+                pool = serving.ModelPool(server, private_key.publickey(), ['served'], poll_interval=args.poll_interval,
+                                         max_batch_size=args.max_batch_size, max_delay=args.max_delay)
+            pool.start()
+            versions = 1
+            for mode in args.modes.split(','):
+                on_half = None
+                uploaded = [None]
+                if mode == 'direct':
+                    predict = lambda X: pool.get('served').predict(X)
+                else:
+                    predict = lambda X: pool.predict('served', X, timeout=60)
+
+                    def on_half():
+                        upload('%d.0' % (versions + 1), versions)
+                        uploaded[0] = time.time()
+                pool.stats.update({'batches': 0, 'requests': 0, 'rows': 0, 'swaps': 0})
+                with contextlib.redirect_stdout(io.StringIO()):
+                    latencies, errors, elapsed = run_clients(predict, args.clients, args.requests, args.rows, on_half)
+                    if mode != 'direct':
+                        versions += 1
+                        # Wait for the new version if the run ended before it was swapped in
+                        deadline = time.time() + 60
+                        while pool.latest['served'].version != '%d.0' % versions and time.time() < deadline:
+                            time.sleep(0.05)
+                res = {'mode': mode, 'requests': len(latencies), 'errors': errors, 'elapsed_s': elapsed,
+                       'throughput': len(latencies) / elapsed,
+                       'p50_ms': _registry.percentile(latencies, 50) * 1000,
+                       'p99_ms': _registry.percentile(latencies, 99) * 1000}
+                if mode == 'pooled':
+                    res.update({'batches': pool.stats['batches'], 'swaps': pool.stats['swaps'],
+                                'mean_batch_rows': pool.stats['rows'] / max(1, pool.stats['batches']),
+                                'swap_after_upload_s': pool.latest['served'].loaded_at - uploaded[0]})
+                results.append(res)
+                print("%-7s %8.0f req/s   p50 %7.2f ms   p99 %7.2f ms   errors %d%s" % (
+                    mode, res['throughput'], res['p50_ms'], res['p99_ms'], errors,
+                    "   batch %.1f rows, %d swaps (%.2f s after the upload)" % (res['mean_batch_rows'], res['swaps'], res['swap_after_upload_s'])
+                    if mode == 'pooled' else ''))
+            pool.stop()
+            served_version = pool.latest['served'].version
+            print("Serving version " + served_version)
+
+    if args.output:
+        import numpy
+        import sklearn
+        environment = {'python': platform.python_version(), 'numpy': numpy.__version__, 'sklearn': sklearn.__version__,
+                       'machine': platform.machine(), 'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment, 'model': args.model, 'clients': args.clients, 'rows': args.rows,
+                       'served_version': served_version, 'results': results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
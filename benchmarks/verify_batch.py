@@ -0,0 +1,144 @@
+'''
+Cold-start benchmark of verifying a fleet of models.
+
+--models signed models (small regressors and classifiers and random forests, all
+different) are written to a temporary directory. Then, for every key type in
+--keys and every mode in --modes, a fresh process loads them all and verifies
+them:
+
+    sequential   model.verify(public_key) for every model, one after another
+    batch        ml_fingerprint.verify_batch(models, public_key)
+
+and reports the time spent importing, loading and verifying. The results are
+written as JSON with --output.
+
+Example
+-------
+    python benchmarks/verify_batch.py --models 1000 --output verify_batch.json
+'''
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+KEYS = ('rsa', 'ed25519')
+MODES = ('sequential', 'batch')
+
+
+def generate_key(kind):
+    from Crypto.PublicKey import RSA, ECC
+    if kind == 'rsa':
+        return RSA.generate(2048)
+    return ECC.generate(curve='ed25519')
+
+
+def build_models(n_models):
+    '''
+    Builds n_models different fitted models: linear regressors, logistic
+    regressions and small random forests, in turns.
+    '''
+    import numpy as np
+    from sklearn.linear_model import LinearRegression, LogisticRegression
+    from ml_fingerprint import example_models
+    models = []
+    for i in range(n_models):
+        rng = np.random.RandomState(i)
+        X = rng.rand(200, 10)
+        y = X[:, 0] + rng.rand(200)
+        if i % 3 == 0:
+            models.append(LinearRegression().fit(X, y))
+        elif i % 3 == 1:
+            models.append(LogisticRegression().fit(X, y > 1))
+        else:
+            models.append(example_models.large_random_forest(n_trees=10, max_depth=6, n_samples=200, n_features=10, random_state=i))
+    return models
+
+
+def measure(directory, key_path, mode, n_jobs):
+    '''
+    Runs in the child process. Prints a JSON object with the results.
+    '''
+    start = time.perf_counter()
+    from ml_fingerprint import ml_fingerprint, serialization, keyring
+    ml_fingerprint.decorate_base_estimator()
+    imported = time.perf_counter()
+    with open(key_path, 'rb') as f:
+        public_key = keyring.load_key(f.read())
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.mlfp'))
+    models = [serialization.load(path) for path in paths]
+    loaded = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == 'sequential':
+            passed = sum(bool(model.verify(public_key)) for model in models)
+        else:
+            passed = int(ml_fingerprint.verify_batch(models, public_key, n_jobs=n_jobs).passed.sum())
+    verified = time.perf_counter()
+    print(json.dumps({'import_s': imported - start, 'load_s': loaded - imported, 'verify_s': verified - loaded,
+                      'total_s': verified - start, 'passed': passed, 'models': len(models)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--models', type=int, default=1000, help="Number of models of the fleet.")
+    parser.add_argument('--keys', default=','.join(KEYS), help="Comma-separated list of key types.")
+    parser.add_argument('--modes', default=','.join(MODES), help="Comma-separated list of modes.")
+    parser.add_argument('--n-jobs', type=int, help="Threads used by verify_batch to hash the models.")
+    parser.add_argument('--output', help="Write the results as JSON to this file.")
+    parser.add_argument('--child', nargs=4, metavar=('DIR', 'KEY', 'MODE', 'N_JOBS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        directory, key_path, mode, n_jobs = args.child
+        measure(directory, key_path, mode, int(n_jobs) or None)
+        return
+
+    from ml_fingerprint import ml_fingerprint, serialization
+    ml_fingerprint.decorate_base_estimator()
+    start = time.time()
+    models = build_models(args.models)
+    print("Built %d models in %.1f s" % (len(models), time.time() - start))
+
+    results = []
+    for kind in args.keys.split(','):
+        private_key = generate_key(kind)
+        with tempfile.TemporaryDirectory() as tmp:
+            key_path = os.path.join(tmp, 'key.pem')
+            with open(key_path, 'wb') as f:
+                if kind == 'rsa':
+                    f.write(private_key.publickey().export_key())
+                else:
+                    f.write(private_key.public_key().export_key(format='PEM').encode('ascii'))
+            model_dir = os.path.join(tmp, 'models')
+            os.mkdir(model_dir)
+            with contextlib.redirect_stdout(io.StringIO()):
+                for i, model in enumerate(models):
+                    model.sign(private_key)
+                    serialization.dump(model, os.path.join(model_dir, 'model_%06d.mlfp' % i))
+            for mode in args.modes.split(','):
+                out = subprocess.check_output([sys.executable, __file__, '--child', model_dir, key_path, mode, str(args.n_jobs or 0)])
+                res = json.loads(out.decode().strip().splitlines()[-1])
+                res.update({'key': kind, 'mode': mode})
+                results.append(res)
+                print("%-8s %-10s import %6.2f s  load %6.2f s  verify %6.2f s  (%.2f ms/model)  total %6.2f s  passed %d/%d" % (
+                    kind, mode, res['import_s'], res['load_s'], res['verify_s'], res['verify_s'] / res['models'] * 1000,
+                    res['total_s'], res['passed'], res['models']))
+
+    if args.output:
+        import numpy
+        import sklearn
+        environment = {'python': platform.python_version(), 'numpy': numpy.__version__, 'sklearn': sklearn.__version__,
+                       'machine': platform.machine(), 'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment, 'models': args.models, 'results': results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
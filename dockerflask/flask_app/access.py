@@ -0,0 +1,88 @@
+'''
+How often every model is requested (downloaded with GET /model/<name> or used by
+/model/<name>/predict), kept in the model_access table.
+
+Writing a row per request would make every read wait for the database write lock,
+so every worker counts in memory and adds its counts to the table at most every
+ACCESS_FLUSH_INTERVAL seconds, in one short transaction. The counts are used to
+pre-warm the model cache of the workers with the most requested models.
+'''
+import time
+import sqlite3
+import threading
+from datetime import datetime
+
+SCHEMA = ('''create table if not exists "model_access" (
+    "model_id" INTEGER NOT NULL, "count" INTEGER NOT NULL, "last_access" TEXT, PRIMARY KEY("model_id"))''',
+    'create index if not exists model_access_count on model_access (count)')
+
+
+class AccessCounter():
+    """
+    Counts the accesses to the models in memory and adds them to the database
+    from time to time.
+
+    Attributes
+    ----------
+    flush_interval : float
+        Seconds between two writes to the database.
+    counts : dict
+        {model id: accesses} not written yet.
+    """
+    def __init__(self, flush_interval=10.0):
+        self.flush_interval = flush_interval
+        self.counts = {}
+        self.flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, conn, model_id):
+        '''
+        Counts an access to a model, and writes the pending counts with conn if
+        the last write was more than flush_interval seconds ago.
+        '''
+        with self._lock:
+            self.counts[model_id] = self.counts.get(model_id, 0) + 1
+            if time.monotonic() - self.flushed_at < self.flush_interval:
+                return
+            counts = self.counts
+            self.counts = {}
+            self.flushed_at = time.monotonic()
+        try:
+            self.flush(conn, counts)
+        except sqlite3.Error as e:
+            # Never fail a request because of the counters
+            print("Couldn't write the access counts: " + str(e))
+
+    def flush(self, conn, counts=None):
+        '''
+        Adds the given counts (by default, the pending ones) to the database.
+        '''
+        if counts is None:
+            with self._lock:
+                counts = self.counts
+                self.counts = {}
+                self.flushed_at = time.monotonic()
+        if not counts:
+            return
+        now = datetime.now().isoformat()
+        try:
+            conn.executemany('''insert into model_access (model_id, count, last_access) values (?, ?, ?)
+                on conflict (model_id) do update set count = count + excluded.count, last_access = excluded.last_access''',
+                [(model_id, count, now) for model_id, count in counts.items()])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # Counted again in the next flush
+            with self._lock:
+                for model_id, count in counts.items():
+                    self.counts[model_id] = self.counts.get(model_id, 0) + count
+            raise
+
+
+def most_accessed(conn, limit):
+    '''
+    Returns the rows (id, name, content_digest, revision) of the most requested
+    models that still exist, most requested first.
+    '''
+    return conn.execute('''select models.id, models.name, models.content_digest, models.revision from model_access
+        join models on models.id = model_access.model_id order by model_access.count desc limit ?''', (limit,)).fetchall()
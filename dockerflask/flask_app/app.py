@@ -1,23 +1,397 @@
-from flask import Flask, request, render_template, url_for, session, redirect
+from flask import Flask, request, render_template, url_for, session, redirect, g
 import sqlite3
 import os
 import json
+import threading
+import concurrent.futures
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from markupsafe import Markup
 from authlib.integrations.flask_client import OAuth
 import secrets
-
-database = os.path.join(os.getcwd(), 'ml_fingerprint_database.db')
-
-def get_db_connection():
-    conn = sqlite3.connect(database)
-    conn.row_factory = sqlite3.Row
-    return conn
+import base64
+import storage as payload_storage
+import metrics
+import scrubber
+import search
+import predict
+import access
+import limits
 
 server = Flask(__name__, static_folder='assets')
 server.secret_key = '!secret'
 server.config.from_object('config')
 oauth = OAuth(server)
 
+
+def get_db_connection():
+    '''
+    Returns the SQLite connection of the current request, opening it if needed.
+
+    Every request (and therefore every worker thread or greenlet) gets its own
+    connection, which is closed when the request ends. SQLite connections must
+    not be shared between threads, so they are never stored at module level.
+    '''
+    if 'db' not in g:
+        conn = sqlite3.connect(server.config['DATABASE'], timeout=server.config['DATABASE_TIMEOUT'],
+                               factory=metrics.connection_factory())
+        conn.row_factory = sqlite3.Row
+        conn.execute('pragma synchronous = normal')
+        g.db = conn
+    return g.db
+
+@server.teardown_appcontext
+def close_db_connection(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.close()
+
+def init_db():
+    '''
+    Creates the tables if they don't exist and switches the database to WAL mode,
+    so readers in other workers are not blocked while a model is being written.
+    '''
+    conn = sqlite3.connect(server.config['DATABASE'], timeout=server.config['DATABASE_TIMEOUT'])
+    c = conn.cursor()
+    c.execute('pragma journal_mode = wal')
+    c.execute('''create table if not exists "key" (
+        "id" INTEGER NOT NULL, "privatekey" TEXT, "publickey" TEXT, PRIMARY KEY("id"))''')
+    c.execute('''create table if not exists "models" (
+        "id" INTEGER NOT NULL, "name" TEXT, "serialized_model" BLOB, "serializer_bytes" TEXT,
+        "serializer_text" TEXT, "supervised" INTEGER, "type" TEXT, "estimator" TEXT, "scores" TEXT,
+        "version" TEXT, "metadata" TEXT, "date" TEXT, "description" TEXT, "owner" TEXT, "email" TEXT,
+        PRIMARY KEY("id"))''')
+    c.execute('''create table if not exists "api_keys" (
+        "id" INTEGER NOT NULL, "email" TEXT, "name" TEXT, "key" TEXT, "create_date" TEXT,
+        "expire_date" TEXT, PRIMARY KEY("id"))''')
+    add_missing_columns(c, 'models', {'payload_digest': 'TEXT', 'payload_size': 'INTEGER',
+                                      'display_scores': 'TEXT', 'display_date': 'TEXT', 'version_key': 'TEXT',
+                                      'revision': 'INTEGER', 'content_digest': 'TEXT'})
+    c.execute('create index if not exists api_keys_key on api_keys (key)')
+    c.execute('create index if not exists models_payload_digest on models (payload_digest)')
+    c.execute('create index if not exists models_name_version on models (name, version)')
+    c.execute('create index if not exists models_name_version_key on models (name, version_key)')
+    c.execute('create index if not exists models_content_digest on models (content_digest)')
+    for statement in access.SCHEMA:
+        c.execute(statement)
+    # Models written before the version_key column existed
+    rows = c.execute('select id, version from models where version_key is null').fetchall()
+    c.executemany('update models set version_key = ? where id = ?', [(version_key(version), model_id) for model_id, version in rows])
+    # Latest version of every model, kept by triggers
+    new_latest = c.execute("select 1 from sqlite_master where name = 'latest_versions'").fetchone() is None
+    for statement in LATEST_VERSIONS_SCHEMA:
+        c.execute(statement)
+    if new_latest:
+        c.execute('''insert or ignore into latest_versions (name, model_id, version_key)
+            select name, id, version_key from models m where id = (
+            select id from models where name = m.name order by version_key desc, id desc limit 1)''')
+    # Full-text and score/metadata indexes of /search
+    search.create_index(c, server.config['SEARCH_SCORES'], server.config['SEARCH_METADATA'])
+    c.execute('''create table if not exists "model_chunks" (
+        "model_id" INTEGER NOT NULL, "position" INTEGER NOT NULL, "digest" TEXT, "size" INTEGER,
+        PRIMARY KEY("model_id", "position"))''')
+    c.execute('create index if not exists model_chunks_digest on model_chunks (digest)')
+    c.execute(payload_storage.SQLiteStorage.SCHEMA)
+    # Results of the background scrubber (see scrubber.py)
+    for statement in scrubber.SCHEMA:
+        c.execute(statement)
+    # Token buckets shared by the workers (see limits.py)
+    for statement in limits.SCHEMA:
+        c.execute(statement)
+    # Changes with every insert, update or delete of a model, so all the workers know when
+    # their cached model lists are out of date
+    c.execute('''create table if not exists "list_generation" ("id" INTEGER NOT NULL, "generation" INTEGER, PRIMARY KEY("id"))''')
+    c.execute('insert or ignore into list_generation (id, generation) values (0, 0)')
+    # Models written before the display columns existed
+    rows = c.execute('select id, scores, date from models where display_date is null').fetchall()
+    for model_id, scores, date in rows:
+        model_dict = display_fields({'scores': scores, 'date': date})
+        c.execute('update models set display_scores = ?, display_date = ? where id = ?',
+                  (model_dict['display_scores'], model_dict['display_date'], model_id))
+    conn.commit()
+    conn.close()
+
+def add_missing_columns(c, table, columns):
+    '''
+    Adds to an existing table the columns (given as {name: type}) it doesn't have yet.
+    '''
+    existing = [row[1] for row in c.execute('pragma table_info(%s)' % table)]
+    for column, column_type in columns.items():
+        if column not in existing:
+            try:
+                c.execute('alter table %s add column %s %s' % (table, column, column_type))
+            except sqlite3.OperationalError:
+                # Another worker added it at the same time
+                pass
+
+def display_fields(model_dict):
+    '''
+    Computes how the scores (JSON text) and date of a model are shown in the model list.
+    Done when the model is written, so listing the models doesn't format them every time.
+    '''
+    new_scores = {}
+    for key, value in json.loads(model_dict['scores'] or '{}').items():
+        try:
+            new_scores[key] = "{:.4f}".format(value)
+        except (TypeError, ValueError):
+            new_scores[key] = str(value)
+    model_dict['display_scores'] = json.dumps(new_scores)
+    if model_dict['date'] == None:
+        model_dict['display_date'] = "-"
+    else:
+        try:
+            date = datetime.fromisoformat(str(model_dict['date']))
+            model_dict['display_date'] = date.strftime('%d %b. %Y %H:%M')
+        except ValueError:
+            model_dict['display_date'] = str(model_dict['date'])
+    return model_dict
+
+def version_key(version):
+    '''
+    Returns a string that sorts like the semantic version it comes from, so versions
+    can be ordered by SQLite: "1.10" > "1.9", "2.0.0" > "2.0.0-rc.1" > "2.0.0-beta".
+
+    Every numeric part is written with its number of digits in front ("10" -> "0210"),
+    parts are separated by "." and the release ends with "#", which sorts after the "!"
+    that starts a pre-release. Build metadata ("+...") and a leading "v" are ignored.
+    '''
+    def part(text):
+        if text.isdigit():
+            digits = text.lstrip('0') or '0'
+            return '%02d%s' % (len(digits), digits)
+        return text
+    version = str(version).strip().split('+')[0]
+    if version[:1] in ('v', 'V'):
+        version = version[1:]
+    release, _, prerelease = version.partition('-')
+    key = '.'.join(part(p) for p in release.split('.'))
+    if prerelease:
+        return key + '!' + '.'.join(part(p) for p in prerelease.split('.'))
+    return key + '#'
+
+# The model of every name with the highest version_key (the highest id on a tie). The triggers
+# update it in the same transaction as the models table.
+LATEST_VERSIONS_SCHEMA = ('''create table if not exists "latest_versions" (
+    "name" TEXT NOT NULL, "model_id" INTEGER NOT NULL, "version_key" TEXT, PRIMARY KEY("name"))''',
+    'create unique index if not exists latest_versions_model_id on latest_versions (model_id)',
+    '''create trigger if not exists "latest_versions_insert" after insert on models begin
+    insert into latest_versions (name, model_id, version_key) values (new.name, new.id, new.version_key)
+        on conflict (name) do update set model_id = excluded.model_id, version_key = excluded.version_key
+        where excluded.version_key > latest_versions.version_key or latest_versions.version_key is null
+        or (excluded.version_key = latest_versions.version_key and excluded.model_id > latest_versions.model_id);
+    end''',
+    '''create trigger if not exists "latest_versions_delete" after delete on models
+    when old.id in (select model_id from latest_versions where name = old.name) begin
+    delete from latest_versions where name = old.name;
+    insert into latest_versions (name, model_id, version_key) select name, id, version_key from models
+        where name = old.name order by version_key desc, id desc limit 1;
+    end''',
+    '''create trigger if not exists "latest_versions_update" after update of name, version_key on models begin
+    delete from latest_versions where name in (old.name, new.name);
+    insert into latest_versions (name, model_id, version_key) select name, id, version_key from models
+        where name = old.name order by version_key desc, id desc limit 1;
+    insert or ignore into latest_versions (name, model_id, version_key) select name, id, version_key from models
+        where name = new.name order by version_key desc, id desc limit 1;
+    end''')
+
+def bump_list_generation(c):
+    '''
+    Must be called inside the write transaction of every insert, update or delete of a model.
+    '''
+    c.execute('update list_generation set generation = generation + 1 where id = 0')
+
+init_db()
+
+# Requests per model, written every ACCESS_FLUSH_INTERVAL seconds (see access.py)
+access_counter = access.AccessCounter(server.config['ACCESS_FLUSH_INTERVAL'])
+
+# Per-route timings, query counts and response sizes on /metrics (see metrics.py)
+if server.config['METRICS_ENABLED']:
+    metrics.init_app(server, lambda api_key: check_api_key(get_db_connection().cursor(), api_key) is not None)
+
+# Request size, rate and concurrency limits (see limits.py)
+limits.init_app(server, get_db_connection)
+
+# Backend where the model payloads are stored. None keeps them inline in the models table.
+storage = payload_storage.storage_from_config(server.config)
+# Backend where the chunks of delta uploads are stored. Without a payload backend they
+# go to a table of the database, written through the connection of the current request.
+chunk_storage = storage if storage is not None else payload_storage.SQLiteStorage(get_db_connection)
+
+# Chunks of delta uploads that were never completed (the scrubber deletes them too)
+with server.app_context():
+    scrubber.sweep_chunks(get_db_connection(), chunk_storage, timedelta(hours=server.config['CHUNK_GRACE_PERIOD']))
+
+# Largest amount of chunk data returned by a single /chunks/fetch request
+MAX_FETCH_SIZE = 16 * 1024 * 1024
+
+# Rendered HTML of the model list of every combination of filters, with the list
+# generation it was rendered at: {filters: (generation, model count, html)}. Every worker
+# keeps its own, and only the most recently used LIST_CACHE_SIZE entries are kept.
+list_cache = OrderedDict()
+list_cache_lock = threading.Lock()
+LIST_CACHE_SIZE = 256
+
+# Columns of the models table shown in the model list
+LIST_COLUMNS = ('id, name, serializer_bytes, serializer_text, supervised, type, estimator, scores, version, metadata, '
+                'date, description, owner, email, payload_size, display_scores, display_date')
+# Generated columns of the search index
+SEARCH_COLUMNS = tuple(search.indexed_columns(server.config['SEARCH_SCORES'], server.config['SEARCH_METADATA']))
+
+
+def decode_payload(serialized_model, serializer_text):
+    '''
+    Converts the serialized model received in a request into the bytes to be stored.
+    '''
+    if serializer_text == 'base64':
+        return base64.b64decode(serialized_model)
+    return serialized_model.encode('utf-8')
+
+def encode_payload(data, serializer_text):
+    '''
+    Inverse of decode_payload(), used when sending a stored model back to a client.
+    '''
+    if serializer_text == 'base64':
+        return base64.b64encode(data).decode('ascii')
+    return data.decode('utf-8')
+
+def store_payload(model_dict):
+    '''
+    Writes the serialized model of model_dict into the storage backend and replaces it
+    by its digest. Does nothing if the payloads are kept inline in the database.
+    '''
+    if storage is None:
+        model_dict['payload_digest'] = None
+        model_dict['payload_size'] = None
+        return None
+    data = decode_payload(model_dict['serialized_model'], model_dict['serializer_text'])
+    model_dict['payload_digest'] = storage.put(data)
+    model_dict['payload_size'] = len(data)
+    model_dict['serialized_model'] = None
+    return data
+
+def ensure_payload(model_dict, data):
+    '''
+    Must be called inside the write transaction that references the payload: if a
+    concurrent delete removed the (shared) payload after store_payload(), it is written again.
+    '''
+    if data is not None and not storage.exists(model_dict['payload_digest']):
+        storage.put(data)
+
+def release_payload(c, digest):
+    '''
+    Must be called inside the write transaction that stopped referencing the payload.
+    Removes it from the storage backend if no other model uses it.
+    '''
+    if storage is None or digest is None:
+        return
+    if not payload_referenced(c, digest):
+        storage.delete(digest)
+
+def payload_referenced(c, digest):
+    '''
+    Checks if any model uses the payload, either whole or as one of its chunks
+    (both share the same content-addressed storage when a backend is configured).
+    '''
+    if c.execute('select 1 from models where payload_digest = ?', (digest,)).fetchone() is not None:
+        return True
+    return c.execute('select 1 from model_chunks where digest = ?', (digest,)).fetchone() is not None
+
+def load_payload(c, model_dict):
+    '''
+    Puts back into model_dict the serialized model, reading it from the storage backend
+    or joining its chunks if needed.
+    '''
+    if model_dict.get('payload_digest'):
+        data = storage.get(model_dict['payload_digest'])
+        model_dict['serialized_model'] = encode_payload(data, model_dict['serializer_text'])
+    elif model_dict.get('serialized_model') is None:
+        chunks = get_chunk_list(c, model_dict['id'])
+        if chunks:
+            data = b''.join(chunk_storage.get(digest) for digest, _ in chunks)
+            model_dict['serialized_model'] = encode_payload(data, model_dict['serializer_text'])
+    return model_dict
+
+def get_chunk_list(c, model_id):
+    '''
+    Returns the [digest, size] of the chunks of a model uploaded with delta uploads, in order.
+    '''
+    rows = c.execute('select digest, size from model_chunks where model_id = ? order by position', (model_id,)).fetchall()
+    return [[row['digest'], row['size']] for row in rows]
+
+def valid_digests(digests):
+    '''
+    Checks a list of chunk digests sent by a client. Digests are used as addresses in
+    the storage backends, so anything but a SHA256 digest could name other files.
+    '''
+    return isinstance(digests, list) and all(payload_storage.valid_digest(digest) for digest in digests)
+
+def valid_chunk_list(chunks):
+    '''
+    Checks the list of [digest, size] of a model sent with a delta upload.
+    '''
+    return (isinstance(chunks, list) and all(isinstance(chunk, list) and len(chunk) == 2 for chunk in chunks) and
+            valid_digests([digest for digest, _ in chunks]) and
+            all(type(size) is int and size >= 0 for _, size in chunks))
+
+def missing_chunks(digests):
+    '''
+    Returns the digests (without duplicates, in order) that are not in the chunk storage.
+    '''
+    missing = []
+    for digest in digests:
+        if digest not in missing and not chunk_storage.exists(digest):
+            missing.append(digest)
+    return missing
+
+def store_chunk_list(c, model_id, chunks):
+    '''
+    Must be called inside the write transaction of the model. References the chunks
+    [digest, size] from the model, in order.
+    '''
+    c.executemany('insert into model_chunks (model_id, position, digest, size) values (?,?,?,?)',
+        [(model_id, position, digest, size) for position, (digest, size) in enumerate(chunks)])
+
+def release_chunk_list(c, model_id, new_chunks=None):
+    '''
+    Must be called inside the write transaction that stops referencing the chunks of
+    a model. Replaces them by new_chunks (if any) and removes from the chunk storage
+    the old ones that no model uses anymore.
+    '''
+    digests = set(row['digest'] for row in c.execute('select digest from model_chunks where model_id = ?', (model_id,)))
+    c.execute('delete from model_chunks where model_id = ?', (model_id,))
+    if new_chunks is not None:
+        store_chunk_list(c, model_id, new_chunks)
+    for digest in digests:
+        # Rows written before the digests were checked may not be valid
+        if payload_storage.valid_digest(digest) and not payload_referenced(c, digest):
+            chunk_storage.delete(digest)
+
+def prepare_payload(model_dict):
+    '''
+    Stores the payload of an uploaded model. Models sent with delta uploads come with
+    the list of their chunks instead of the serialized model, and only their size is kept.
+
+    Returns
+    -------
+    bytes or None
+        The payload written to the storage backend, to be passed to ensure_payload().
+    '''
+    if model_dict.get('chunks') is None:
+        data = store_payload(model_dict)
+        if model_dict['payload_digest'] is not None:
+            model_dict['content_digest'] = model_dict['payload_digest']
+        else:
+            model_dict['content_digest'] = payload_storage.payload_digest(
+                decode_payload(model_dict['serialized_model'], model_dict['serializer_text']))
+        return data
+    model_dict['serialized_model'] = None
+    model_dict['payload_digest'] = None
+    model_dict['payload_size'] = sum(size for _, size in model_dict['chunks'])
+    # The chunks are content-addressed, so the list of their digests identifies the payload
+    model_dict['content_digest'] = payload_storage.payload_digest('\n'.join(digest for digest, _ in model_dict['chunks']).encode('ascii'))
+    return None
+
 CONF_URL = 'https://accounts.google.com/.well-known/openid-configuration'
 
 oauth.register(
@@ -113,26 +487,44 @@ def get_model(modelname):
     if 'api_key' not in request.args:
         return "No API key provided.", 403
     api_key = request.args['api_key']
-    current_time = datetime.now()
-    row = c.execute("select * from api_keys where key = ? and expire_date >= ?", (api_key, current_time.isoformat())).fetchone()
+    row = check_api_key(c, api_key)
     if row == None:
         return "API key invalid", 403
     email = row['email']
     name = row['name']
 
     model = None
-    if 'version' in request.args:
-        version = request.args['version']
-        model = c.execute('select * from models where name = ? and version = ?', (modelname,version)).fetchone()
-    else:
-        model = c.execute('select * from models where name = ? order by version desc', (modelname,)).fetchone()
+    with metrics.phase('select'):
+        if 'version' in request.args:
+            version = request.args['version']
+            model = c.execute('select * from models where name = ? and version = ?', (modelname,version)).fetchone()
+        else:
+            model = c.execute('select models.* from latest_versions join models on models.id = latest_versions.model_id where latest_versions.name = ?', (modelname,)).fetchone()
     
     if model != None:
+        access_counter.record(conn, model['id'])
+        # Identifies the payload, so clients can tell an updated version from the one they cached
+        digest = model_cache_key(model)
+        if request.args.get('digest') == digest:
+            return ("", 304)
         model_dict = dict(model)
+        for column in ('display_scores', 'display_date', 'version_key', 'revision', 'content_digest') + SEARCH_COLUMNS:
+            model_dict.pop(column, None)
+        model_dict['content_digest'] = digest
+        chunks = None
+        if request.args.get('chunked') == 'true' and model['serialized_model'] is None and model['payload_digest'] is None:
+            chunks = get_chunk_list(c, model['id'])
+        if chunks:
+            # Delta download: the client fetches from /chunks/fetch only the chunks it doesn't have
+            model_dict['chunks'] = chunks
+        else:
+            with metrics.phase('payload'):
+                model_dict = load_payload(c, model_dict)
         model_dict['scores'] = json.loads(model['scores'])
         model_dict['metadata'] = json.loads(model['metadata'])
 
-        json_response = json.dumps(model_dict, indent=4)
+        with metrics.phase('encode'):
+            json_response = json.dumps(model_dict, indent=4)
         return (json_response, {'Content-Type': 'application/json'})
     else:
         return ("The selected model doesn't exist.", 404)
@@ -142,17 +534,17 @@ def upload_model(modelname):
     c = conn.cursor()
 
     body = request.json
-    print(body)
 
     if 'api_key' not in body:
         return "No API key provided.", 403
     api_key = body['api_key']
-    current_time = datetime.now()
-    row = c.execute("select * from api_keys where key = ? and expire_date >= ?", (api_key, current_time.isoformat())).fetchone()
+    row = check_api_key(c, api_key)
     if row == None:
         return "API key invalid", 403
     email = row['email']
     name = row['name']
+    if body.get('chunks') is not None and not valid_chunk_list(body['chunks']):
+        return "Invalid list of chunks.", 400
 
     model = c.execute('select * from models where name = ? and version = ?', (modelname,body['version'])).fetchone()
 
@@ -167,9 +559,30 @@ def upload_model(modelname):
         model_dict['name'] = modelname
         model_dict['owner'] = name
         model_dict['email'] = email
+        model_dict['version_key'] = version_key(model_dict['version'])
+        display_fields(model_dict)
+
+        # The payload is written before taking the database lock, so slow uploads
+        # to the storage backend don't block the other workers.
+        with metrics.phase('payload'):
+            data = prepare_payload(model_dict)
 
-        c.execute('insert into models (name, serialized_model, serializer_bytes, serializer_text, supervised, type, estimator, scores, version, metadata, date, description, owner, email) values (:name, :serialized_model, :serializer_bytes, :serializer_text, :supervised, :type, :estimator, :scores, :version, :metadata, :date, :description, :owner, :email)',
+        c.execute('begin immediate')
+        if c.execute('select id from models where name = ? and version = ?', (modelname,body['version'])).fetchone() != None:
+            conn.rollback()
+            return "The model already exists.", 400
+        ensure_payload(model_dict, data)
+        if model_dict.get('chunks') is not None:
+            # Checked inside the transaction, so a concurrent delete can't remove them before they are referenced
+            missing = missing_chunks([digest for digest, _ in model_dict['chunks']])
+            if missing:
+                conn.rollback()
+                return (json.dumps({'missing': missing}), 409, {'Content-Type': 'application/json'})
+        c.execute('insert into models (name, serialized_model, serializer_bytes, serializer_text, supervised, type, estimator, scores, version, metadata, date, description, owner, email, payload_digest, payload_size, display_scores, display_date, version_key, content_digest) values (:name, :serialized_model, :serializer_bytes, :serializer_text, :supervised, :type, :estimator, :scores, :version, :metadata, :date, :description, :owner, :email, :payload_digest, :payload_size, :display_scores, :display_date, :version_key, :content_digest)',
             model_dict)
+        if model_dict.get('chunks') is not None:
+            store_chunk_list(c, c.lastrowid, model_dict['chunks'])
+        bump_list_generation(c)
 
         conn.commit()
         return "The model has been successfully inserted into the database.", 200
@@ -185,12 +598,13 @@ def update_model(modelname):
     if 'api_key' not in body:
         return "No API key provided.", 403
     api_key = body['api_key']
-    current_time = datetime.now()
-    row = c.execute("select * from api_keys where key = ? and expire_date >= ?", (api_key, current_time.isoformat())).fetchone()
+    row = check_api_key(c, api_key)
     if row == None:
         return "API key invalid", 403
     email = row['email']
     name = row['name']
+    if body.get('chunks') is not None and not valid_chunk_list(body['chunks']):
+        return "Invalid list of chunks.", 400
 
     model = c.execute('select * from models where name = ? and version = ?', (modelname,body['version'])).fetchone()
     if model != None:
@@ -204,9 +618,26 @@ def update_model(modelname):
         model_dict['id'] = model['id']
         model_dict['owner'] = name
         model_dict['email'] = email
+        display_fields(model_dict)
 
-        c.execute('update models set serialized_model = :serialized_model, serializer_bytes = :serializer_bytes, serializer_text = :serializer_text, supervised = :supervised, type = :type, estimator = :estimator, scores = :scores, metadata = :metadata, date = :date, description = :description, owner = :owner, email = :email where id = :id',
+        with metrics.phase('payload'):
+            data = prepare_payload(model_dict)
+
+        c.execute('begin immediate')
+        ensure_payload(model_dict, data)
+        if model_dict.get('chunks') is not None:
+            missing = missing_chunks([digest for digest, _ in model_dict['chunks']])
+            if missing:
+                conn.rollback()
+                return (json.dumps({'missing': missing}), 409, {'Content-Type': 'application/json'})
+        c.execute('update models set serialized_model = :serialized_model, serializer_bytes = :serializer_bytes, serializer_text = :serializer_text, supervised = :supervised, type = :type, estimator = :estimator, scores = :scores, metadata = :metadata, date = :date, description = :description, owner = :owner, email = :email, payload_digest = :payload_digest, payload_size = :payload_size, display_scores = :display_scores, display_date = :display_date, content_digest = :content_digest, revision = coalesce(revision, 0) + 1 where id = :id',
             model_dict)
+        if model['payload_digest'] != model_dict['payload_digest']:
+            release_payload(c, model['payload_digest'])
+        release_chunk_list(c, model['id'], model_dict.get('chunks'))
+        # The new payload must be checked again by the scrubber
+        c.execute('delete from scrub_results where model_id = ?', (model['id'],))
+        bump_list_generation(c)
 
         conn.commit()
         return "The model has been successfully updated.", 200
@@ -220,8 +651,7 @@ def delete_model(modelname):
     if 'api_key' not in request.args:
         return "No API key provided.", 403
     api_key = request.args['api_key']
-    current_time = datetime.now()
-    row = c.execute("select * from api_keys where key = ? and expire_date >= ?", (api_key, current_time.isoformat())).fetchone()
+    row = check_api_key(c, api_key)
     if row == None:
         return "API key invalid", 403
     email = row['email']
@@ -230,18 +660,226 @@ def delete_model(modelname):
     model = None
     if 'version' in request.args:
         version = request.args['version']
-        model = c.execute('select * from models where name = ? and version = ? order by version desc', (modelname,version)).fetchone()
+        model = c.execute('select * from models where name = ? and version = ?', (modelname,version)).fetchone()
     else:
-        model = c.execute('select * from models where name = ? order by version desc', (modelname,)).fetchone()
+        model = c.execute('select models.* from latest_versions join models on models.id = latest_versions.model_id where latest_versions.name = ?', (modelname,)).fetchone()
 
     if model != None:
+        c.execute('begin immediate')
         c.execute('delete from models where id = ?', (model['id'],))
+        release_payload(c, model['payload_digest'])
+        release_chunk_list(c, model['id'])
+        c.execute('delete from scrub_results where model_id = ?', (model['id'],))
+        c.execute('delete from model_access where model_id = ?', (model['id'],))
+        bump_list_generation(c)
         conn.commit()
         return "The model has been successfully deleted from the database.", 200
     else:
         return "The model doesn't exist.", 404
 
+@server.route('/model/<modelname>/predict', methods=['POST'])
+def predict_model(modelname):
+    '''
+    Predicts with a model of the registry (its latest version, or ?version=). The rows
+    go in the body, as JSON, NumPy or Arrow (see predict.py), and the result comes back
+    in the same format. ?method= chooses the method of the estimator (predict by default).
+    '''
+    if not server.config['PREDICT_ENABLED']:
+        return "Predictions are not enabled on this server.", 404
+    conn = get_db_connection()
+    c = conn.cursor()
+
+    if 'api_key' not in request.args:
+        return "No API key provided.", 403
+    row = check_api_key(c, request.args['api_key'])
+    if row == None:
+        return "API key invalid", 403
+
+    method = request.args.get('method', 'predict')
+    if method not in predict.METHODS:
+        return "Unknown method: " + method, 400
+
+    with metrics.phase('select'):
+        if 'version' in request.args:
+            model = c.execute('select id, revision, content_digest from models where name = ? and version = ?', (modelname, request.args['version'])).fetchone()
+        else:
+            model = c.execute('select models.id, models.revision, models.content_digest from latest_versions join models on models.id = latest_versions.model_id where latest_versions.name = ?', (modelname,)).fetchone()
+    if model == None:
+        return "The selected model doesn't exist.", 404
+    access_counter.record(conn, model['id'])
+
+    try:
+        X, content_type = predict.read_rows(request.get_data(), request.content_type)
+    except predict.RequestError as e:
+        return str(e), 400
+
+    try:
+        from ml_fingerprint import exceptions
+        pool = predict.get_pool(server.config, read_model_payload, predict_public_keys)
+    except ImportError:
+        return "Predictions need ml_fingerprint installed on the server.", 501
+    with metrics.phase('predict'):
+        # Cached by content, so an updated model is loaded again
+        future = pool.submit(modelname, X, method, version=model_cache_key(model))
+        try:
+            result = future.result(server.config['PREDICT_TIMEOUT'])
+        except (exceptions.VerificationError, exceptions.ModelNotSigned, exceptions.UnsupportedModel) as e:
+            return "The model can't be served: " + str(e), 422
+        except (ValueError, TypeError, AttributeError) as e:
+            return "Prediction failed: " + str(e), 400
+        except KeyError as e:
+            return str(e), 404
+        except concurrent.futures.TimeoutError:
+            return "Prediction timed out.", 503
+
+    with metrics.phase('encode'):
+        body, content_type = predict.encode_result(result, content_type)
+    return (body, {'Content-Type': content_type})
 
+def model_cache_key(row):
+    '''
+    Key of a model in the prediction cache: the digest of its payload or, for models
+    stored before it was recorded, its id and revision.
+    '''
+    if row['content_digest'] is not None:
+        return row['content_digest']
+    return 'id:%d:%d' % (row['id'], row['revision'] or 0)
+
+def read_model_payload(key):
+    '''
+    Returns the payload (bytes) and serializer of the model with the given cache key
+    (see model_cache_key()). Used by the prediction pool, outside of the requests,
+    so it opens its own connection.
+    '''
+    conn = sqlite3.connect(server.config['DATABASE'], timeout=server.config['DATABASE_TIMEOUT'])
+    conn.row_factory = sqlite3.Row
+    columns = 'id, serialized_model, serializer_bytes, serializer_text, payload_digest'
+    try:
+        c = conn.cursor()
+        if key.startswith('id:'):
+            row = c.execute('select ' + columns + ' from models where id = ?', (int(key.split(':')[1]),)).fetchone()
+        else:
+            row = c.execute('select ' + columns + ' from models where content_digest = ? limit 1', (key,)).fetchone()
+        if row == None:
+            raise KeyError("The model doesn't exist anymore: " + key)
+        model_dict = load_payload(c, dict(row))
+    finally:
+        conn.close()
+    return decode_payload(model_dict['serialized_model'], model_dict['serializer_text']), model_dict['serializer_bytes']
+
+def prewarm_models():
+    '''
+    Loads into the prediction cache of this worker the PREDICT_PREWARM most requested
+    models (see access.py), the most requested last so they are the last to be evicted.
+    '''
+    conn = sqlite3.connect(server.config['DATABASE'], timeout=server.config['DATABASE_TIMEOUT'])
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = access.most_accessed(conn, server.config['PREDICT_PREWARM'])
+    finally:
+        conn.close()
+    try:
+        pool = predict.get_pool(server.config, read_model_payload, predict_public_keys)
+    except ImportError:
+        return
+    for row in reversed(rows):
+        try:
+            pool.get(row['name'], model_cache_key(row))
+        except Exception as e:
+            print("Couldn't pre-warm model " + row['name'] + ": " + str(e))
+
+def predict_public_keys():
+    return scrubber.load_public_keys(server.config['DATABASE'], server.config['PREDICT_PUBLIC_KEYS'])
+
+def check_api_key(c, api_key):
+    '''
+    Returns the row of the API key if it exists and hasn't expired, None otherwise.
+    '''
+    with metrics.phase('auth'):
+        current_time = datetime.now()
+        return c.execute("select * from api_keys where key = ? and expire_date >= ?", (api_key, current_time.isoformat())).fetchone()
+
+@server.route('/chunks/missing', methods=['POST'])
+def manage_missing_chunks():
+    '''
+    Receives a list of chunk digests and returns those the server doesn't have,
+    so a delta upload only sends the chunks that changed.
+    '''
+    conn = get_db_connection()
+    c = conn.cursor()
+
+    body = request.json
+    if 'api_key' not in body:
+        return "No API key provided.", 403
+    if check_api_key(c, body['api_key']) == None:
+        return "API key invalid", 403
+    if not valid_digests(body.get('digests')):
+        return "Invalid chunk digest.", 400
+
+    json_response = json.dumps({'missing': missing_chunks(body['digests'])})
+    return (json_response, {'Content-Type': 'application/json'})
+
+@server.route('/chunks', methods=['POST'])
+def upload_chunks():
+    '''
+    Stores the chunks of a delta upload, given as a list of [digest, base64 content].
+    Every chunk is checked against its digest before being stored.
+    '''
+    conn = get_db_connection()
+    c = conn.cursor()
+
+    body = request.json
+    if 'api_key' not in body:
+        return "No API key provided.", 403
+    if check_api_key(c, body['api_key']) == None:
+        return "API key invalid", 403
+
+    chunks = []
+    for digest, content in body['chunks']:
+        data = base64.b64decode(content)
+        if payload_storage.payload_digest(data) != digest:
+            return "The content of chunk " + str(digest) + " doesn't match its digest.", 400
+        chunks.append(data)
+    # The upload time lets scrubber.sweep_chunks() delete the chunks of pushes never completed
+    uploaded = datetime.now().isoformat()
+    for data in chunks:
+        digest = chunk_storage.put(data)
+        c.execute('insert into chunk_uploads (digest, uploaded) values (?, ?) '
+                  'on conflict (digest) do update set uploaded = excluded.uploaded', (digest, uploaded))
+    conn.commit()
+    return "The chunks have been successfully stored.", 200
+
+@server.route('/chunks/fetch', methods=['POST'])
+def fetch_chunks():
+    '''
+    Returns the content (base64) of the requested chunks, as a list of [digest, content].
+    Stops after MAX_FETCH_SIZE bytes, so the client must ask again for the rest.
+    '''
+    conn = get_db_connection()
+    c = conn.cursor()
+
+    body = request.json
+    if 'api_key' not in body:
+        return "No API key provided.", 403
+    if check_api_key(c, body['api_key']) == None:
+        return "API key invalid", 403
+    if not valid_digests(body.get('digests')):
+        return "Invalid chunk digest.", 400
+
+    chunks = []
+    size = 0
+    for digest in body['digests']:
+        if chunks and size >= MAX_FETCH_SIZE:
+            break
+        try:
+            data = chunk_storage.get(digest)
+        except KeyError:
+            return "The chunk " + str(digest) + " doesn't exist.", 404
+        chunks.append([digest, base64.b64encode(data).decode('ascii')])
+        size += len(data)
+
+    json_response = json.dumps({'chunks': chunks})
+    return (json_response, {'Content-Type': 'application/json'})
 
 
 @server.route('/modellist', methods=['GET'])
@@ -259,6 +897,43 @@ def manage_modellist_versions(modelname):
         return "Method not allowed.", 405
 
 
+@server.route('/search', methods=['GET'])
+def search_models():
+    '''
+    Searches the models by text, type, scores and metadata (see search.py for the parameters).
+    Returns the matching models in JSON, like /modellist?format=json.
+    '''
+    conn = get_db_connection()
+    c = conn.cursor()
+
+    if 'api_key' not in request.args:
+        return "No API key provided.", 403
+    row = check_api_key(c, request.args['api_key'])
+    if row == None:
+        return "API key invalid", 403
+
+    try:
+        sql_sentence, args = search.build_query(request.args, LIST_COLUMNS, server.config['SEARCH_SCORES'],
+                                                server.config['SEARCH_METADATA'])
+        with metrics.phase('select'):
+            rows = c.execute(sql_sentence, args).fetchall()
+    except search.SearchError as e:
+        return str(e), 400
+    except sqlite3.OperationalError as e:
+        # Malformed full-text query
+        return "Invalid search: " + str(e), 400
+
+    model_list = []
+    for model in rows:
+        model_dict = dict(model)
+        model_dict.pop('display_scores')
+        model_dict.pop('display_date')
+        model_dict['scores'] = json.loads(model['scores'])
+        model_dict['metadata'] = json.loads(model['metadata'])
+        model_list.append(model_dict)
+    with metrics.phase('encode'):
+        json_list = json.dumps(model_list, indent=4)
+    return (json_list, {'Content-Type': 'application/json'})
 
 def get_modellist(modelname=None):
     login = 'user' not in session
@@ -269,17 +944,28 @@ def get_modellist(modelname=None):
     conn = get_db_connection()
     c = conn.cursor()
 
-    if 'format' in request.args and request.args['format'] == 'json':
+    json_format = 'format' in request.args and request.args['format'] == 'json'
+    if json_format:
         if 'api_key' not in request.args:
             return "No API key provided.", 403
         api_key = request.args['api_key']
-        current_time = datetime.now()
-        row = c.execute("select * from api_keys where key = ? and expire_date >= ?", (api_key, current_time.isoformat())).fetchone()
+        row = check_api_key(c, api_key)
         if row == None:
             return "API key invalid", 403
+    else:
+        # The rendered list is reused until a model is inserted, updated or deleted. The generation
+        # is read before the models, so a list is never cached as newer than the data it shows.
+        filters = (request.args.get('type'), modelname, request.args.get('allversions'))
+        generation = c.execute('select generation from list_generation where id = 0').fetchone()[0]
+        with list_cache_lock:
+            cached = list_cache.get(filters)
+            if cached is not None and cached[0] == generation:
+                list_cache.move_to_end(filters)
+        if cached is not None and cached[0] == generation:
+            return render_template('list.html', modelcount=cached[1], modellist_html=Markup(cached[2]), login=login, user=user)
 
-    
-    sql_sentence = "select * from (select * from models order by version desc) where 1 = 1"
+    # Every column but the payload, which can be large
+    sql_sentence = "select " + LIST_COLUMNS + " from models where 1 = 1"
     args = {}
     
     # If type specified, filter by type
@@ -300,36 +986,51 @@ def get_modellist(modelname=None):
 
     # If allversions=true, show all versions. If not, show only lastest version for each model.
     if not ('allversions' in request.args and request.args['allversions'] == "true") and modelname == None:
-        sql_sentence += " group by name"
+        sql_sentence += " and id in (select model_id from latest_versions)"
 
-    sql_sentence += " order by supervised desc, type, name"
+    if modelname != None:
+        # The versions of a model, newest first (ModelPool takes the first one as the latest)
+        sql_sentence += " order by version_key desc, id desc"
+    else:
+        sql_sentence += " order by supervised desc, type, name, version_key desc"
 
-    rows = c.execute(sql_sentence, args).fetchall()
-    model_list = []
-    for model in rows:
-        model_dict = dict(model)
-        model_dict.pop('serialized_model')
-        model_dict['scores'] = json.loads(model['scores'])
-        model_dict['metadata'] = json.loads(model['metadata'])
-        
-        model_list.append(model_dict)
+    with metrics.phase('select'):
+        rows = c.execute(sql_sentence, args).fetchall()
 
-    if 'format' in request.args and request.args['format'] == 'json':
-        json_list = json.dumps(model_list, indent=4)
+    if json_format:
+        model_list = []
+        for model in rows:
+            model_dict = dict(model)
+            model_dict.pop('display_scores')
+            model_dict.pop('display_date')
+            model_dict['scores'] = json.loads(model['scores'])
+            model_dict['metadata'] = json.loads(model['metadata'])
+            model_list.append(model_dict)
+        with metrics.phase('encode'):
+            json_list = json.dumps(model_list, indent=4)
         return (json_list, {'Content-Type': 'application/json'})
     else:
-        for model in model_list:
-            new_scores = {}
-            for key, value in model['scores'].items():
-                new_scores[key] = "{:.4f}".format(value)
-            model['scores'] = new_scores
-            if model['date'] == None:
-                date_str = "-"
-            else:
-                date = datetime.fromisoformat(str(model['date']))
-                date_str = date.strftime('%d %b. %Y %H:%M')
-            model['date'] = date_str
-        return render_template('list.html', modelcount=len(model_list), modellist=model_list, login=login, user=user)
+        with metrics.phase('render'):
+            model_list = []
+            for model in rows:
+                model_dict = dict(model)
+                if model_dict['display_date'] is None:
+                    # Inserted without going through the app
+                    display_fields(model_dict)
+                model_dict['scores'] = json.loads(model_dict['display_scores'])
+                model_dict['date'] = model_dict['display_date']
+                model_list.append(model_dict)
+            html = render_template('list_items.html', modellist=model_list)
+        with list_cache_lock:
+            list_cache[filters] = (generation, len(model_list), html)
+            list_cache.move_to_end(filters)
+            while len(list_cache) > LIST_CACHE_SIZE:
+                list_cache.popitem(last=False)
+        return render_template('list.html', modelcount=len(model_list), modellist_html=Markup(html), login=login, user=user)
+
+# Every worker imports the app, so every worker pre-warms its own prediction cache
+if server.config['PREDICT_ENABLED'] and server.config['PREDICT_PREWARM'] > 0:
+    threading.Thread(target=prewarm_models, daemon=True, name='prewarm models').start()
 
 
 #if __name__ == '__main__':
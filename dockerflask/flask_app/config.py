@@ -0,0 +1,80 @@
+import os
+
+GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
+GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET')
+
+# SQLite database file. Every worker opens its own connections to it.
+DATABASE = os.getenv('ML_FINGERPRINT_DATABASE', os.path.join(os.getcwd(), 'ml_fingerprint_database.db'))
+# Seconds a connection waits for a lock held by another worker before failing.
+DATABASE_TIMEOUT = float(os.getenv('ML_FINGERPRINT_DATABASE_TIMEOUT', '30'))
+
+# Where the model payloads are stored: 'database' (inline in the models table),
+# 'filesystem' (content-addressed files under STORAGE_PATH) or 's3'.
+STORAGE_BACKEND = os.getenv('ML_FINGERPRINT_STORAGE', 'database')
+STORAGE_PATH = os.getenv('ML_FINGERPRINT_STORAGE_PATH', os.path.join(os.getcwd(), 'model_payloads'))
+# S3-compatible object store (AWS, MinIO...). An endpoint like file:///some/dir
+# uses a local directory instead, which is handy for development and tests.
+S3_ENDPOINT_URL = os.getenv('ML_FINGERPRINT_S3_ENDPOINT')
+S3_BUCKET = os.getenv('ML_FINGERPRINT_S3_BUCKET', 'ml-fingerprint')
+S3_PREFIX = os.getenv('ML_FINGERPRINT_S3_PREFIX', 'models/')
+
+# Opt-in instrumentation (metrics.py): per-route and per-phase timings, query counts
+# and response sizes on /metrics, in the Prometheus text format.
+METRICS_ENABLED = os.getenv('ML_FINGERPRINT_METRICS', 'false').lower() in ('1', 'true', 'yes')
+# Directory where the workers save their metrics so /metrics reports all of them.
+METRICS_DIR = os.getenv('ML_FINGERPRINT_METRICS_DIR')
+# /metrics needs an API key (e.g. in the params of the Prometheus scrape config).
+# Profiling (only with the metrics enabled): a fraction of the requests is profiled
+# with PROFILER ('cprofile' or 'pyinstrument') and, if PROFILE_ON_REQUEST, so is any
+# request with a valid API key and an X-Profile: cprofile|pyinstrument header.
+# Profiles go to PROFILE_DIR, which keeps the last PROFILE_MAX_FILES of them.
+PROFILE_SAMPLE_RATE = float(os.getenv('ML_FINGERPRINT_PROFILE_SAMPLE_RATE', '0'))
+PROFILE_ON_REQUEST = os.getenv('ML_FINGERPRINT_PROFILE_ON_REQUEST', 'false').lower() in ('1', 'true', 'yes')
+PROFILER = os.getenv('ML_FINGERPRINT_PROFILER', 'cprofile')
+PROFILE_DIR = os.getenv('ML_FINGERPRINT_PROFILE_DIR', os.path.join(os.getcwd(), 'profiles'))
+PROFILE_MAX_FILES = int(os.getenv('ML_FINGERPRINT_PROFILE_MAX_FILES', '100'))
+
+# Score and metadata keys indexed for /search (see search.py), comma separated. Other
+# keys can be searched too, but more slowly. Keys are matched as given, in lower case
+# and in upper case. Indexed keys may only have letters, digits, "_", "." and "-".
+SEARCH_SCORES = [key for key in os.getenv('ML_FINGERPRINT_SEARCH_SCORES',
+                                          'accuracy,f1,precision,recall,roc_auc,r2,mse,mae').split(',') if key]
+SEARCH_METADATA = [key for key in os.getenv('ML_FINGERPRINT_SEARCH_METADATA', 'dataset,task').split(',') if key]
+
+# Predictions served by the registry, on POST /model/<name>/predict (see predict.py).
+# Needs ml_fingerprint installed on the server.
+PREDICT_ENABLED = os.getenv('ML_FINGERPRINT_PREDICT', 'false').lower() in ('1', 'true', 'yes')
+# Estimated bytes of verified models kept in memory by every worker, and number of
+# the most requested models every worker loads when it starts.
+PREDICT_CACHE_BYTES = int(os.getenv('ML_FINGERPRINT_PREDICT_CACHE_BYTES', str(512 * 1024 * 1024)))
+PREDICT_PREWARM = int(os.getenv('ML_FINGERPRINT_PREDICT_PREWARM', '8'))
+# Largest batch of rows, and seconds a batch waits for more concurrent requests.
+PREDICT_MAX_BATCH = int(os.getenv('ML_FINGERPRINT_PREDICT_MAX_BATCH', '1024'))
+PREDICT_MAX_DELAY = float(os.getenv('ML_FINGERPRINT_PREDICT_MAX_DELAY', '0.002'))
+PREDICT_TIMEOUT = float(os.getenv('ML_FINGERPRINT_PREDICT_TIMEOUT', '30'))
+# Public keys (PEM files, comma separated) trusted besides those of the 'key' table.
+PREDICT_PUBLIC_KEYS = [path for path in os.getenv('ML_FINGERPRINT_PREDICT_PUBLIC_KEYS', '').split(',') if path]
+# Unpickling 'pickle' and 'pickle5' models runs code chosen by whoever uploaded them.
+PREDICT_TRUST_PICKLE = os.getenv('ML_FINGERPRINT_PREDICT_TRUST_PICKLE', 'false').lower() in ('1', 'true', 'yes')
+
+# Hours the chunks of a delta upload are kept before the model that references them is
+# pushed. Those of pushes never completed are deleted afterwards, by the scrubber and when
+# the server starts.
+CHUNK_GRACE_PERIOD = float(os.getenv('ML_FINGERPRINT_CHUNK_GRACE_PERIOD', '24'))
+
+# Seconds between two writes of the per-model request counters of a worker (see access.py).
+ACCESS_FLUSH_INTERVAL = float(os.getenv('ML_FINGERPRINT_ACCESS_FLUSH_INTERVAL', '10'))
+
+# Limits that keep a single client from taking all the workers (see limits.py).
+# Largest request body in bytes; larger models can be sent with delta uploads.
+MAX_CONTENT_LENGTH = int(os.getenv('ML_FINGERPRINT_MAX_CONTENT_LENGTH', str(256 * 1024 * 1024)))
+# Requests per second of every API key (0 disables the rate limit), and requests it can
+# send at once. With RATE_LIMIT_SHARED the buckets are kept in the database, so the
+# limit holds across all the workers instead of for each of them.
+RATE_LIMIT = float(os.getenv('ML_FINGERPRINT_RATE_LIMIT', '0'))
+RATE_LIMIT_BURST = int(os.getenv('ML_FINGERPRINT_RATE_LIMIT_BURST', '60'))
+RATE_LIMIT_SHARED = os.getenv('ML_FINGERPRINT_RATE_LIMIT_SHARED', 'false').lower() in ('1', 'true', 'yes')
+# Requests of a route handled at the same time by every worker, comma separated, like
+# "manage_model:POST=2,manage_modellist=8". Routes not listed have no cap.
+ROUTE_CONCURRENCY = {name.strip(): int(limit) for name, limit in
+                     (item.split('=') for item in os.getenv('ML_FINGERPRINT_ROUTE_CONCURRENCY', '').split(',') if item)}
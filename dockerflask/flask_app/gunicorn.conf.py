@@ -0,0 +1,22 @@
+# Gunicorn settings for the registry server.
+# Every value can be overridden with an environment variable, so the same image
+# can be run with a single sync worker, several threaded workers or gevent.
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Worker processes. Each one imports the app on its own and opens its own
+# SQLite connections, so nothing is shared between them.
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+
+# 'gthread' runs every worker with a thread pool, so a slow model upload only
+# blocks one thread. Use 'gevent' for many slow clients.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+# Large models take a while to upload, so don't kill workers too early.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
@@ -0,0 +1,265 @@
+'''
+Limits that keep a single client from taking all the workers of the registry.
+
+    - Request size: a body larger than MAX_CONTENT_LENGTH is rejected with 413 as
+      soon as its Content-Length is seen, before it is read, let alone parsed.
+      Bodies sent without a length (chunked transfer) are cut off by Flask when they
+      go over it. Large models still fit with delta uploads, which send the model in
+      requests of about 8 MB.
+    - Rate: every API key has a token bucket of RATE_LIMIT_BURST requests, refilled
+      at RATE_LIMIT requests per second. Requests over it get 429 with Retry-After.
+      The key is read from the api_key argument or the X-API-Key header, never from
+      the body. Requests without a valid key share a bucket per client address.
+      Every worker keeps its own buckets, unless RATE_LIMIT_SHARED keeps them in the
+      rate_limits table for all of them (at the cost of a write per request).
+    - Concurrency: ROUTE_CONCURRENCY caps the requests of a route that a worker
+      handles at the same time, as {endpoint: requests}. The endpoint can end in
+      ":METHOD" to cap only that method ("manage_model:POST" for the uploads).
+      Requests over the cap get 503 with Retry-After right away, instead of holding
+      a thread the other routes need.
+
+The limits are reported in the response headers:
+
+    X-RateLimit-Limit         size of the bucket (burst)
+    X-RateLimit-Remaining     requests left in the bucket
+    X-RateLimit-Reset         seconds until the bucket is full again
+    X-Concurrency-Limit       cap of the route
+    X-Concurrency-Remaining   requests the route can still take
+'''
+import math
+import time
+import sqlite3
+import threading
+from datetime import datetime
+from flask import request, g
+
+SCHEMA = ('''create table if not exists "rate_limits" (
+    "key" TEXT NOT NULL, "tokens" REAL NOT NULL, "updated" REAL NOT NULL, PRIMARY KEY("key")) without rowid''',)
+
+# Routes that are never limited
+EXEMPT_ENDPOINTS = ('static',)
+
+
+def refill(tokens, elapsed, rate, burst):
+    '''
+    Tokens of a bucket that had the given tokens elapsed seconds ago.
+    '''
+    return min(float(burst), tokens + max(0.0, elapsed) * rate)
+
+
+class TokenBuckets():
+    """
+    Token buckets of the clients of a worker.
+
+    Attributes
+    ----------
+    rate : float
+        Tokens added to every bucket per second.
+    burst : int
+        Size of the buckets.
+    max_keys : int
+        Buckets kept before the full ones are dropped (a full bucket is the same as
+        no bucket).
+    """
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        '''
+        Takes a token from the bucket of key.
+
+        Returns
+        -------
+        (bool, float)
+            Whether there was a token, and the tokens left.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self.buckets.get(key, (self.burst, now))
+            tokens = refill(tokens, now - updated, self.rate, self.burst)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self._prune(now)
+        return allowed, tokens
+
+    def _prune(self, now):
+        for key, (tokens, updated) in list(self.buckets.items()):
+            if refill(tokens, now - updated, self.rate, self.burst) >= self.burst:
+                del self.buckets[key]
+
+
+class SQLiteTokenBuckets(TokenBuckets):
+    """
+    Token buckets kept in the rate_limits table, shared by all the workers.
+
+    Attributes
+    ----------
+    get_connection : callable
+        Function that returns the connection of the current request.
+    """
+    def __init__(self, rate, burst, get_connection):
+        super().__init__(rate, burst)
+        self.get_connection = get_connection
+
+    def take(self, key):
+        # Wall clock: the buckets are shared by processes
+        now = time.time()
+        conn = self.get_connection()
+        c = conn.cursor()
+        try:
+            c.execute('begin immediate')
+            row = c.execute('select tokens, updated from rate_limits where key = ?', (key,)).fetchone()
+            tokens = self.burst if row is None else refill(row[0], now - row[1], self.rate, self.burst)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            c.execute('insert or replace into rate_limits (key, tokens, updated) values (?, ?, ?)', (key, tokens, now))
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            # A busy database must not take the whole registry down: let the request in
+            print("Couldn't update the rate limit of " + key + ": " + str(e))
+            return True, float(self.burst)
+        return allowed, tokens
+
+
+class ConcurrencyLimits():
+    """
+    Caps on the requests of every route handled at the same time by a worker.
+
+    Attributes
+    ----------
+    limits : dict
+        {endpoint or "endpoint:METHOD": maximum concurrent requests}.
+    """
+    def __init__(self, limits):
+        self.limits = dict(limits)
+        self.active = {name: 0 for name in self.limits}
+        self._lock = threading.Lock()
+
+    def name(self, endpoint, method):
+        '''
+        Returns the name of the cap of a request, None if it has none.
+        '''
+        for name in (endpoint + ':' + method, endpoint):
+            if name in self.limits:
+                return name
+        return None
+
+    def acquire(self, name):
+        '''
+        Takes a slot of a cap. Returns False if all of them are in use.
+        '''
+        with self._lock:
+            if self.active[name] >= self.limits[name]:
+                return False
+            self.active[name] += 1
+            return True
+
+    def release(self, name):
+        with self._lock:
+            self.active[name] -= 1
+
+    def remaining(self, name):
+        return max(0, self.limits[name] - self.active[name])
+
+
+def client_key(get_connection):
+    '''
+    Returns the rate limit key of the current request: its API key if it's valid,
+    or its address.
+    '''
+    api_key = request.args.get('api_key') or request.headers.get('X-API-Key')
+    if api_key:
+        # Only valid keys get their own bucket, so making up keys doesn't get more requests
+        row = get_connection().execute('select 1 from api_keys where key = ? and expire_date >= ?',
+                                        (api_key, datetime.now().isoformat())).fetchone()
+        if row is not None:
+            return 'key:' + api_key
+    return 'addr:' + str(request.remote_addr)
+
+
+def init_app(server, get_connection):
+    '''
+    Registers the request hooks that enforce the limits.
+
+    Parameters
+    ----------
+    server : flask.Flask
+        The app. Flask itself enforces MAX_CONTENT_LENGTH on the bodies it reads.
+    get_connection : callable
+        Function that returns the database connection of the current request.
+
+    Configuration (server.config)
+    -----------------------------
+    MAX_CONTENT_LENGTH : int or None
+        Largest request body, in bytes.
+    RATE_LIMIT : float
+        Requests per second of every client (0 disables the rate limit).
+    RATE_LIMIT_BURST : int
+        Requests a client can send at once.
+    RATE_LIMIT_SHARED : bool
+        If True, the buckets are kept in the database and shared by the workers.
+    ROUTE_CONCURRENCY : dict
+        See ConcurrencyLimits.
+    '''
+    config = server.config
+    buckets = None
+    if config.get('RATE_LIMIT', 0) > 0:
+        if config.get('RATE_LIMIT_SHARED'):
+            buckets = SQLiteTokenBuckets(config['RATE_LIMIT'], config['RATE_LIMIT_BURST'], get_connection)
+        else:
+            buckets = TokenBuckets(config['RATE_LIMIT'], config['RATE_LIMIT_BURST'])
+    # Read by the hooks on every request, so they can be replaced
+    server.extensions['limits'] = {'buckets': buckets, 'concurrency': ConcurrencyLimits(config.get('ROUTE_CONCURRENCY') or {})}
+
+    @server.before_request
+    def check_limits():
+        if request.endpoint in EXEMPT_ENDPOINTS or request.endpoint is None:
+            return None
+        max_length = config.get('MAX_CONTENT_LENGTH')
+        if max_length is not None and request.content_length is not None and request.content_length > max_length:
+            return "The request body is larger than %d bytes." % max_length, 413
+
+        buckets = server.extensions['limits']['buckets']
+        if buckets is not None:
+            allowed, tokens = buckets.take(client_key(get_connection))
+            g.rate_limit = (buckets, tokens)
+            if not allowed:
+                retry_after = math.ceil((1 - tokens) / buckets.rate)
+                return "Too many requests.", 429, {'Retry-After': str(retry_after)}
+
+        concurrency = server.extensions['limits']['concurrency']
+        name = concurrency.name(request.endpoint, request.method)
+        if name is not None:
+            if not concurrency.acquire(name):
+                g.concurrency = (concurrency, name, False)
+                return "Too many concurrent requests to this route.", 503, {'Retry-After': '1'}
+            g.concurrency = (concurrency, name, True)
+        return None
+
+    @server.after_request
+    def add_limit_headers(response):
+        if 'rate_limit' in g:
+            limiter, tokens = g.rate_limit
+            response.headers['X-RateLimit-Limit'] = str(limiter.burst)
+            response.headers['X-RateLimit-Remaining'] = str(int(tokens))
+            response.headers['X-RateLimit-Reset'] = str(math.ceil((limiter.burst - tokens) / limiter.rate))
+        if 'concurrency' in g:
+            concurrency, name = g.concurrency[:2]
+            response.headers['X-Concurrency-Limit'] = str(concurrency.limits[name])
+            response.headers['X-Concurrency-Remaining'] = str(concurrency.remaining(name))
+        return response
+
+    @server.teardown_request
+    def release_slot(exception):
+        concurrency, name, acquired = g.pop('concurrency', (None, None, False))
+        if acquired:
+            concurrency.release(name)
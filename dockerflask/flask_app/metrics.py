@@ -0,0 +1,472 @@
+'''
+Opt-in instrumentation of the registry: per-route and per-phase timings, SQL
+query counts and durations and response sizes, exposed on /metrics in the
+Prometheus text format, plus optional profiling of sampled requests.
+
+Everything is disabled unless init_app() is called (see METRICS_ENABLED in
+config.py); phase() is then a no-op, so the routes can be instrumented
+unconditionally.
+
+/metrics and profiling on request need a valid API key (the api_key argument or
+the X-API-Key header), so only the users of the registry can read the numbers or
+make the server write profiles.
+
+Every gunicorn worker keeps its own numbers. If METRICS_DIR is set, each worker
+also saves them there (at most once per second) and /metrics adds up the files
+of all workers, so a scrape sees the whole server and not only the worker that
+happened to serve it. The files of workers that exited (restarted by gunicorn after
+max_requests, a crash or a HUP) are removed then, so their numbers are dropped.
+'''
+import os
+import io
+import json
+import time
+import random
+import itertools
+import sqlite3
+import tempfile
+import threading
+import contextlib
+from flask import g, request, has_request_context
+
+# Upper bounds (seconds) of the buckets of the duration histograms
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds (bytes) of the buckets of the response size histogram
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+HELP = {
+    'mlfp_requests_total': ('counter', "Requests served, by route, method and status."),
+    'mlfp_request_duration_seconds': ('histogram', "Time spent serving requests, by route and method."),
+    'mlfp_phase_duration_seconds': ('histogram', "Time spent in each phase of a request, by route and phase."),
+    'mlfp_db_queries_total': ('counter', "SQL statements executed, by route."),
+    'mlfp_db_query_duration_seconds': ('histogram', "Time spent in each SQL statement (including fetching its rows), by route."),
+    'mlfp_response_size_bytes': ('histogram', "Size of the response bodies, by route."),
+}
+
+_enabled = False
+# Numbers the profiles of this process, so two in the same second don't overwrite each other
+_profile_ids = itertools.count()
+
+
+class Registry():
+    """
+    Counters and histograms of one process, keyed by metric name and label values.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets=DURATION_BUCKETS):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            entry = series.get(key)
+            if entry is None:
+                entry = series[key] = {'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(entry['buckets']):
+                if value <= bound:
+                    entry['counts'][i] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def snapshot(self):
+        '''
+        Returns the metrics as a JSON-compatible dict.
+        '''
+        with self.lock:
+            return {'counters': {name: [[list(map(list, key)), value] for key, value in series.items()]
+                                 for name, series in self.counters.items()},
+                    'histograms': {name: [[list(map(list, key)), dict(entry, counts=list(entry['counts']))] for key, entry in series.items()]
+                                   for name, series in self.histograms.items()}}
+
+
+def merge(snapshots):
+    '''
+    Adds up several snapshots (of different workers) into one.
+    '''
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, series in snapshot['counters'].items():
+            merged = counters.setdefault(name, {})
+            for key, value in series:
+                key = tuple(map(tuple, key))
+                merged[key] = merged.get(key, 0) + value
+        for name, series in snapshot['histograms'].items():
+            merged = histograms.setdefault(name, {})
+            for key, entry in series:
+                key = tuple(map(tuple, key))
+                if key not in merged:
+                    merged[key] = dict(entry, counts=list(entry['counts']))
+                else:
+                    total = merged[key]
+                    total['counts'] = [a + b for a, b in zip(total['counts'], entry['counts'])]
+                    total['sum'] += entry['sum']
+                    total['count'] += entry['count']
+    return counters, histograms
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, _escape(v)) for k, v in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(counters, histograms):
+    '''
+    Writes merged metrics in the Prometheus text exposition format.
+    '''
+    out = io.StringIO()
+    for name in sorted(set(counters) | set(histograms)):
+        kind, text = HELP.get(name, ('counter' if name in counters else 'histogram', name))
+        out.write('# HELP %s %s\n# TYPE %s %s\n' % (name, text, name, kind))
+        if name in counters:
+            for key, value in sorted(counters[name].items()):
+                out.write('%s%s %s\n' % (name, _labels(key), _number(value)))
+        else:
+            for key, entry in sorted(histograms[name].items()):
+                for bound, count in zip(entry['buckets'], entry['counts']):
+                    out.write('%s_bucket%s %d\n' % (name, _labels(key, [('le', _number(float(bound)))]), count))
+                out.write('%s_bucket%s %d\n' % (name, _labels(key, [('le', '+Inf')]), entry['count']))
+                out.write('%s_sum%s %s\n' % (name, _labels(key), repr(float(entry['sum']))))
+                out.write('%s_count%s %d\n' % (name, _labels(key), entry['count']))
+    return out.getvalue()
+
+
+registry = Registry()
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+@contextlib.contextmanager
+def phase(name):
+    '''
+    Times a phase of the current request (auth, payload, encode, render...).
+    Does nothing if the metrics are disabled or there is no request.
+    '''
+    if not _enabled or not has_request_context():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe('mlfp_phase_duration_seconds', {'route': _route(), 'phase': name}, time.perf_counter() - start)
+
+
+def _record_query(elapsed):
+    if has_request_context():
+        g.metrics_db_queries = g.get('metrics_db_queries', 0) + 1
+        g.metrics_db_seconds = g.get('metrics_db_seconds', 0.0) + elapsed
+        route = _route()
+    else:
+        route = 'background'
+    registry.inc('mlfp_db_queries_total', {'route': route})
+    registry.observe('mlfp_db_query_duration_seconds', {'route': route}, elapsed)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    Cursor that records the time of every statement, from its execution
+    until its last row is fetched.
+    """
+    def execute(self, *args, **kwargs):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            self._query_time = time.perf_counter() - start
+            self._pending = True
+            if self.description is None:
+                self._finish()
+
+    def executemany(self, *args, **kwargs):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            self._query_time = time.perf_counter() - start
+            self._pending = True
+            self._finish()
+
+    def _finish(self, extra=0.0):
+        if getattr(self, '_pending', False):
+            self._pending = False
+            _record_query(self._query_time + extra)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._query_time += time.perf_counter() - start
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._finish(time.perf_counter() - start)
+        return rows
+
+    def fetchmany(self, *args, **kwargs):
+        start = time.perf_counter()
+        rows = super().fetchmany(*args, **kwargs)
+        self._query_time += time.perf_counter() - start
+        if not rows:
+            self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # Statements whose rows were only partly fetched (e.g. a single fetchone())
+        self._finish()
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    Connection whose cursors are TimedCursors, used when the metrics are enabled.
+    """
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args, **kwargs):
+        return self.cursor().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self.cursor().executemany(*args, **kwargs)
+
+
+def connection_factory():
+    '''
+    Returns the connection class get_db_connection() must use.
+    '''
+    return TimedConnection if _enabled else sqlite3.Connection
+
+
+class _Profiler():
+    """
+    Profiles one request with cProfile or, if installed and requested, pyinstrument.
+    """
+    def __init__(self, kind):
+        self.kind = kind
+        if kind == 'pyinstrument':
+            try:
+                import pyinstrument
+                self.profiler = pyinstrument.Profiler()
+            except ImportError:
+                self.kind = 'cprofile'
+        if self.kind == 'cprofile':
+            import cProfile
+            self.profiler = cProfile.Profile()
+
+    def start(self):
+        if self.kind == 'pyinstrument':
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self, directory, route, max_files=None):
+        '''
+        Stops profiling and saves the result to a file in directory. Returns its path.
+        If there are more than max_files profiles in directory, the oldest are removed.
+        '''
+        os.makedirs(directory, exist_ok=True)
+        name = '%s-%d-%d-%s' % (time.strftime('%Y%m%d-%H%M%S'), os.getpid(), next(_profile_ids), route.strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'root')
+        if self.kind == 'pyinstrument':
+            self.profiler.stop()
+            path = os.path.join(directory, name + '.html')
+            with open(path, 'w') as f:
+                f.write(self.profiler.output_html())
+        else:
+            self.profiler.disable()
+            path = os.path.join(directory, name + '.prof')
+            self.profiler.dump_stats(path)
+        if max_files is not None:
+            prune_profiles(directory, max_files)
+        return path
+
+
+def prune_profiles(directory, max_files):
+    '''
+    Removes the oldest profiles of directory until there are max_files left.
+    '''
+    profiles = []
+    for filename in os.listdir(directory):
+        if filename.endswith(('.prof', '.html')):
+            path = os.path.join(directory, filename)
+            try:
+                profiles.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+    profiles.sort()
+    for _, path in profiles[:max(0, len(profiles) - max_files)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to another user
+        pass
+    return True
+
+
+def load_snapshots(directory):
+    '''
+    Returns the snapshots saved in directory by the workers still running, and removes
+    those of the workers that exited.
+    '''
+    snapshots = []
+    for filename in os.listdir(directory):
+        if not (filename.startswith('worker-') and filename.endswith('.json')):
+            continue
+        path = os.path.join(directory, filename)
+        pid = filename[len('worker-'):-len('.json')]
+        if pid.isdigit() and not _process_alive(int(pid)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            pass
+    return snapshots
+
+
+def request_api_key():
+    '''
+    Returns the API key of the current request (api_key argument or X-API-Key header), if any.
+    '''
+    return request.args.get('api_key') or request.headers.get('X-API-Key')
+
+
+def init_app(server, valid_api_key):
+    '''
+    Enables the metrics for the app: registers the request hooks and the /metrics route.
+
+    Parameters
+    ----------
+    server : flask.Flask
+        The app.
+    valid_api_key : callable
+        Function that takes an API key and returns whether it is valid. Needed to read
+        /metrics and to profile a request on demand.
+
+    Configuration (server.config)
+    -----------------------------
+    METRICS_DIR : str or None
+        Directory shared by the workers to add up their metrics.
+    PROFILE_DIR : str
+        Where the profiles are saved.
+    PROFILE_SAMPLE_RATE : float
+        Fraction of the requests that are profiled (0 disables sampling).
+    PROFILE_ON_REQUEST : bool
+        If True, a request with a valid API key and the X-Profile header (or a 'profile'
+        argument) set to 'cprofile' or 'pyinstrument' is profiled. The name of the profile
+        file (in PROFILE_DIR) is returned in the X-Profile-File header.
+    PROFILE_MAX_FILES : int or None
+        Profiles kept in PROFILE_DIR; the oldest are removed.
+    '''
+    global _enabled
+    _enabled = True
+    config = server.config
+    metrics_dir = config.get('METRICS_DIR')
+    state = {'last_save': 0.0}
+    save_lock = threading.Lock()
+
+    def save_snapshot(force=False):
+        if not metrics_dir:
+            return
+        now = time.time()
+        with save_lock:
+            if not force and now - state['last_save'] < 1.0:
+                return
+            state['last_save'] = now
+            os.makedirs(metrics_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=metrics_dir, prefix='.tmp-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(registry.snapshot(), f)
+            os.replace(tmp_path, os.path.join(metrics_dir, 'worker-%d.json' % os.getpid()))
+
+    @server.before_request
+    def start_request():
+        g.metrics_start = time.perf_counter()
+        kind = None
+        if config.get('PROFILE_ON_REQUEST'):
+            kind = request.headers.get('X-Profile') or request.args.get('profile')
+            if kind is not None and not (request_api_key() and valid_api_key(request_api_key())):
+                kind = None
+        if kind is None and config.get('PROFILE_SAMPLE_RATE', 0) > random.random():
+            kind = config.get('PROFILER', 'cprofile')
+        if kind in ('cprofile', 'pyinstrument'):
+            g.metrics_profiler = _Profiler(kind)
+            g.metrics_profiler.start()
+
+    @server.after_request
+    def end_request(response):
+        route = _route()
+        profiler = g.pop('metrics_profiler', None)
+        if profiler is not None:
+            path = profiler.stop(config.get('PROFILE_DIR', 'profiles'), route, config.get('PROFILE_MAX_FILES'))
+            # Only the name: the layout of the server is nobody's business
+            response.headers['X-Profile-File'] = os.path.basename(path)
+        elapsed = time.perf_counter() - g.get('metrics_start', time.perf_counter())
+        labels = {'route': route, 'method': request.method}
+        registry.inc('mlfp_requests_total', dict(labels, status=str(response.status_code)))
+        registry.observe('mlfp_request_duration_seconds', labels, elapsed)
+        if 'metrics_db_seconds' in g:
+            registry.observe('mlfp_phase_duration_seconds', {'route': route, 'phase': 'db'}, g.metrics_db_seconds)
+        if not response.is_streamed:
+            registry.observe('mlfp_response_size_bytes', {'route': route}, response.calculate_content_length() or 0, SIZE_BUCKETS)
+        response.headers['Server-Timing'] = 'total;dur=%.2f' % (elapsed * 1000)
+        save_snapshot()
+        return response
+
+    @server.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        if not request_api_key():
+            return "No API key provided.", 403
+        if not valid_api_key(request_api_key()):
+            return "API key invalid", 403
+        if metrics_dir:
+            save_snapshot(force=True)
+            snapshots = load_snapshots(metrics_dir)
+        else:
+            snapshots = [registry.snapshot()]
+        counters, histograms = merge(snapshots)
+        return render(counters, histograms), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
@@ -0,0 +1,178 @@
+'''
+Predictions served by the registry itself (POST /model/<name>/predict), so clients
+that only need predictions don't download and deserialize the whole model.
+
+Opt-in with PREDICT_ENABLED (config.py). Every worker keeps the verified estimators
+it uses in a ml_fingerprint.serving.ModelPool, least recently used out first once
+their estimated size (ml_fingerprint.serving.estimate_nbytes()) is over
+PREDICT_CACHE_BYTES. They are keyed by the digest of their payload, so a model that
+is updated is never served from the cache. At startup, every worker loads the
+PREDICT_PREWARM models requested the most (see access.py).
+Concurrent requests to the same model are coalesced into one predict() call of up
+to PREDICT_MAX_BATCH rows, waiting at most PREDICT_MAX_DELAY seconds for more.
+
+Models are verified with the public keys of the 'key' table and PREDICT_PUBLIC_KEYS
+before they are used, and unsigned models are refused. 'manifest' models are verified
+before anything is built from them. Like the scrubber, the server only unpickles
+'pickle' and 'pickle5' models with PREDICT_TRUST_PICKLE.
+
+The rows are sent in one of these formats, and the result comes back in the same one:
+
+    application/json                      {"instances": [[...], ...]}, with an optional
+                                          "columns": [...] to make a pandas DataFrame
+    application/x-npy                     a 2-D array saved with numpy.save()
+    application/vnd.apache.arrow.stream   an Arrow IPC stream (needs pyarrow)
+
+This needs ml_fingerprint (and so numpy and scikit-learn) installed on the server.
+'''
+import io
+import json
+import threading
+
+METHODS = ('predict', 'predict_proba', 'predict_log_proba', 'decision_function', 'transform', 'score_samples')
+JSON = 'application/json'
+NPY = 'application/x-npy'
+ARROW = 'application/vnd.apache.arrow.stream'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class RequestError(ValueError):
+    '''
+    Raised when the rows of a request can't be read.
+    '''
+
+
+class DatabaseRegistry():
+    """
+    Source of the models of a ModelPool that reads them from the registry database
+    instead of the API. Versions are the cache keys of the models (the digests of
+    their payloads).
+
+    Attributes
+    ----------
+    read_payload : callable
+        Function that takes a cache key and returns the payload (bytes) and serializer.
+    trust_pickle : bool
+        If False, only 'manifest' models are loaded.
+    """
+    def __init__(self, read_payload, trust_pickle=False):
+        self.read_payload = read_payload
+        self.trust_pickle = trust_pickle
+
+    def get_model(self, modelname, public_key, version=None):
+        from ml_fingerprint import ml_fingerprint, remote, manifest, exceptions
+        data, serializer_bytes = self.read_payload(version)
+        if serializer_bytes == 'manifest':
+            # Verified over the manifest and its buffers before any object is built
+            lazy_model = manifest.loads(data)
+            if not lazy_model.is_signed():
+                raise exceptions.ModelNotSigned("Model %s isn't signed." % modelname)
+            ml_fingerprint.verify_attributes(lazy_model.attributes, public_key)
+            return lazy_model.load()
+        if not self.trust_pickle:
+            raise exceptions.UnsupportedModel("Only 'manifest' models can be served (the model is in '%s')." % serializer_bytes)
+        model = remote.deserialize_model(data, serializer_bytes)
+        ml_fingerprint.verify_attributes(model.__dict__, public_key)
+        return model
+
+
+def get_pool(settings, read_payload, public_keys):
+    '''
+    Returns the ModelPool of this worker, creating it the first time.
+
+    Parameters
+    ----------
+    settings : dict
+        The configuration of the app.
+    read_payload : callable
+        See DatabaseRegistry.
+    public_keys : callable
+        Function that returns the trusted public keys (PEM).
+    '''
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from ml_fingerprint import keyring, serving, ml_fingerprint
+                ml_fingerprint.decorate_base_estimator()
+                registry = DatabaseRegistry(read_payload, settings['PREDICT_TRUST_PICKLE'])
+                _pool = serving.ModelPool(registry, keyring.Keyring(public_keys()),
+                                          max_batch_size=settings['PREDICT_MAX_BATCH'],
+                                          max_delay=settings['PREDICT_MAX_DELAY'],
+                                          max_bytes=settings['PREDICT_CACHE_BYTES'])
+    return _pool
+
+
+def read_rows(body, content_type):
+    '''
+    Reads the rows of a request.
+
+    Returns
+    -------
+    (numpy.ndarray or pandas.DataFrame, str)
+        The rows and the format they came in.
+
+    Raises
+    ------
+    RequestError
+        If the body can't be read in the given format.
+    '''
+    import numpy as np
+    content_type = (content_type or JSON).split(';')[0].strip()
+    try:
+        if content_type == NPY:
+            X = np.load(io.BytesIO(body), allow_pickle=False)
+        elif content_type == ARROW:
+            try:
+                import pyarrow
+            except ImportError:
+                raise RequestError("Arrow requests are not supported by this server (pyarrow is not installed).")
+            X = pyarrow.ipc.open_stream(body).read_all().to_pandas()
+        elif content_type == JSON:
+            data = json.loads(body)
+            instances = data['instances'] if isinstance(data, dict) else data
+            if isinstance(data, dict) and data.get('columns') is not None:
+                import pandas
+                X = pandas.DataFrame(instances, columns=data['columns'])
+            else:
+                X = np.asarray(instances)
+        else:
+            raise RequestError("Unsupported content type: " + content_type)
+    except RequestError:
+        raise
+    except Exception as e:
+        raise RequestError("Couldn't read the rows: " + str(e))
+    if X.ndim != 2 or len(X) == 0:
+        raise RequestError("The rows must be a non-empty 2-D array.")
+    return X, content_type
+
+
+def encode_result(result, content_type):
+    '''
+    Encodes the result of a prediction in the format of the request.
+
+    Returns
+    -------
+    (bytes or str, str)
+        The body and its content type.
+    '''
+    import numpy as np
+    result = np.asarray(result)
+    if content_type == NPY:
+        buffer = io.BytesIO()
+        np.save(buffer, result, allow_pickle=False)
+        return buffer.getvalue(), NPY
+    if content_type == ARROW:
+        import pyarrow
+        if result.ndim == 1:
+            columns = {'prediction': result}
+        else:
+            columns = {'prediction_%d' % i: result[:, i] for i in range(result.shape[1])}
+        table = pyarrow.table(columns)
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), ARROW
+    return json.dumps({'predictions': result.tolist()}), JSON
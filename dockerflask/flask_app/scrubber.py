@@ -0,0 +1,406 @@
+'''
+Background scrubber of the registry: re-checks the stored models so corruption or
+tampering is found before a client's verify() fails.
+
+It walks the models table in small batches and, for every model:
+
+    1. reads its payload (inline, from the storage backend or from its chunks) and
+       hashes it again: against payload_digest, the digest of every chunk, or, for
+       payloads kept inline, the digest recorded the first time the model was checked;
+    2. verifies its signature in a pool of processes, with the public keys of the
+       'key' table and those given with --public-key;
+    3. records the outcome in the scrub_results table.
+
+Every time it runs out of models to check, it also deletes the chunks of delta uploads
+that no model references and that were last uploaded more than --chunk-grace-period
+hours ago: those of pushes that were never completed (see sweep_chunks()).
+
+Models that were never checked go first (in id order, from a cursor saved in the
+scrub_state table, so a restarted scrubber resumes where it stopped), then those
+checked more than --stale-after hours ago, oldest first. Reads are rate limited
+(--max-bytes-per-second, --max-models-per-second) and every batch is written in one
+short transaction, so the impact on the serving workers stays bounded.
+
+Signatures are verified with ml_fingerprint, which the server itself doesn't need:
+without it only the digests are checked. Models in 'pickle' or 'pickle5' format can
+only be verified by unpickling them, which runs code chosen by whoever uploaded them,
+so they are only verified with --trust-pickle. 'manifest' models are verified without
+building any object.
+
+Example
+-------
+    python scrubber.py --public-key signing_key.pub --processes 2
+'''
+import sys
+import time
+import base64
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import config
+import storage as payload_storage
+
+SCHEMA = ('''create table if not exists "scrub_results" (
+    "model_id" INTEGER NOT NULL, "checked_at" TEXT, "status" TEXT, "payload_digest" TEXT,
+    "detail" TEXT, PRIMARY KEY("model_id"))''',
+          'create index if not exists scrub_results_checked_at on scrub_results (checked_at)',
+          'create index if not exists scrub_results_status on scrub_results (status)',
+          'create table if not exists "scrub_state" ("name" TEXT NOT NULL, "value" TEXT, PRIMARY KEY("name"))',
+          # Last time every chunk was sent to /chunks, written by app.upload_chunks()
+          'create table if not exists "chunk_uploads" ("digest" TEXT NOT NULL, "uploaded" TEXT, PRIMARY KEY("digest"))',
+          'create index if not exists chunk_uploads_uploaded on chunk_uploads (uploaded)')
+
+# Outcomes recorded in scrub_results.status
+OK = 'ok'                          # payload intact and signature valid
+CORRUPT = 'corrupt'                # payload missing or not matching its digest
+INVALID = 'invalid_signature'      # payload intact but its signature is not valid
+UNSIGNED = 'unsigned'
+UNKNOWN_KEY = 'unknown_key'        # signed with a key the scrubber doesn't have
+UNVERIFIED = 'unverified'          # payload intact, signature not checked (see the module docstring)
+ERROR = 'error'                    # the payload couldn't be decoded
+
+_keyring = None
+_trust_pickle = False
+
+
+def _init_worker(public_keys, trust_pickle):
+    global _keyring, _trust_pickle
+    from ml_fingerprint import keyring
+    _keyring = keyring.Keyring(public_keys)
+    _trust_pickle = trust_pickle
+
+
+def verify_payload(data, serializer_bytes):
+    '''
+    Runs in the worker processes. Verifies the signature of a serialized model.
+
+    Returns
+    -------
+    (str, str or None)
+        Status and details.
+    '''
+    from ml_fingerprint import ml_fingerprint, manifest, exceptions
+    try:
+        if serializer_bytes == 'manifest':
+            attributes = manifest.loads(data).attributes
+        elif serializer_bytes in ('pickle', 'pickle5'):
+            if not _trust_pickle:
+                return UNVERIFIED, "Pickled models are only verified with --trust-pickle"
+            from ml_fingerprint import remote
+            attributes = remote.deserialize_model(data, serializer_bytes).__dict__
+        else:
+            return ERROR, "Unknown serializer: " + str(serializer_bytes)
+        serialized_model, fingerprint_data = ml_fingerprint._signed_message(attributes)
+        kid = fingerprint_data.get('key_id')
+        if kid is not None and kid not in _keyring:
+            return UNKNOWN_KEY, kid
+        ml_fingerprint._check_signature(serialized_model, fingerprint_data, _keyring)
+        return OK, None
+    except exceptions.ModelNotSigned:
+        return UNSIGNED, None
+    except exceptions.VerificationError as e:
+        return INVALID, str(e)
+    except Exception as e:
+        return ERROR, type(e).__name__ + ": " + str(e)
+
+
+def sweep_chunks(conn, chunk_storage, grace_period):
+    '''
+    Deletes from chunk_storage the chunks uploaded more than grace_period ago that no
+    model references. A delta push uploads its chunks before the model that references
+    them, so the chunks of a push that is never completed would otherwise be kept forever.
+    Chunks that were referenced since they were uploaded are left to release_chunk_list(),
+    only their upload record is removed.
+
+    Returns
+    -------
+    int
+        Number of chunks deleted.
+    '''
+    before = (datetime.now() - grace_period).isoformat()
+    deleted = 0
+    c = conn.cursor()
+    c.execute('begin immediate')
+    try:
+        digests = [row[0] for row in c.execute('select digest from chunk_uploads where uploaded < ?', (before,)).fetchall()]
+        for digest in digests:
+            # The chunks share the storage backend with the whole payloads, if there is one
+            referenced = (c.execute('select 1 from model_chunks where digest = ?', (digest,)).fetchone() is not None or
+                          c.execute('select 1 from models where payload_digest = ?', (digest,)).fetchone() is not None)
+            if not referenced:
+                chunk_storage.delete(digest)
+                deleted += 1
+            c.execute('delete from chunk_uploads where digest = ?', (digest,))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return deleted
+
+
+class RateLimiter():
+    """
+    Spreads the work so that, on average, no more than bytes_per_second bytes
+    and items_per_second items are processed per second.
+    """
+    def __init__(self, bytes_per_second=None, items_per_second=None):
+        self.bytes_per_second = bytes_per_second
+        self.items_per_second = items_per_second
+        self.next_time = time.monotonic()
+
+    def wait(self, n_bytes, n_items):
+        '''
+        Accounts for n_bytes and n_items just processed, sleeping if the limits were exceeded.
+        '''
+        cost = 0.0
+        if self.bytes_per_second:
+            cost = max(cost, n_bytes / self.bytes_per_second)
+        if self.items_per_second:
+            cost = max(cost, n_items / self.items_per_second)
+        now = time.monotonic()
+        self.next_time = max(self.next_time, now) + cost
+        if self.next_time > now:
+            time.sleep(self.next_time - now)
+
+
+class Scrubber():
+    """
+    Checks the models of a registry database in batches.
+
+    Attributes
+    ----------
+    database : str
+        Path of the SQLite database of the registry.
+    storage : storage.Storage or None
+        Backend of the payloads (None if they are kept inline).
+    chunk_storage : storage.Storage
+        Backend of the chunks of delta uploads.
+    executor : concurrent.futures.Executor or None
+        Pool that verifies the signatures. If None, only the digests are checked.
+    batch_size : int
+        Models checked per batch.
+    stale_after : datetime.timedelta
+        Age after which a checked model is checked again.
+    chunk_grace_period : datetime.timedelta
+        Age after which the chunks no model references are deleted (see sweep_chunks()).
+    """
+    def __init__(self, database, storage=None, executor=None, batch_size=32, stale_after=timedelta(days=7),
+                 rate_limiter=None, timeout=30.0, chunk_grace_period=timedelta(days=1)):
+        self.database = database
+        self.conn = sqlite3.connect(database, timeout=timeout)
+        self.conn.row_factory = sqlite3.Row
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+        self.storage = storage
+        self.chunk_storage = storage if storage is not None else payload_storage.SQLiteStorage(lambda: self.conn)
+        self.executor = executor
+        self.batch_size = batch_size
+        self.stale_after = stale_after
+        self.chunk_grace_period = chunk_grace_period
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.rescanned = False
+
+    def get_cursor(self):
+        row = self.conn.execute("select value from scrub_state where name = 'cursor'").fetchone()
+        return int(row['value']) if row is not None else 0
+
+    def next_batch(self):
+        '''
+        Returns the next models to check: never checked ones after the cursor, or else the
+        stalest ones. Returns an empty list when there is nothing to do.
+        '''
+        columns = 'm.id, m.serialized_model, m.serializer_bytes, m.serializer_text, m.payload_digest'
+        unchecked = ('select ' + columns + ' from models m where m.id > ? and not exists '
+                     '(select 1 from scrub_results r where r.model_id = m.id) order by m.id limit ?')
+        cursor = self.get_cursor()
+        rows = self.conn.execute(unchecked, (cursor, self.batch_size)).fetchall()
+        if not rows and cursor > 0 and not self.rescanned:
+            # End of the pass: look once from the beginning, for ids reused below the cursor
+            # (new models normally get higher ids, and are found after the cursor)
+            rows = self.conn.execute(unchecked, (0, self.batch_size)).fetchall()
+            self.rescanned = not rows
+        if rows:
+            return rows
+        stale = (datetime.now() - self.stale_after).isoformat()
+        return self.conn.execute('select ' + columns + ', r.payload_digest as checked_digest from scrub_results r '
+                                 'join models m on m.id = r.model_id where r.checked_at < ? '
+                                 'order by r.checked_at limit ?', (stale, self.batch_size)).fetchall()
+
+    def read_payload(self, row):
+        '''
+        Reads the payload of a model and checks it against its digests.
+
+        Returns
+        -------
+        (bytes or None, str, str or None)
+            The payload (None if it is corrupt), its digest and the reason it is corrupt.
+        '''
+        if row['payload_digest']:
+            try:
+                data = self.storage.get(row['payload_digest'])
+            except KeyError:
+                return None, None, "Payload missing from the storage backend"
+            digest = payload_storage.payload_digest(data)
+            if digest != row['payload_digest']:
+                return None, digest, "Payload doesn't match its digest"
+            return data, digest, None
+        if row['serialized_model'] is None:
+            pieces = []
+            chunks = self.conn.execute('select digest, size from model_chunks where model_id = ? order by position',
+                                       (row['id'],)).fetchall()
+            if not chunks:
+                return None, None, "The model has no payload"
+            for chunk in chunks:
+                try:
+                    data = self.chunk_storage.get(chunk['digest'])
+                except KeyError:
+                    return None, None, "Chunk missing: " + chunk['digest']
+                if len(data) != chunk['size'] or payload_storage.payload_digest(data) != chunk['digest']:
+                    return None, None, "Chunk doesn't match its digest: " + chunk['digest']
+                pieces.append(data)
+            data = b''.join(pieces)
+            return data, payload_storage.payload_digest(data), None
+        serialized_model = row['serialized_model']
+        if isinstance(serialized_model, str):
+            serialized_model = serialized_model.encode('utf-8')
+        try:
+            data = base64.b64decode(serialized_model, validate=True) if row['serializer_text'] == 'base64' else bytes(serialized_model)
+        except ValueError:
+            return None, None, "The inline payload is not valid base64"
+        digest = payload_storage.payload_digest(data)
+        # Inline payloads have no digest of their own: they are compared with the one seen
+        # the last time (updates of a model remove its previous result, see app.update_model())
+        if 'checked_digest' in row.keys() and row['checked_digest'] is not None and row['checked_digest'] != digest:
+            # The digest seen before is kept, so it is reported again until the model is replaced
+            return None, row['checked_digest'], "Inline payload changed since it was last checked"
+        return data, digest, None
+
+    def run_batch(self):
+        '''
+        Checks the next batch of models and records the results.
+
+        Returns
+        -------
+        int
+            Number of models checked (0 if there was nothing to do).
+        '''
+        rows = self.next_batch()
+        self.conn.commit()
+        if not rows:
+            return 0
+        results = {}
+        pending = []
+        n_bytes = 0
+        for row in rows:
+            data, digest, problem = self.read_payload(row)
+            if problem is not None:
+                results[row['id']] = (CORRUPT, digest, problem)
+            elif self.executor is None:
+                results[row['id']] = (UNVERIFIED, digest, "Signatures are not verified (ml_fingerprint not available)")
+            else:
+                n_bytes += len(data)
+                pending.append((row['id'], digest, self.executor.submit(verify_payload, data, row['serializer_bytes'])))
+        for model_id, digest, future in pending:
+            status, detail = future.result()
+            results[model_id] = (status, digest, detail)
+
+        now = datetime.now().isoformat()
+        c = self.conn.cursor()
+        c.execute('begin immediate')
+        c.executemany('insert into scrub_results (model_id, checked_at, status, payload_digest, detail) values (?,?,?,?,?) '
+                      'on conflict (model_id) do update set checked_at = excluded.checked_at, status = excluded.status, '
+                      'payload_digest = excluded.payload_digest, detail = excluded.detail',
+                      [(model_id, now, status, digest, detail) for model_id, (status, digest, detail) in results.items()])
+        if 'checked_digest' not in rows[0].keys():
+            # A batch of never checked models: the next one starts after them
+            c.execute("insert into scrub_state (name, value) values ('cursor', ?) on conflict (name) do update set value = excluded.value",
+                      (str(max(row['id'] for row in rows)),))
+        # Models deleted while they were being checked
+        c.execute('delete from scrub_results where model_id not in (select id from models) and model_id in (%s)'
+                  % ','.join('?' * len(results)), list(results))
+        self.conn.commit()
+
+        for model_id, (status, digest, detail) in results.items():
+            if status not in (OK, UNVERIFIED):
+                print("Model %d: %s%s" % (model_id, status, " (" + detail + ")" if detail else ""), flush=True)
+        self.rate_limiter.wait(n_bytes, len(rows))
+        return len(rows)
+
+    def run(self, once=False, idle_sleep=60.0):
+        '''
+        Checks batches forever (or, with once, until every model has been checked and none is stale).
+        '''
+        while True:
+            if self.run_batch() == 0:
+                deleted = sweep_chunks(self.conn, self.chunk_storage, self.chunk_grace_period)
+                if deleted:
+                    print("Deleted %d chunks of delta uploads that were never completed" % deleted, flush=True)
+                if once:
+                    return
+                time.sleep(idle_sleep)
+                self.rescanned = False
+
+    def close(self):
+        self.conn.close()
+
+
+def load_public_keys(database, paths):
+    '''
+    Returns the public keys (PEM) of the 'key' table of the database and of the given files.
+    '''
+    keys = []
+    conn = sqlite3.connect(database)
+    try:
+        keys.extend(row[0] for row in conn.execute('select publickey from key where publickey is not null'))
+    except sqlite3.OperationalError:
+        pass
+    finally:
+        conn.close()
+    for path in paths:
+        with open(path, 'rb') as f:
+            keys.append(f.read())
+    return keys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=config.DATABASE)
+    parser.add_argument('--public-key', action='append', default=[], help="PEM file of a trusted public key (repeatable).")
+    parser.add_argument('--processes', type=int, default=1, help="Processes that verify signatures.")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--max-bytes-per-second', type=float, default=8 * 1024 * 1024)
+    parser.add_argument('--max-models-per-second', type=float, default=20)
+    parser.add_argument('--stale-after', type=float, default=24 * 7, help="Hours after which a model is checked again.")
+    parser.add_argument('--chunk-grace-period', type=float, default=config.CHUNK_GRACE_PERIOD,
+                        help="Hours after which the chunks no model references are deleted.")
+    parser.add_argument('--idle-sleep', type=float, default=60, help="Seconds to wait when there is nothing to check.")
+    parser.add_argument('--trust-pickle', action='store_true', help="Unpickle 'pickle' and 'pickle5' models to verify them.")
+    parser.add_argument('--once', action='store_true', help="Exit when there is nothing left to check.")
+    args = parser.parse_args()
+
+    settings = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+    executor = None
+    try:
+        import ml_fingerprint
+        executor = ProcessPoolExecutor(args.processes, initializer=_init_worker,
+                                       initargs=(load_public_keys(args.database, args.public_key), args.trust_pickle))
+    except ImportError:
+        print("ml_fingerprint is not installed: only the digests of the payloads will be checked.", file=sys.stderr)
+    scrubber = Scrubber(args.database, payload_storage.storage_from_config(settings), executor, args.batch_size,
+                        timedelta(hours=args.stale_after),
+                        RateLimiter(args.max_bytes_per_second, args.max_models_per_second), config.DATABASE_TIMEOUT,
+                        timedelta(hours=args.chunk_grace_period))
+    try:
+        scrubber.run(args.once, args.idle_sleep)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scrubber.close()
+        if executor is not None:
+            executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
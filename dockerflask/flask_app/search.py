@@ -0,0 +1,226 @@
+'''
+Search index of the models table.
+
+Two kinds of indexes are kept, both by SQLite itself:
+
+    - models_fts, an FTS5 table over the name, description and estimator of every
+      model, kept up to date by triggers on the models table. Free-text queries
+      (q=) use it instead of scanning the descriptions in Python.
+    - A generated column for every score and metadata key in SEARCH_SCORES and
+      SEARCH_METADATA (config.py), computed with json_extract() from the JSON text
+      of the model and indexed. Filtering and sorting by those keys ("best F1 among
+      the classification models") reads the index instead of every row. Other keys
+      can be used too, but they are extracted from every row.
+
+build_query() turns the parameters of the /search route into a single SQL query:
+
+    q             FTS5 query over name, description and estimator ("rain*", "forest OR tree")
+    type          model type, or "supervised"/"unsupervised"
+    score         score key to sort by (best first, see order); models without it are left out
+    order         "desc" (default) or "asc", e.g. for errors like MSE
+    min_score     only models whose score is at least this
+    max_score     only models whose score is at most this
+    metadata.KEY  only models whose metadata KEY has this value
+    latest        "true" to search only the latest version of every model
+    limit         number of models returned (default 20, at most MAX_LIMIT)
+    offset        number of models skipped, for paging
+
+Without score, the models matching q come first by relevance (bm25), then by name.
+'''
+import re
+import sqlite3
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 1000
+
+# Keys that can be written into the definition of a generated column
+INDEXABLE_KEY = re.compile('^[A-Za-z0-9_.-]+$')
+
+FTS_SCHEMA = ('''create virtual table if not exists "models_fts" using fts5(
+    name, description, estimator, content='models', content_rowid='id', tokenize='unicode61 remove_diacritics 2')''',
+    '''create trigger if not exists "models_fts_insert" after insert on models begin
+    insert into models_fts (rowid, name, description, estimator) values (new.id, new.name, new.description, new.estimator);
+    end''',
+    '''create trigger if not exists "models_fts_delete" after delete on models begin
+    insert into models_fts (models_fts, rowid, name, description, estimator) values ('delete', old.id, old.name, old.description, old.estimator);
+    end''',
+    '''create trigger if not exists "models_fts_update" after update of name, description, estimator on models begin
+    insert into models_fts (models_fts, rowid, name, description, estimator) values ('delete', old.id, old.name, old.description, old.estimator);
+    insert into models_fts (rowid, name, description, estimator) values (new.id, new.name, new.description, new.estimator);
+    end''')
+
+
+class SearchError(ValueError):
+    '''
+    Raised when the search parameters are not valid.
+    '''
+
+
+def column_name(prefix, key):
+    return prefix + re.sub('[^0-9a-z_]', '_', key.lower())
+
+
+def _json_path(key):
+    if '"' in key or '\\' in key:
+        raise SearchError("Invalid key: " + key)
+    return '$."%s"' % key
+
+
+def _extract(json_column, key, args=None):
+    '''
+    SQL expression with the value of key in a JSON column. Keys are matched as given,
+    in lower case and in upper case ("f1", "F1"), since clients write them both ways.
+
+    With args (the arguments of a query), the JSON paths are added to them and the
+    expression refers to them, so keys sent by clients never end up in the SQL text.
+    Without them (the definition of a generated column can't have arguments), the key
+    may only have letters, digits, '_', '.' and '-'.
+    '''
+    variants = []
+    for variant in (key, key.lower(), key.upper()):
+        if variant not in variants:
+            variants.append(variant)
+    paths = []
+    for variant in variants:
+        path = _json_path(variant)
+        if args is None:
+            if not INDEXABLE_KEY.match(variant):
+                raise SearchError("Invalid key: " + key)
+            paths.append("json_extract(%s, '%s')" % (json_column, path))
+        else:
+            arg = 'path_%d' % len(args)
+            args[arg] = path
+            paths.append('json_extract(%s, :%s)' % (json_column, arg))
+    value = paths[0] if len(paths) == 1 else 'coalesce(%s)' % ', '.join(paths)
+    # Legacy rows may not hold valid JSON: they simply have no value
+    return 'case when json_valid(%s) then %s end' % (json_column, value)
+
+
+def indexed_columns(scores, metadata):
+    '''
+    Returns {column name: (column type, SQL expression)} of the generated columns
+    of the given score and metadata keys.
+    '''
+    columns = {}
+    for key in scores:
+        columns[column_name('score_', key)] = ('REAL', _extract('scores', key))
+    for key in metadata:
+        columns[column_name('meta_', key)] = ('TEXT', _extract('metadata', key))
+    return columns
+
+
+def create_index(c, scores, metadata):
+    '''
+    Creates the FTS5 table with its triggers and the generated, indexed columns of
+    the given score and metadata keys, if they don't exist yet.
+    '''
+    existing = [row[1] for row in c.execute('pragma table_xinfo(models)')]
+    for column, (column_type, expression) in indexed_columns(scores, metadata).items():
+        if column not in existing:
+            try:
+                # Virtual: computed when read, so adding one doesn't rewrite the table
+                c.execute('alter table models add column %s %s generated always as (%s) virtual' % (column, column_type, expression))
+            except sqlite3.OperationalError:
+                # Another worker added it at the same time
+                pass
+        c.execute('create index if not exists models_%s on models (%s)' % (column, column))
+    new_fts = c.execute("select 1 from sqlite_master where name = 'models_fts'").fetchone() is None
+    for statement in FTS_SCHEMA:
+        c.execute(statement)
+    if new_fts:
+        # Index the models that already existed
+        c.execute("insert into models_fts (models_fts) values ('rebuild')")
+
+
+def build_query(params, columns, scores=(), metadata=()):
+    '''
+    Builds the query of a search.
+
+    Parameters
+    ----------
+    params : dict
+        Search parameters (see the module docstring), as strings.
+    columns : str
+        Columns of the models table returned, comma separated.
+    scores, metadata : iterable of str
+        Score and metadata keys that have a generated column.
+
+    Returns
+    -------
+    (str, dict)
+        The query and its arguments.
+
+    Raises
+    ------
+    SearchError
+        If a parameter is not valid.
+    '''
+    indexed = indexed_columns(scores, metadata)
+    select = ', '.join('m.' + column.strip() for column in columns.split(','))
+    sql_from = ' from models m'
+    where = []
+    order = []
+    args = {}
+
+    if params.get('q'):
+        sql_from += ' join models_fts on models_fts.rowid = m.id'
+        where.append('models_fts match :q')
+        args['q'] = params['q']
+
+    if params.get('type'):
+        if params['type'] == 'supervised':
+            where.append('m.supervised = 1')
+        elif params['type'] == 'unsupervised':
+            where.append('m.supervised = 0')
+        else:
+            where.append('m.type = :type')
+            args['type'] = params['type']
+
+    for name, value in params.items():
+        if name.startswith('metadata.'):
+            key = name[len('metadata.'):]
+            column = column_name('meta_', key)
+            expression = 'm.' + column if column in indexed else _extract('m.metadata', key, args)
+            arg = 'meta_%d' % len(args)
+            where.append('%s = :%s' % (expression, arg))
+            args[arg] = value
+
+    if params.get('score'):
+        key = params['score']
+        column = column_name('score_', key)
+        score = 'm.' + column if column in indexed else _extract('m.scores', key, args)
+        where.append('%s is not null' % score)
+        for bound, operator in (('min_score', '>='), ('max_score', '<=')):
+            if params.get(bound) is not None:
+                try:
+                    args[bound] = float(params[bound])
+                except ValueError:
+                    raise SearchError("%s must be a number" % bound)
+                where.append('%s %s :%s' % (score, operator, bound))
+        direction = params.get('order', 'desc').lower()
+        if direction not in ('asc', 'desc'):
+            raise SearchError("order must be 'asc' or 'desc'")
+        order.append('%s %s' % (score, direction))
+    elif params.get('min_score') is not None or params.get('max_score') is not None:
+        raise SearchError("min_score and max_score need a score")
+
+    if params.get('latest') == 'true':
+        where.append('m.id in (select model_id from latest_versions)')
+
+    if params.get('q'):
+        order.append('models_fts.rank')
+    order += ['m.name', 'm.version_key desc']
+
+    try:
+        args['limit'] = min(int(params.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+        args['offset'] = int(params.get('offset', 0))
+    except ValueError:
+        raise SearchError("limit and offset must be integers")
+    if args['limit'] < 0 or args['offset'] < 0:
+        raise SearchError("limit and offset can't be negative")
+
+    sql = 'select ' + select + sql_from
+    if where:
+        sql += ' where ' + ' and '.join(where)
+    sql += ' order by ' + ', '.join(order) + ' limit :limit offset :offset'
+    return sql, args
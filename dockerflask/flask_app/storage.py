@@ -0,0 +1,292 @@
+'''
+Storage backends for the serialized models.
+
+The database only keeps the metadata of every model and the SHA256 digest of
+its payload. The payload itself is stored in a content-addressed backend, so
+two versions with the same bytes share a single copy.
+'''
+import os
+import io
+import re
+import hashlib
+import tempfile
+
+
+# Format of the digests returned by payload_digest()
+DIGEST = re.compile('^[0-9a-f]{64}$')
+
+
+def payload_digest(data):
+    '''
+    Returns the hex SHA256 digest used as the address of a payload.
+    '''
+    return hashlib.sha256(data).hexdigest()
+
+def valid_digest(digest):
+    '''
+    Checks that a digest (usually sent by a client) has the format of payload_digest(),
+    so it can't name anything outside of the storage backend.
+    '''
+    return isinstance(digest, str) and DIGEST.match(digest) is not None
+
+def _check_digest(digest):
+    if not valid_digest(digest):
+        raise ValueError("Invalid payload digest: " + repr(digest))
+
+
+class Storage():
+    """
+    Base class of the payload backends.
+    Payloads are addressed by the SHA256 digest of their content.
+    """
+
+    def put(self, data):
+        '''
+        Stores the payload (if it isn't already stored) and returns its digest.
+        '''
+        digest = payload_digest(data)
+        if not self.exists(digest):
+            self._write(digest, data)
+        return digest
+
+    def get(self, digest):
+        '''
+        Returns the payload stored under the given digest.
+        Raises KeyError if it doesn't exist.
+        '''
+        raise NotImplementedError
+
+    def exists(self, digest):
+        raise NotImplementedError
+
+    def delete(self, digest):
+        '''
+        Removes the payload. Deleting a payload that doesn't exist is not an error.
+        '''
+        raise NotImplementedError
+
+    def _write(self, digest, data):
+        raise NotImplementedError
+
+
+class FilesystemStorage(Storage):
+    """
+    Stores every payload in its own file, sharded in two levels of directories
+    by the first characters of the digest (root/ab/cd/abcd...), so no directory
+    grows too large. Files are written to a temporary name and renamed into
+    place, so readers never see a partially written payload.
+
+    Attributes
+    ----------
+    root : str
+        Directory where the payloads are stored.
+    """
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest):
+        _check_digest(digest)
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def get(self, digest):
+        try:
+            with open(self.path(digest), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def delete(self, digest):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _write(self, digest, data):
+        path = self.path(digest)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class S3Storage(Storage):
+    """
+    Stores the payloads as objects of an S3-compatible bucket (AWS S3, MinIO...).
+
+    Attributes
+    ----------
+    client : botocore client
+        Any object with boto3's put_object, get_object, head_object and delete_object methods.
+    bucket : str
+        Name of the bucket.
+    prefix : str
+        Prefix added to the key of every object.
+    """
+    def __init__(self, client, bucket, prefix='models/'):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def key(self, digest):
+        _check_digest(digest)
+        return self.prefix + digest[:2] + '/' + digest
+
+    def get(self, digest):
+        try:
+            res = self.client.get_object(Bucket=self.bucket, Key=self.key(digest))
+        except Exception as e:
+            if _is_not_found(e):
+                raise KeyError(digest)
+            raise
+        return res['Body'].read()
+
+    def exists(self, digest):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(digest))
+            return True
+        except Exception as e:
+            if _is_not_found(e):
+                return False
+            raise
+
+    def delete(self, digest):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(digest))
+
+    def _write(self, digest, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.key(digest), Body=data)
+
+
+class SQLiteStorage(Storage):
+    """
+    Stores the payloads in a table of a SQLite database. Used for the chunks of
+    delta uploads when the payloads are kept in the database.
+
+    Attributes
+    ----------
+    connect : callable
+        Returns the connection to use. Passing the connection of the current
+        request makes the writes part of its transaction. The table must have
+        been created beforehand with SCHEMA.
+    """
+    SCHEMA = 'create table if not exists "blobs" ("digest" TEXT NOT NULL, "data" BLOB, PRIMARY KEY("digest"))'
+
+    def __init__(self, connect):
+        self.connect = connect
+
+    def get(self, digest):
+        row = self.connect().execute('select data from blobs where digest = ?', (digest,)).fetchone()
+        if row is None:
+            raise KeyError(digest)
+        return bytes(row[0])
+
+    def exists(self, digest):
+        return self.connect().execute('select 1 from blobs where digest = ?', (digest,)).fetchone() is not None
+
+    def delete(self, digest):
+        self.connect().execute('delete from blobs where digest = ?', (digest,))
+
+    def _write(self, digest, data):
+        self.connect().execute('insert or ignore into blobs (digest, data) values (?, ?)', (digest, data))
+
+
+def _is_not_found(error):
+    response = getattr(error, 'response', None) or {}
+    return str(response.get('Error', {}).get('Code')) in ('404', 'NoSuchKey', 'NotFound')
+
+
+class ObjectNotFound(Exception):
+    """
+    Error raised by LocalObjectClient, shaped like botocore's ClientError.
+    """
+    def __init__(self, key):
+        super().__init__("Object not found: " + key)
+        self.response = {'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}
+
+
+class LocalObjectClient():
+    """
+    Minimal stand-in for an S3 client that keeps the objects in a local directory
+    (one subdirectory per bucket). It implements just the calls S3Storage uses,
+    so the S3 backend can be run and tested without an object store.
+    """
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, Bucket, Key):
+        parts = [Bucket] + Key.split('/')
+        if any(part in ('', '.', '..') or os.sep in part or (os.altsep and os.altsep in part) for part in parts):
+            raise ValueError("Invalid object key: " + repr(Key))
+        return os.path.join(self.root, *parts)
+
+    def put_object(self, Bucket, Key, Body):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(Body)
+        os.replace(tmp_path, path)
+        return {}
+
+    def get_object(self, Bucket, Key):
+        try:
+            with open(self._path(Bucket, Key), 'rb') as f:
+                return {'Body': io.BytesIO(f.read())}
+        except FileNotFoundError:
+            raise ObjectNotFound(Key)
+
+    def head_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise ObjectNotFound(Key)
+        return {'ContentLength': os.path.getsize(path)}
+
+    def delete_object(self, Bucket, Key):
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
+
+
+def storage_from_config(config):
+    '''
+    Builds the backend selected in the app config.
+
+    STORAGE_BACKEND can be 'database' (payloads stay inline in the models table,
+    returns None), 'filesystem' (uses STORAGE_PATH) or 's3' (uses S3_BUCKET,
+    S3_PREFIX and S3_ENDPOINT_URL; an endpoint starting with file:// uses the
+    local stand-in instead of boto3).
+    '''
+    backend = config.get('STORAGE_BACKEND', 'database')
+    if backend == 'database':
+        return None
+    elif backend == 'filesystem':
+        return FilesystemStorage(config['STORAGE_PATH'])
+    elif backend == 's3':
+        endpoint = config.get('S3_ENDPOINT_URL')
+        if endpoint and endpoint.startswith('file://'):
+            client = LocalObjectClient(endpoint[len('file://'):])
+        else:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("The 's3' storage backend requires boto3 (pip install boto3).")
+            client = boto3.client('s3', endpoint_url=endpoint)
+        return S3Storage(client, config['S3_BUCKET'], config.get('S3_PREFIX', 'models/'))
+    else:
+        raise ValueError("Unknown storage backend: " + backend)
+
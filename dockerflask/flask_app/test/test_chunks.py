@@ -0,0 +1,60 @@
+import os
+import sys
+import base64
+import sqlite3
+import tempfile
+import unittest
+
+tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault('ML_FINGERPRINT_DATABASE', os.path.join(tmp.name, 'registry.db'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app
+import storage
+
+
+class ChunksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.conn = sqlite3.connect(app.server.config['DATABASE'])
+        self.conn.execute("insert into api_keys (email, name, key, expire_date) values ('a@b.c', 'a', 'key', '2999-01-01')")
+        self.conn.commit()
+        # Digests that are paths are only dangerous with the filesystem backend
+        self.chunk_storage = app.chunk_storage
+        app.chunk_storage = storage.FilesystemStorage(os.path.join(self.tmp.name, 'chunks'))
+        self.victim = os.path.join(self.tmp.name, 'victim')
+        with open(self.victim, 'wb') as f:
+            f.write(b'secret')
+        self.client = app.server.test_client()
+
+    def tearDown(self):
+        app.chunk_storage = self.chunk_storage
+        self.conn.execute('delete from models')
+        self.conn.execute('delete from api_keys')
+        self.conn.commit()
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def test_upload_and_fetch(self):
+        digest = storage.payload_digest(b'chunk')
+        self.assertEqual(self.client.post('/chunks/missing', json={'api_key': 'key', 'digests': [digest]}).get_json(),
+                         {'missing': [digest]})
+        response = self.client.post('/chunks', json={'api_key': 'key', 'chunks': [[digest, base64.b64encode(b'chunk').decode('ascii')]]})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/chunks/fetch', json={'api_key': 'key', 'digests': [digest]})
+        self.assertEqual(base64.b64decode(response.get_json()['chunks'][0][1]), b'chunk')
+
+    def test_digests_are_not_paths(self):
+        for digest in (self.victim, os.path.relpath(self.victim, app.chunk_storage.root)):
+            response = self.client.post('/chunks/fetch', json={'api_key': 'key', 'digests': [digest]})
+            self.assertEqual(response.status_code, 400)
+            response = self.client.post('/chunks/missing', json={'api_key': 'key', 'digests': [digest]})
+            self.assertEqual(response.status_code, 400)
+            response = self.client.post('/model/stolen', json={'api_key': 'key', 'version': '1.0', 'chunks': [[digest, 6]]})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.conn.execute('select count(*) from models').fetchone()[0], 0)
+        with open(self.victim, 'rb') as f:
+            self.assertEqual(f.read(), b'secret')
+
+
+if __name__ == '__main__':
+    unittest.main()
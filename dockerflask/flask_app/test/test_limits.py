@@ -0,0 +1,79 @@
+import os
+import sys
+import sqlite3
+import tempfile
+import unittest
+
+tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault('ML_FINGERPRINT_DATABASE', os.path.join(tmp.name, 'registry.db'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app
+import limits
+
+
+class LimitsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(app.server.config['DATABASE'])
+        self.conn.execute("insert into api_keys (email, name, key, expire_date) values ('a@b.c', 'a', 'key', '2999-01-01')")
+        self.conn.commit()
+        self.saved = dict(app.server.extensions['limits'])
+        self.client = app.server.test_client()
+
+    def tearDown(self):
+        app.server.extensions['limits'].update(self.saved)
+        for table in ('api_keys', 'rate_limits'):
+            self.conn.execute('delete from ' + table)
+        self.conn.commit()
+        self.conn.close()
+
+    def test_large_body_is_rejected_before_reading(self):
+        max_length = app.server.config['MAX_CONTENT_LENGTH']
+        app.server.config['MAX_CONTENT_LENGTH'] = 1000
+        try:
+            res = self.client.post('/model/big', data=b'{"api_key": "key", "x": "' + b'a' * 2000 + b'"}',
+                                   content_type='application/json')
+        finally:
+            app.server.config['MAX_CONTENT_LENGTH'] = max_length
+        self.assertEqual(res.status_code, 413)
+
+    def test_rate_limit_per_api_key(self):
+        app.server.extensions['limits']['buckets'] = limits.TokenBuckets(0.01, 2)
+        remaining = []
+        for i in range(2):
+            res = self.client.get('/modellist?format=json&api_key=key')
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.headers['X-RateLimit-Limit'], '2')
+            remaining.append(res.headers['X-RateLimit-Remaining'])
+        self.assertEqual(remaining, ['1', '0'])
+        res = self.client.get('/modellist?format=json', headers={'X-API-Key': 'key'})
+        self.assertEqual(res.status_code, 429)
+        self.assertGreater(int(res.headers['Retry-After']), 0)
+        # A made-up key doesn't get a bucket of its own, but the bucket of the address isn't empty yet
+        self.assertEqual(self.client.get('/modellist?format=json&api_key=other').status_code, 403)
+
+    def test_shared_buckets(self):
+        conn = sqlite3.connect(app.server.config['DATABASE'])
+        workers = [limits.SQLiteTokenBuckets(0.01, 3, lambda: conn) for i in range(2)]
+        allowed = [workers[i % 2].take('key:key')[0] for i in range(4)]
+        conn.close()
+        self.assertEqual(allowed, [True, True, True, False])
+
+    def test_route_concurrency(self):
+        concurrency = limits.ConcurrencyLimits({'manage_modellist': 1})
+        app.server.extensions['limits']['concurrency'] = concurrency
+        concurrency.acquire('manage_modellist')
+        res = self.client.get('/modellist?format=json&api_key=key')
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '1')
+        concurrency.release('manage_modellist')
+        res = self.client.get('/modellist?format=json&api_key=key')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['X-Concurrency-Limit'], '1')
+        self.assertEqual(res.headers['X-Concurrency-Remaining'], '0')
+        self.assertEqual(concurrency.active['manage_modellist'], 0)
+        # Other routes have no cap
+        self.assertNotIn('X-Concurrency-Limit', self.client.get('/search?api_key=key').headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import sqlite3
+import subprocess
+import tempfile
+import unittest
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import metrics
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_render_merged_workers(self):
+        workers = []
+        for duration in (0.003, 0.2):
+            registry = metrics.Registry()
+            registry.inc('mlfp_requests_total', {'route': '/modellist', 'method': 'GET', 'status': '200'})
+            registry.observe('mlfp_request_duration_seconds', {'route': '/modellist', 'method': 'GET'}, duration)
+            workers.append(registry.snapshot())
+        text = metrics.render(*metrics.merge(workers))
+        self.assertIn('# TYPE mlfp_requests_total counter', text)
+        self.assertIn('mlfp_requests_total{method="GET",route="/modellist",status="200"} 2', text)
+        self.assertIn('mlfp_request_duration_seconds_bucket{method="GET",route="/modellist",le="0.005"} 1', text)
+        self.assertIn('mlfp_request_duration_seconds_bucket{method="GET",route="/modellist",le="+Inf"} 2', text)
+        self.assertIn('mlfp_request_duration_seconds_count{method="GET",route="/modellist"} 2', text)
+
+    def test_timed_connection_counts_queries(self):
+        metrics.registry = metrics.Registry()
+        conn = sqlite3.connect(':memory:', factory=metrics.TimedConnection)
+        conn.execute('create table t (x integer)')
+        conn.executemany('insert into t values (?)', [(i,) for i in range(10)])
+        self.assertEqual(len(conn.execute('select * from t').fetchall()), 10)
+        c = conn.cursor()
+        c.execute('select * from t').fetchone()
+        c.execute('select count(*) from t').fetchone()
+        del c
+        conn.close()
+        series = metrics.registry.counters['mlfp_db_queries_total']
+        self.assertEqual(series[(('route', 'background'),)], 5)
+
+    def test_snapshots_of_exited_workers_are_removed(self):
+        registry = metrics.Registry()
+        registry.inc('mlfp_requests_total', {'route': '/modellist', 'method': 'GET', 'status': '200'})
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        with tempfile.TemporaryDirectory() as tmp:
+            for pid in (os.getpid(), exited.pid):
+                with open(os.path.join(tmp, 'worker-%d.json' % pid), 'w') as f:
+                    json.dump(registry.snapshot(), f)
+            self.assertEqual(len(metrics.load_snapshots(tmp)), 1)
+            self.assertEqual(os.listdir(tmp), ['worker-%d.json' % os.getpid()])
+
+    def test_metrics_and_profiles_need_an_api_key(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            server = Flask(__name__)
+            server.config.update(PROFILE_ON_REQUEST=True, PROFILE_DIR=tmp, PROFILE_MAX_FILES=2)
+            server.add_url_rule('/hello', 'hello', lambda: 'hello')
+            try:
+                metrics.init_app(server, lambda api_key: api_key == 'key')
+                client = server.test_client()
+                self.assertEqual(client.get('/metrics').status_code, 403)
+                self.assertEqual(client.get('/metrics?api_key=other').status_code, 403)
+                self.assertEqual(client.get('/metrics', headers={'X-API-Key': 'key'}).status_code, 200)
+
+                self.assertNotIn('X-Profile-File', client.get('/hello', headers={'X-Profile': 'cprofile'}).headers)
+                self.assertEqual(os.listdir(tmp), [])
+                names = [client.get('/hello?api_key=key', headers={'X-Profile': 'cprofile'}).headers['X-Profile-File'] for i in range(3)]
+                self.assertEqual(os.path.basename(names[0]), names[0])
+                self.assertEqual(len(os.listdir(tmp)), 2)
+            finally:
+                metrics._enabled = False
+
+if __name__ == '__main__':
+    unittest.main()
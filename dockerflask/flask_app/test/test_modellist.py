@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import sqlite3
+import tempfile
+import unittest
+
+tmp = tempfile.TemporaryDirectory()
+os.environ['ML_FINGERPRINT_DATABASE'] = os.path.join(tmp.name, 'registry.db')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app
+
+
+class ModelListTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(app.server.config['DATABASE'])
+        self.conn.execute("insert into api_keys (email, name, key, expire_date) values ('a@b.c', 'a', 'key', '2999-01-01')")
+        # Rows inserted without the app have no display columns
+        rows = [('model', '1.%d' % i, json.dumps({'r2': 0.123456789}), '{}', '2023-01-02 03:04:05.000000') for i in range(3)]
+        self.conn.executemany("insert into models (name, version, supervised, type, scores, metadata, date) values (?, ?, 1, 'linear', ?, ?, ?)", rows)
+        self.conn.commit()
+        self.client = app.server.test_client()
+
+    def tearDown(self):
+        self.conn.execute('delete from models')
+        self.conn.execute('delete from api_keys')
+        self.conn.commit()
+        self.conn.close()
+        app.list_cache.clear()
+
+    def test_list_is_cached_until_a_model_changes(self):
+        page = self.client.get('/modellist?allversions=true').data
+        self.assertEqual(page.count(b'<article'), 3)
+        self.assertIn(b'0.1235', page)
+        self.assertIn(b'02 Jan. 2023 03:04', page)
+        self.assertEqual(len(app.list_cache), 1)
+        self.assertEqual(self.client.get('/modellist?allversions=true').data, page)
+        response = self.client.delete('/model/model?api_key=key&version=1.0')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/modellist?allversions=true').data.count(b'<article'), 2)
+
+    def test_json_list_has_no_display_columns(self):
+        models = self.client.get('/modellist?format=json&api_key=key').get_json()
+        self.assertEqual(len(models), 1)
+        self.assertNotIn('display_scores', models[0])
+        self.assertEqual(models[0]['scores'], {'r2': 0.123456789})
+
+    def test_latest_version_is_semantic(self):
+        versions = ['0.9', '1.0.0-beta', '1.0.0-rc.1', '1.0.0', '1.9', '1.10', 'v2.0+build.5']
+        self.assertEqual(sorted(versions, key=app.version_key), versions)
+        for version in ('9', '10', '10-rc1'):
+            self.conn.execute("insert into models (name, version, version_key, scores, metadata) values ('semver', ?, ?, '{}', '{}')",
+                              (version, app.version_key(version)))
+        self.conn.commit()
+        latest = lambda: self.client.get('/model/semver?api_key=key').get_json()['version']
+        self.assertEqual(latest(), '10')
+        self.assertEqual(self.client.delete('/model/semver?api_key=key').status_code, 200)
+        self.assertEqual(latest(), '10-rc1')
+        self.conn.execute("update models set name = 'other' where name = 'semver' and version = '10-rc1'")
+        self.conn.commit()
+        self.assertEqual(latest(), '9')
+
+    def test_versions_are_listed_newest_first(self):
+        # Sorted by type first, like the list of all models, 1.0 would come first
+        for version, model_type in (('1.0', 'classification'), ('2.0', 'regression'), ('1.5', 'clustering')):
+            self.conn.execute("insert into models (name, version, version_key, supervised, type, scores, metadata) values ('typed', ?, ?, 1, ?, '{}', '{}')",
+                              (version, app.version_key(version), model_type))
+        self.conn.commit()
+        models = self.client.get('/modellist/typed?format=json&api_key=key').get_json()
+        self.assertEqual([model['version'] for model in models], ['2.0', '1.5', '1.0'])
+
+    def test_unchanged_model_is_not_sent_again(self):
+        get = lambda **params: self.client.get('/model/model', query_string=dict(api_key='key', version='1.1', **params))
+        digest = get().get_json()['content_digest']
+        self.assertEqual(get(digest=digest).status_code, 304)
+        # Updated in place: same version, new payload
+        self.conn.execute("update models set revision = 1 where name = 'model' and version = '1.1'")
+        self.conn.commit()
+        response = get(digest=digest)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_json()['content_digest'], digest)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import io
+import os
+import sys
+import base64
+import sqlite3
+import tempfile
+import unittest
+import orjson
+import numpy as np
+
+tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault('ML_FINGERPRINT_DATABASE', os.path.join(tmp.name, 'registry.db'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app
+from Crypto.PublicKey import RSA
+from ml_fingerprint import ml_fingerprint, example_models, remote, manifest, serialization, keyring, exceptions
+
+
+class PredictTestCase(unittest.TestCase):
+    def setUp(self):
+        ml_fingerprint.decorate_base_estimator()
+        key = RSA.generate(1024)
+        self.model = example_models.vanderplas_regression()
+        self.model.sign(key)
+        self.conn = sqlite3.connect(app.server.config['DATABASE'])
+        self.conn.execute("insert into api_keys (email, name, key, expire_date) values ('a@b.c', 'a', 'key', '2999-01-01')")
+        self.conn.execute('insert into key (publickey) values (?)', (key.publickey().export_key().decode('ascii'),))
+        rows = [('served', '1.0', 'manifest', base64.b64encode(b''.join(remote.serialize_model(self.model, 'manifest'))).decode('ascii')),
+                ('pickled', '1.0', 'pickle', remote.encode_model(self.model, 'pickle')[0])]
+        self.conn.executemany("insert into models (name, version, version_key, serializer_bytes, serializer_text, serialized_model, scores, metadata) values (?, ?, '01.1#', ?, 'base64', ?, '{}', '{}')", rows)
+        self.conn.commit()
+        app.server.config['PREDICT_ENABLED'] = True
+        app.access_counter.counts.clear()
+        self.client = app.server.test_client()
+        self.X = np.random.RandomState(0).rand(5, 2)
+
+    def tearDown(self):
+        app.server.config['PREDICT_ENABLED'] = False
+        for table in ('models', 'api_keys', 'key', 'model_access'):
+            self.conn.execute('delete from ' + table)
+        self.conn.commit()
+        self.conn.close()
+        if app.predict._pool is not None:
+            app.predict._pool.stop()
+            app.predict._pool = None
+
+    def test_predict(self):
+        response = self.client.post('/model/served/predict?api_key=key', json={'instances': self.X.tolist()})
+        self.assertEqual(response.status_code, 200)
+        np.testing.assert_allclose(response.get_json()['predictions'], self.model.predict(self.X))
+        buffer = io.BytesIO()
+        np.save(buffer, self.X)
+        response = self.client.post('/model/served/predict?api_key=key', data=buffer.getvalue(), content_type='application/x-npy')
+        np.testing.assert_allclose(np.load(io.BytesIO(response.data)), self.model.predict(self.X))
+        self.assertEqual(self.client.post('/model/served/predict?api_key=key', json={'instances': [[1, 2, 3]]}).status_code, 400)
+        # Updating the model changes its revision, so it is loaded again
+        self.conn.execute("update models set revision = 1 where name = 'served'")
+        self.conn.commit()
+        self.client.post('/model/served/predict?api_key=key', json={'instances': self.X.tolist()})
+        self.assertEqual(len(app.predict._pool.models), 2)
+
+    def test_untrusted_models_are_not_served(self):
+        self.assertEqual(self.client.post('/model/pickled/predict?api_key=key', json=[[1, 2]]).status_code, 422)
+        self.conn.execute("update models set serialized_model = ? where name = 'served'",
+                          (remote.encode_model(example_models.vanderplas_regression(), 'manifest')[0],))
+        self.conn.commit()
+        self.assertEqual(self.client.post('/model/served/predict?api_key=key', json=[[1, 2]]).status_code, 422)
+
+    def test_unsigned_manifest_is_not_built(self):
+        # A manifest that would create a file if it were built
+        description, buffers = manifest.dumps_manifest(example_models.vanderplas_regression())
+        description = orjson.loads(description)
+        path = os.path.join(tmp.name, 'created')
+        args = [{'t': 'json', 'v': v} for v in (path, 'uint8', 'w+', 0)] + [{'t': 'tuple', 'items': [{'t': 'json', 'v': 16}]}]
+        description['model']['attributes'].append(['mapped_', {'t': 'reduce', 'class': 'numpy:memmap',
+                                                               'args': {'t': 'tuple', 'items': args},
+                                                               'state': {'t': 'json', 'v': None}}])
+        data = b''.join(serialization.iter_oob(orjson.dumps(description), buffers, magic=manifest.MAGIC))
+        registry = app.predict.DatabaseRegistry(lambda version: (data, 'manifest'))
+        public_key = keyring.Keyring([self.conn.execute('select publickey from key').fetchone()[0]])
+        with self.assertRaises(exceptions.ModelNotSigned):
+            registry.get_model('evil', public_key, 'digest')
+        self.assertFalse(os.path.exists(path))
+
+    def test_prewarm_most_requested(self):
+        self.conn.execute("update models set content_digest = 'digest' where name = 'served'")
+        self.conn.commit()
+        for name in ('served', 'served', 'pickled'):
+            self.assertEqual(self.client.get('/model/%s?api_key=key' % name).status_code, 200)
+        app.access_counter.flush(self.conn)
+        self.assertEqual(dict(self.conn.execute('select models.name, count from model_access join models on models.id = model_id').fetchall()),
+                         {'served': 2, 'pickled': 1})
+        app.prewarm_models()
+        pool = app.predict._pool
+        self.assertEqual(list(pool.models), [('served', 'digest')])
+        self.assertGreater(pool.nbytes, 0)
+        # Bounded by size: a new model evicts the least recently used one
+        pool.max_bytes = pool.nbytes
+        self.conn.execute("update models set content_digest = 'other' where name = 'served'")
+        self.conn.commit()
+        self.client.post('/model/served/predict?api_key=key', json={'instances': self.X.tolist()})
+        self.assertEqual(list(pool.models), [('served', 'other')])
+
+
+if __name__ == '__main__':
+    unittest.main()
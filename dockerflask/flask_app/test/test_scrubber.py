@@ -0,0 +1,94 @@
+import os
+import sys
+import base64
+import sqlite3
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import storage
+import scrubber
+from Crypto.PublicKey import RSA
+from ml_fingerprint import ml_fingerprint, example_models, remote
+
+
+class ScrubberTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.tmp.name, 'registry.db')
+        conn = sqlite3.connect(self.database)
+        conn.execute('''create table models (id INTEGER PRIMARY KEY, serialized_model BLOB, serializer_bytes TEXT,
+            serializer_text TEXT, payload_digest TEXT)''')
+        conn.execute('create table model_chunks (model_id INTEGER, position INTEGER, digest TEXT, size INTEGER)')
+        conn.execute(storage.SQLiteStorage.SCHEMA)
+        ml_fingerprint.decorate_base_estimator()
+        self.key = RSA.generate(1024)
+        model = example_models.vanderplas_regression()
+        model.sign(self.key)
+        self.payload = b''.join(remote.serialize_model(model, 'manifest'))
+        self.storage = storage.FilesystemStorage(os.path.join(self.tmp.name, 'payloads'))
+        rows = [(1, base64.b64encode(self.payload).decode('ascii'), 'manifest', 'base64', None),
+                (2, None, 'manifest', 'base64', self.storage.put(self.payload)),
+                (3, base64.b64encode(b'not a model').decode('ascii'), 'pickle', 'base64', None)]
+        conn.executemany('insert into models values (?,?,?,?,?)', rows)
+        conn.commit()
+        conn.close()
+        # Threads instead of processes: the worker state is set up in this process
+        scrubber._init_worker([self.key.publickey().export_key()], False)
+        self.executor = ThreadPoolExecutor(1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.tmp.cleanup()
+
+    def results(self, s):
+        return {row['model_id']: row['status'] for row in s.conn.execute('select * from scrub_results')}
+
+    def test_scrub_and_resume(self):
+        s = scrubber.Scrubber(self.database, self.storage, self.executor, batch_size=2)
+        self.assertEqual(s.run_batch(), 2)
+        self.assertEqual(s.get_cursor(), 2)
+        s.close()
+        # A new scrubber resumes after the cursor
+        s = scrubber.Scrubber(self.database, self.storage, self.executor, batch_size=2)
+        self.assertEqual(s.run_batch(), 1)
+        self.assertEqual(self.results(s), {1: scrubber.OK, 2: scrubber.OK, 3: scrubber.UNVERIFIED})
+        self.assertEqual(s.run_batch(), 0)
+        s.close()
+
+    def test_corruption_is_detected(self):
+        s = scrubber.Scrubber(self.database, self.storage, self.executor, stale_after=timedelta(0))
+        s.run_batch()
+        tampered = bytearray(self.payload)
+        tampered[-1] ^= 1
+        s.conn.execute('update models set serialized_model = ? where id = 1', (base64.b64encode(bytes(tampered)).decode('ascii'),))
+        with open(self.storage.path(self.storage.put(self.payload)), 'wb') as f:
+            f.write(bytes(tampered))
+        s.conn.commit()
+        s.run_batch()
+        results = self.results(s)
+        self.assertEqual(results[1], scrubber.CORRUPT)
+        self.assertEqual(results[2], scrubber.CORRUPT)
+        s.close()
+
+    def test_chunks_of_unfinished_uploads_are_deleted(self):
+        s = scrubber.Scrubber(self.database, self.storage, self.executor, chunk_grace_period=timedelta(hours=1))
+        used, unused, recent = (s.chunk_storage.put(data) for data in (b'used', b'unused', b'recent'))
+        s.conn.execute('insert into model_chunks values (2, 0, ?, 4)', (used,))
+        old = (datetime.now() - timedelta(hours=2)).isoformat()
+        s.conn.executemany('insert into chunk_uploads values (?, ?)',
+                           [(used, old), (unused, old), (recent, datetime.now().isoformat())])
+        s.conn.commit()
+        s.run(once=True)
+        self.assertTrue(s.chunk_storage.exists(used))
+        self.assertFalse(s.chunk_storage.exists(unused))
+        # Still within the grace period: its push may not have finished yet
+        self.assertTrue(s.chunk_storage.exists(recent))
+        self.assertEqual([row[0] for row in s.conn.execute('select digest from chunk_uploads')], [recent])
+        s.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import sqlite3
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import search
+
+COLUMNS = 'id, name, type, version, scores, metadata'
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('''create table models (id INTEGER PRIMARY KEY, name TEXT, description TEXT, estimator TEXT,
+            supervised INTEGER, type TEXT, version TEXT, version_key TEXT, scores TEXT, metadata TEXT)''')
+        rows = [('rain', 'Predicts rain tomorrow', 'RandomForestClassifier', 'classification', '1.0', {'f1': 0.7}, {'dataset': 'weatherAUS'}),
+                ('rain', 'Predicts rain tomorrow', 'RandomForestClassifier', 'classification', '1.1', {'F1': 0.8}, {'dataset': 'weatherAUS'}),
+                ('spam', 'Spam filter', 'LogisticRegression', 'classification', '2.0', {'f1': 0.9}, {'dataset': 'emails'}),
+                ('price', 'House prices', 'LinearRegression', 'regression', '1.0', {'MSE': 3.5}, {})]
+        self.conn.executemany('insert into models (name, description, estimator, supervised, type, version, scores, metadata) values (?, ?, ?, 1, ?, ?, ?, ?)',
+                              [row[:5] + (json.dumps(row[5]), json.dumps(row[6])) for row in rows])
+        self.conn.execute('update models set version_key = version')
+        self.conn.execute('create table latest_versions as select name, max(id) as model_id from models group by name')
+        # Created after the rows, so the existing models must be indexed too
+        search.create_index(self.conn, ['f1', 'mse'], ['dataset'])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def search(self, **params):
+        sql, args = search.build_query(params, COLUMNS, ['f1', 'mse'], ['dataset'])
+        return [(row[1], row[3]) for row in self.conn.execute(sql, args)]
+
+    def test_best_score(self):
+        self.assertEqual(self.search(type='classification', score='f1', limit='1'), [('spam', '2.0')])
+        self.assertEqual(self.search(score='f1', latest='true'), [('spam', '2.0'), ('rain', '1.1')])
+        self.assertEqual(self.search(score='mse', order='asc'), [('price', '1.0')])
+        self.assertEqual(self.search(score='f1', min_score='0.75', max_score='0.85'), [('rain', '1.1')])
+        # Score without a generated column
+        self.assertEqual(self.search(score='mse', type='regression'), self.search(score='MSE', type='regression'))
+        sql, _ = search.build_query({'score': 'f1'}, COLUMNS, ['f1'])
+        plan = ' '.join(row[3] for row in self.conn.execute('explain query plan ' + sql, {'limit': 1, 'offset': 0}))
+        self.assertIn('models_score_f1', plan)
+
+    def test_text_and_metadata(self):
+        self.assertEqual(self.search(q='rain', latest='true'), [('rain', '1.1')])
+        self.assertEqual(self.search(q='logistic*'), [('spam', '2.0')])
+        self.assertEqual(self.search(**{'metadata.dataset': 'emails'}), [('spam', '2.0')])
+        self.conn.execute("update models set description = 'Junk mail' where name = 'spam'")
+        self.conn.execute("delete from models where name = 'price'")
+        self.assertEqual(self.search(q='junk'), [('spam', '2.0')])
+        self.assertEqual(self.search(q='house'), [])
+        with self.assertRaises(search.SearchError):
+            self.search(order='up', score='f1')
+
+
+    def test_keys_are_not_sql(self):
+        self.conn.execute('create table key (apikey TEXT)')
+        self.conn.execute("insert into key values ('secret')")
+        injection = "x' || char(34)), 1) end is not null union select apikey, 1, 1, 1, 1, 1 from key --"
+        for params in ({'score': injection}, {'metadata.' + injection: 'a'}):
+            sql, args = search.build_query(params, COLUMNS)
+            self.assertNotIn('apikey', sql)
+            self.assertEqual(self.conn.execute(sql, args).fetchall(), [])
+        # Keys with quotes or spaces are still looked up
+        self.conn.execute("""update models set metadata = '{"it''s data": "yes"}' where name = 'price'""")
+        self.assertEqual(self.search(**{"metadata.it's data": 'yes'}), [('price', '1.0')])
+        with self.assertRaises(search.SearchError):
+            search.indexed_columns([injection], [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import storage
+
+
+class StorageTestMixin():
+    def test_put_get(self):
+        digest = self.storage.put(b'model bytes')
+        self.assertEqual(digest, storage.payload_digest(b'model bytes'))
+        self.assertTrue(self.storage.exists(digest))
+        self.assertEqual(self.storage.get(digest), b'model bytes')
+
+    def test_same_content_same_address(self):
+        self.assertEqual(self.storage.put(b'abc'), self.storage.put(b'abc'))
+
+    def test_delete(self):
+        digest = self.storage.put(b'to be deleted')
+        self.storage.delete(digest)
+        self.assertFalse(self.storage.exists(digest))
+        with self.assertRaises(KeyError):
+            self.storage.get(digest)
+        # Deleting twice is not an error
+        self.storage.delete(digest)
+
+
+class FilesystemStorageTestCase(StorageTestMixin, unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = storage.FilesystemStorage(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_sharded_layout(self):
+        digest = self.storage.put(b'sharded')
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp.name, digest[:2], digest[2:4], digest)))
+
+    def test_digests_are_not_paths(self):
+        for digest in ('/etc/hostname', '../../../../etc/hostname', storage.payload_digest(b'x').upper()):
+            with self.assertRaises(ValueError):
+                self.storage.exists(digest)
+
+
+class S3StorageTestCase(StorageTestMixin, unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = storage.storage_from_config({'STORAGE_BACKEND': 's3',
+                                                    'S3_ENDPOINT_URL': 'file://' + self.tmp.name,
+                                                    'S3_BUCKET': 'bucket'})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_digests_are_not_paths(self):
+        with self.assertRaises(ValueError):
+            self.storage.exists('/etc/hostname')
+        # Keys built by other callers of the local stand-in are checked as well
+        with self.assertRaises(ValueError):
+            self.storage.client.head_object(Bucket='bucket', Key='../../etc/hostname')
+        with self.assertRaises(ValueError):
+            self.storage.client.head_object(Bucket='bucket', Key='/etc/hostname')
+
+
+class SQLiteStorageTestCase(StorageTestMixin, unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute(storage.SQLiteStorage.SCHEMA)
+        self.storage = storage.SQLiteStorage(lambda: self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,22 @@
+'''
+ml_fingerprint: signing and verification of scikit-learn models.
+
+The submodules are imported lazily (PEP 562), the first time they are used as
+attributes of the package: ``import ml_fingerprint`` is almost free, and
+``ml_fingerprint.remote`` or ``ml_fingerprint.example_models`` (pandas, requests...)
+are only loaded by the processes that need them.
+'''
+import importlib
+
+_SUBMODULES = ('chunking', 'cli', 'digests', 'example_models', 'exceptions', 'keyring', 'manifest',
+               'ml_fingerprint', 'remote', 'serialization', 'serving')
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES))
@@ -0,0 +1,97 @@
+'''
+Content-defined chunking of serialized models.
+
+The serialized model is cut into chunks wherever a rolling hash of the last
+WINDOW bytes matches a pattern, so the cut points depend only on the content
+around them. When a new version of a model only changes some of its arrays,
+the chunks of the unchanged arrays are the same as in the previous version and
+don't need to be sent again.
+
+The rolling hash is the sum of random 64-bit values assigned to each byte of
+the window, computed with numpy over large blocks at a time.
+'''
+import hashlib
+import numpy as np
+
+WINDOW = 64
+MIN_SIZE = 16 * 1024
+AVG_SIZE = 64 * 1024
+MAX_SIZE = 256 * 1024
+_BLOCK = 4 * 1024 * 1024
+
+# Fixed table, so every client cuts the same content at the same points. All the
+# bits must be random: with odd values only, the sum of an even window is always even.
+_GEAR = np.random.RandomState(0x6d6c6670).randint(0, 2**64, 256, dtype=np.uint64)
+
+
+def _candidates(data, mask):
+    '''
+    Returns the sorted positions p (end of a chunk, exclusive) where the hash of
+    the window data[p - WINDOW:p] matches the mask.
+    '''
+    view = np.frombuffer(data, dtype=np.uint8)
+    found = []
+    for start in range(WINDOW, len(view) + 1, _BLOCK):
+        end = min(start + _BLOCK, len(view) + 1)
+        values = _GEAR[view[start - WINDOW:end - 1]]
+        sums = np.cumsum(values, dtype=np.uint64)
+        # Sum of the window ending at each position of the block
+        windows = sums[WINDOW - 1:].copy()
+        windows[1:] -= sums[:-WINDOW]
+        found.append(np.flatnonzero((windows & mask) == 0) + start)
+    if not found:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(found)
+
+
+def chunk_boundaries(data, min_size=MIN_SIZE, avg_size=AVG_SIZE, max_size=MAX_SIZE):
+    '''
+    Computes where to cut a buffer into content-defined chunks.
+
+    Parameters
+    ----------
+    data : bytes-like
+        The buffer to be chunked.
+    min_size, avg_size, max_size : int, optional
+        Minimum, expected and maximum size of the chunks. avg_size must be a power of 2.
+
+    Returns
+    -------
+    list
+        End offset of every chunk. The last one is always len(data).
+    '''
+    size = memoryview(data).nbytes
+    if size == 0:
+        return []
+    mask = np.uint64(avg_size - 1)
+    candidates = _candidates(data, mask)
+    boundaries = []
+    pos = 0
+    while pos < size:
+        i = np.searchsorted(candidates, pos + min_size)
+        if i < len(candidates) and candidates[i] <= pos + max_size:
+            pos = int(candidates[i])
+        else:
+            pos = min(pos + max_size, size)
+        boundaries.append(pos)
+    return boundaries
+
+
+def split(data, **kwargs):
+    '''
+    Cuts a buffer into content-defined chunks.
+
+    Returns
+    -------
+    list of (str, memoryview)
+        Hex SHA256 digest and content of every chunk, in order. The contents are
+        views over data, not copies.
+    '''
+    view = memoryview(data).cast('B')
+    chunks = []
+    start = 0
+    for end in chunk_boundaries(view, **kwargs):
+        chunk = view[start:end]
+        chunks.append((hashlib.sha256(chunk).hexdigest(), chunk))
+        start = end
+    return chunks
@@ -0,0 +1,431 @@
+'''
+Command line interface (the ml-fingerprint command), for signing, verifying and
+syncing many models at once, i.e. in release pipelines.
+
+    ml-fingerprint sign --key private.pem models/          signs every model file, in place
+    ml-fingerprint verify --key public.pem models/         verifies them (exit status 1 if any fails)
+    ml-fingerprint push --version 1.2 models/              uploads them to the registry
+    ml-fingerprint pull --key public.pem models/           downloads and verifies the latest versions
+    ml-fingerprint bench [models/]                         measures load, sign and verify times
+
+Model files are found in the given files and directories (recursively) by their
+extension: .joblib, .pkl or .pickle (pickle) and .mlfp (ml_fingerprint.serialization).
+Loading them unpickles them, so they must come from a trusted source: a signature
+only proves who made a model once it has been loaded.
+
+The files are processed by a pool of --jobs workers: processes for sign and verify,
+which are bound by the CPU, and threads for push and pull, which mostly wait for the
+registry. Every command prints the time of every file and the throughput, and can
+write them as JSON with --report. push and pull take the registry from --url and
+--api-key, or from the ML_FINGERPRINT_URL and ML_FINGERPRINT_API_KEY environment
+variables, so the API key doesn't have to be in the command line.
+'''
+import io
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import contextlib
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+FORMATS = {'.joblib': 'joblib', '.pkl': 'pickle', '.pickle': 'pickle', '.mlfp': 'mlfp'}
+EXTENSIONS = {'joblib': '.joblib', 'pickle': '.pkl', 'mlfp': '.mlfp'}
+
+
+def find_models(paths):
+    '''
+    Returns the model files in the given files and directories, sorted.
+    '''
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                found += [os.path.join(root, name) for name in files
+                          if os.path.splitext(name)[1] in FORMATS and not name.startswith('.')]
+        else:
+            found.append(path)
+    return sorted(found)
+
+
+def load_model(path):
+    '''
+    Loads a model file, in the format given by its extension.
+    '''
+    file_format = FORMATS.get(os.path.splitext(path)[1])
+    if file_format == 'joblib':
+        import joblib
+        return joblib.load(path)
+    if file_format == 'pickle':
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    if file_format == 'mlfp':
+        from . import serialization
+        return serialization.load(path)
+    raise ValueError("Unknown model file format: " + path)
+
+
+def save_model(model, path):
+    '''
+    Saves a model, in the format given by the extension of path. The file is written
+    to a temporary name and then renamed, so it's never left half written.
+    '''
+    file_format = FORMATS.get(os.path.splitext(path)[1])
+    if file_format is None:
+        raise ValueError("Unknown model file format: " + path)
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    if file_format == 'mlfp':
+        from . import serialization
+        serialization.dump(model, path)
+        return
+    tmp_path = os.path.join(directory, '.tmp-%d-%s' % (os.getpid(), os.path.basename(path)))
+    try:
+        if file_format == 'joblib':
+            import joblib
+            joblib.dump(model, tmp_path)
+        else:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(model, f, protocol=5)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _result(path, status, start, nbytes=0, **extra):
+    result = {'path': path, 'status': status, 'seconds': time.perf_counter() - start, 'bytes': nbytes}
+    result.update(extra)
+    return result
+
+
+def sign_file(path, key_path, output=None):
+    '''
+    Signs a model file. The signed model replaces the file, or is written to output.
+    Runs in the workers of the pool.
+    '''
+    from . import ml_fingerprint, keyring
+    start = time.perf_counter()
+    try:
+        ml_fingerprint.decorate_base_estimator()
+        with open(key_path, 'rb') as f:
+            private_key = keyring.load_key(f.read())
+        model = load_model(path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            model.sign(private_key)
+        save_model(model, output or path)
+        return _result(path, 'signed', start, os.path.getsize(output or path))
+    except Exception as e:
+        return _result(path, 'failed', start, error=str(e))
+
+
+def verify_file(path, key_paths):
+    '''
+    Verifies a model file with the keys in the given PEM files. Runs in the workers of the pool.
+    '''
+    from . import ml_fingerprint, keyring, exceptions
+    start = time.perf_counter()
+    try:
+        ml_fingerprint.decorate_base_estimator()
+        model = load_model(path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            model.verify(keyring.Keyring.from_files(key_paths))
+        return _result(path, 'valid', start, os.path.getsize(path))
+    except (exceptions.ModelNotSigned, exceptions.VerificationError) as e:
+        return _result(path, 'invalid', start, os.path.getsize(path), error=str(e))
+    except Exception as e:
+        return _result(path, 'failed', start, error=str(e))
+
+
+def model_category(model):
+    '''
+    Returns (supervised, type) of an estimator, as stored in the registry.
+    '''
+    from sklearn import base
+    estimator = model.steps[-1][1] if hasattr(model, 'steps') else model
+    if base.is_classifier(estimator):
+        return True, 'classification'
+    if base.is_regressor(estimator):
+        return True, 'regression'
+    if getattr(estimator, '_estimator_type', None) == 'clusterer' or hasattr(estimator, 'cluster_centers_'):
+        return False, 'clustering'
+    return False, 'transformer'
+
+
+def push_file(server, path, version, update=False, allow_unsigned=False):
+    '''
+    Uploads a model file to the registry, named after the file. Runs in the workers of the pool.
+    '''
+    start = time.perf_counter()
+    name = os.path.splitext(os.path.basename(path))[0]
+    try:
+        model = load_model(path)
+        if not allow_unsigned and not hasattr(model, 'ml_fingerprint_data'):
+            return _result(path, 'failed', start, name=name, error="The model is not signed.")
+        supervised, model_type = model_category(model)
+        send = server.update_model if update else server.insert_model
+        res = send(model, name, supervised, model_type, {}, version, {'file': os.path.basename(path)},
+                   datetime.now(), 'Pushed with the ml-fingerprint command.')
+        nbytes = os.path.getsize(path)
+        if res.status_code == 200:
+            return _result(path, 'updated' if update else 'pushed', start, nbytes, name=name)
+        if res.status_code == 400 and 'already exists' in res.text:
+            # Already in the registry: nothing to sync
+            return _result(path, 'exists', start, name=name)
+        return _result(path, 'failed', start, name=name, error="%d %s" % (res.status_code, res.text))
+    except Exception as e:
+        return _result(path, 'failed', start, name=name, error=str(e))
+
+
+def pull_model(server, name, directory, public_key, file_format='joblib', version=None, skip_existing=False):
+    '''
+    Downloads a model, verifies it and saves it in directory. Runs in the workers of the pool.
+    '''
+    start = time.perf_counter()
+    path = os.path.join(directory, name + EXTENSIONS[file_format])
+    if skip_existing and os.path.exists(path):
+        return _result(path, 'exists', start, name=name)
+    try:
+        model = server.get_model(name, public_key, version)
+        if model is None:
+            return _result(path, 'failed', start, name=name, error="The model couldn't be downloaded.")
+        save_model(model, path)
+        return _result(path, 'pulled', start, os.path.getsize(path), name=name)
+    except Exception as e:
+        return _result(path, 'failed', start, name=name, error=str(e))
+
+
+def run_pool(function, tasks, jobs, processes, out):
+    '''
+    Runs function(*task) for every task in a pool of jobs workers, printing every
+    result as it completes. Returns the results in the order of the tasks.
+    '''
+    results = [None] * len(tasks)
+    if jobs <= 1:
+        for i, task in enumerate(tasks):
+            results[i] = function(*task)
+            print_result(results[i], out)
+        return results
+    executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor_class(jobs) as executor:
+        futures = {executor.submit(function, *task): i for i, task in enumerate(tasks)}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            print_result(results[futures[future]], out)
+    return results
+
+
+def print_result(result, out):
+    line = "%-8s %8.3f s %10.1f MB  %s" % (result['status'], result['seconds'], result['bytes'] / 1e6, result['path'])
+    if result.get('error'):
+        line += "  (" + result['error'] + ")"
+    print(line, file=out)
+
+
+def summarize(command, results, elapsed, jobs):
+    '''
+    Returns the summary of a command: the number of files of every status and the throughput.
+    '''
+    statuses = {}
+    for result in results:
+        statuses[result['status']] = statuses.get(result['status'], 0) + 1
+    total_bytes = sum(result['bytes'] for result in results)
+    return {'command': command, 'jobs': jobs, 'files': len(results), 'statuses': statuses, 'elapsed_s': elapsed,
+            'bytes': total_bytes, 'files_per_s': len(results) / elapsed if elapsed else None,
+            'mb_per_s': total_bytes / 1e6 / elapsed if elapsed else None}
+
+
+def finish(args, results, elapsed, out, failed=('failed', 'invalid')):
+    '''
+    Prints the summary, writes the report and returns the exit status.
+    '''
+    summary = summarize(args.command, results, elapsed, args.jobs)
+    print("%d files (%s) in %.2f s: %.1f files/s, %.1f MB/s" % (
+        summary['files'], ', '.join('%d %s' % (n, status) for status, n in sorted(summary['statuses'].items())),
+        elapsed, summary['files_per_s'] or 0, summary['mb_per_s'] or 0), file=out)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(dict(summary, results=results), f, indent=4)
+    return 1 if any(result['status'] in failed for result in results) else 0
+
+
+def remote_server(args):
+    from .remote import RemoteServer
+    if not args.url or not args.api_key:
+        raise SystemExit("The registry is needed: give --url and --api-key (or ML_FINGERPRINT_URL and ML_FINGERPRINT_API_KEY).")
+    return RemoteServer(args.url, args.api_key, unsafe_https=args.unsafe_https, serializer_bytes=args.serializer,
+                        delta=args.delta)
+
+
+def command_sign(args, out):
+    tasks = []
+    for arg in args.paths:
+        # With --output, the files keep their path relative to the directory they were found in
+        base = arg if os.path.isdir(arg) else os.path.dirname(arg)
+        for path in find_models([arg]):
+            tasks.append((path, args.key, os.path.join(args.output, os.path.relpath(path, base)) if args.output else None))
+    start = time.perf_counter()
+    results = run_pool(sign_file, tasks, args.jobs, True, out)
+    return finish(args, results, time.perf_counter() - start, out)
+
+
+def command_verify(args, out):
+    tasks = [(path, args.key) for path in find_models(args.paths)]
+    start = time.perf_counter()
+    results = run_pool(verify_file, tasks, args.jobs, True, out)
+    return finish(args, results, time.perf_counter() - start, out)
+
+
+def command_push(args, out):
+    server = remote_server(args)
+    tasks = [(server, path, args.version, args.update, args.allow_unsigned) for path in find_models(args.paths)]
+    start = time.perf_counter()
+    results = run_pool(push_file, tasks, args.jobs, False, out)
+    return finish(args, results, time.perf_counter() - start, out)
+
+
+def command_pull(args, out):
+    from . import keyring
+    server = remote_server(args)
+    public_key = keyring.Keyring.from_files(args.key)
+    names = args.name or [model['name'] for model in server.get_list_models() or []]
+    os.makedirs(args.directory, exist_ok=True)
+    tasks = [(server, name, args.directory, public_key, args.format, args.model_version, args.skip_existing) for name in names]
+    start = time.perf_counter()
+    results = run_pool(pull_model, tasks, args.jobs, False, out)
+    return finish(args, results, time.perf_counter() - start, out)
+
+
+def command_bench(args, out):
+    '''
+    Loads (from the given files, or builds with example_models), signs and verifies
+    every model --repeat times in this process, one after another, and reports the
+    best time of every step.
+    '''
+    from . import ml_fingerprint, serving, digests
+    from Crypto.PublicKey import RSA, ECC
+    ml_fingerprint.decorate_base_estimator()
+    private_key = ECC.generate(curve='ed25519') if args.key_type == 'ed25519' else RSA.generate(2048)
+    public_key = private_key.public_key()
+
+    if args.paths:
+        models = []
+        for path in find_models(args.paths):
+            start = time.perf_counter()
+            model = load_model(path)
+            models.append((path, model, time.perf_counter() - start))
+    else:
+        from . import example_models
+        scale = args.scale
+        models = [('synthetic:RandomForest', example_models.large_random_forest(n_trees=25 * scale), None),
+                  ('synthetic:SVC', example_models.large_svc(n_support_vectors=1000 * scale), None),
+                  ('synthetic:MLP', example_models.large_mlp(hidden_layer_sizes=(128 * scale, 128 * scale)), None),
+                  ('synthetic:TextPipeline', example_models.large_text_pipeline(vocabulary_size=20000 * scale), None)]
+
+    results = []
+    print("%10s %10s %10s %10s  %s" % ('size', 'load', 'sign', 'verify', 'model'), file=out)
+    for path, model, load_time in models:
+        times = {'sign': [], 'verify': []}
+        for i in range(args.repeat):
+            # Signed as a new model every time, without the digests of the previous run
+            digests._caches.pop(model, None)
+            model.__dict__.pop('ml_fingerprint_data', None)
+            start = time.perf_counter()
+            model.sign(private_key)
+            times['sign'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            model.verify(public_key)
+            times['verify'].append(time.perf_counter() - start)
+        result = {'path': path, 'bytes': serving.estimate_nbytes(model), 'load_s': load_time,
+                  'sign_s': min(times['sign']), 'verify_s': min(times['verify'])}
+        results.append(result)
+        print("%7.1f MB %10s %8.4f s %8.4f s  %s" % (result['bytes'] / 1e6, '-' if load_time is None else '%8.4f s' % load_time,
+                                                     result['sign_s'], result['verify_s'], path), file=out)
+    total_bytes = sum(result['bytes'] for result in results)
+    for step in ('sign', 'verify'):
+        seconds = sum(result[step + '_s'] for result in results)
+        print("%-6s %d models in %.3f s: %.1f models/s, %.1f MB/s" % (
+            step, len(results), seconds, len(results) / seconds, total_bytes / 1e6 / seconds), file=out)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'command': 'bench', 'key_type': args.key_type, 'repeat': args.repeat, 'results': results}, f, indent=4)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='ml-fingerprint', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_common(subparser):
+        subparser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1, help="Workers of the pool.")
+        subparser.add_argument('--report', help="Write the results as JSON to this file.")
+
+    def add_registry(subparser):
+        subparser.add_argument('--url', default=os.getenv('ML_FINGERPRINT_URL'), help="URL of the registry.")
+        subparser.add_argument('--api-key', default=os.getenv('ML_FINGERPRINT_API_KEY'), help="API key of the registry.")
+        subparser.add_argument('--serializer', default='pickle', help="serializer_bytes of the uploads (see remote.encode_model()).")
+        subparser.add_argument('--delta', action='store_true', help="Send and receive the models in chunks (see RemoteServer).")
+        subparser.add_argument('--unsafe-https', action='store_true', help="Don't check the certificate of the registry.")
+
+    sign = subparsers.add_parser('sign', help="Sign model files.")
+    sign.add_argument('paths', nargs='+', help="Model files or directories.")
+    sign.add_argument('--key', required=True, help="Private key (PEM, RSA or Ed25519).")
+    sign.add_argument('--output', help="Write the signed models under this directory instead of replacing the files.")
+    add_common(sign)
+
+    verify = subparsers.add_parser('verify', help="Verify model files.")
+    verify.add_argument('paths', nargs='+', help="Model files or directories.")
+    verify.add_argument('--key', required=True, action='append', help="Trusted public key (PEM). Can be given many times.")
+    add_common(verify)
+
+    push = subparsers.add_parser('push', help="Upload model files to the registry, named after the files.")
+    push.add_argument('paths', nargs='+', help="Model files or directories.")
+    push.add_argument('--version', required=True, help="Version of the uploaded models.")
+    push.add_argument('--update', action='store_true', help="Replace the models that already have this version.")
+    push.add_argument('--allow-unsigned', action='store_true', help="Upload models that are not signed too.")
+    add_registry(push)
+    add_common(push)
+
+    pull = subparsers.add_parser('pull', help="Download and verify models of the registry into a directory.")
+    pull.add_argument('directory', help="Where the models are saved, as NAME.joblib (see --format).")
+    pull.add_argument('--key', required=True, action='append', help="Trusted public key (PEM). Can be given many times.")
+    pull.add_argument('--name', action='append', help="Model to download (by default, all of them). Can be given many times.")
+    pull.add_argument('--model-version', help="Version to download (by default, the latest one).")
+    pull.add_argument('--format', choices=sorted(EXTENSIONS), default='joblib', help="Format of the saved files.")
+    pull.add_argument('--skip-existing', action='store_true', help="Don't download the models that already have a file.")
+    add_registry(pull)
+    add_common(pull)
+
+    bench = subparsers.add_parser('bench', help="Measure how long loading, signing and verifying models takes.")
+    bench.add_argument('paths', nargs='*', help="Model files or directories (by default, synthetic models).")
+    bench.add_argument('--scale', type=int, default=1, help="Size of the synthetic models (see example_models).")
+    bench.add_argument('--key-type', choices=('rsa', 'ed25519'), default='rsa')
+    bench.add_argument('--repeat', type=int, default=3, help="Runs of every step; the best one is reported.")
+    bench.add_argument('--report', help="Write the results as JSON to this file.")
+    return parser
+
+
+COMMANDS = {'sign': command_sign, 'verify': command_verify, 'push': command_push, 'pull': command_pull,
+            'bench': command_bench}
+
+
+def main(argv=None):
+    '''
+    Entry point of the ml-fingerprint command. Returns the exit status.
+    '''
+    args = build_parser().parse_args(argv)
+    if args.command != 'bench':
+        args.jobs = max(1, args.jobs)
+    out = sys.stdout
+    # The library prints a line for every model it signs or verifies: keep the output to the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        return COMMANDS[args.command](args, out)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,394 @@
+'''
+Per-attribute digests of a model, used by the per-attribute signature schemes.
+
+Instead of serializing the whole model into a single JSON document and hashing
+it, every attribute gets its own SHA256 digest, and the signature covers the
+table of digests. Numpy arrays are hashed from their raw bytes (plus dtype and
+shape), which is much faster than formatting them as JSON text; any other
+attribute is hashed from its orjson serialization.
+
+Values orjson can't serialize are hashed recursively: the digest of a nested
+estimator (the steps of a Pipeline, the trees of a forest, the best estimator
+of a search...) covers its class and the digests of its attributes, and other
+objects are hashed from their class and the state they would be pickled with.
+Estimators shared by several parents are only hashed once, and long lists of
+estimators are hashed in parallel.
+
+Since only the table is signed, re-signing a model only needs to hash again the
+arrays that changed. The digests computed for a model are remembered (while the
+model is alive) together with a token that tells if the array may have changed
+since, see DigestCache.
+'''
+import os
+import zlib
+import hashlib
+import weakref
+import copyreg
+import orjson
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from numpy.lib.format import dtype_to_descr
+from sklearn import base
+
+# 'attributes-v1' only hashed what orjson could serialize and excluded the rest.
+# 'attributes-v2' gives the same digests for those values and also hashes the rest.
+# 'attributes-v3' hashes the padding bytes of structured arrays as zeros (see array_digest()).
+SCHEME = 'attributes-v3'
+SCHEMES = ('attributes-v1', 'attributes-v2', 'attributes-v3')
+
+# Values hashed from their JSON serialization. From 'attributes-v2' on, dataclasses and dates are
+# hashed as objects, the way ml_fingerprint.manifest stores them.
+_JSON_OPTIONS = {'attributes-v1': orjson.OPT_SERIALIZE_NUMPY,
+                 'attributes-v2': orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_DATETIME,
+                 'attributes-v3': orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_DATETIME}
+
+# Schemes that hash the padding of structured arrays as it is in memory.
+_RAW_PADDING_SCHEMES = ('attributes-v1', 'attributes-v2')
+
+# Lists of estimators at least this long are hashed in parallel.
+PARALLEL_MIN_ITEMS = 32
+
+
+class DigestCache():
+    """
+    Digests of the arrays of a model from its last signature, keyed by their
+    path in the model (attribute names and indices from the model down to the
+    array), along with the token of the array when it was hashed.
+
+    The token holds the address, shape, strides and dtype of the array.
+    Read-only arrays (e.g. memory-mapped) can't be modified through the model,
+    so that and their identity are enough for them. Writable arrays can be
+    modified in place (partial_fit does that), so their token also holds a
+    CRC32 of their content, which is cheaper to compute than the SHA256 it may save.
+    """
+    def __init__(self):
+        self.entries = {}
+
+    def lookup(self, path, array):
+        '''
+        Returns the cached digest of the array if it hasn't changed, None otherwise,
+        and the token to store along with its new digest.
+        '''
+        token = _array_token(array)
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == token:
+            return entry[1], token
+        return None, token
+
+    def store(self, path, token, digest):
+        self.entries[path] = (token, digest)
+
+
+_caches = weakref.WeakKeyDictionary()
+
+
+def digest_cache(model):
+    '''
+    Returns the DigestCache of a model, creating it if needed. It is dropped
+    along with the model.
+    '''
+    cache = _caches.get(model)
+    if cache is None:
+        cache = _caches[model] = DigestCache()
+    return cache
+
+
+def _class_path(cls):
+    return cls.__module__ + ':' + cls.__qualname__
+
+
+def _contiguous(array):
+    '''
+    Returns the order ('C' or 'F') and a C-contiguous view (or copy) of the array
+    whose bytes are hashed.
+    '''
+    if array.flags.c_contiguous:
+        return 'C', array
+    if array.flags.f_contiguous:
+        return 'F', array.T
+    return 'C', np.ascontiguousarray(array)
+
+
+def _raw_bytes(array):
+    return array.reshape(-1).view(np.uint8)
+
+
+def _array_token(array):
+    token = (array.__array_interface__['data'][0], array.shape, array.strides, array.dtype.str)
+    if array.flags.writeable:
+        return token + (zlib.crc32(_raw_bytes(_contiguous(array)[1])),)
+    return token + (id(array),)
+
+
+def _has_padding(dtype):
+    if dtype.names is None:
+        return False
+    fields = [dtype.fields[name][0] for name in dtype.names]
+    return sum(field.itemsize for field in fields) < dtype.itemsize or any(_has_padding(field) for field in fields)
+
+
+def _without_padding(array):
+    '''
+    Returns a copy of a structured array with the padding bytes between (and after)
+    its fields set to zero.
+    '''
+    clean = np.zeros(array.shape, dtype=array.dtype)
+    for name in array.dtype.names:
+        if _has_padding(array.dtype.fields[name][0]):
+            clean[name] = _without_padding(array[name])
+        else:
+            clean[name] = array[name]
+    return clean
+
+
+def array_digest(array, zero_padding=True):
+    '''
+    Returns the hex SHA256 digest of a numpy array (without Python objects in it),
+    covering its dtype, shape, memory order and raw bytes.
+
+    The padding bytes of structured dtypes (like the nodes of a tree) are left
+    uninitialized by whatever created the array, e.g. unpickling a tree, so two
+    copies of the same array may differ there. With zero_padding they are hashed
+    as zeros, which is what 'attributes-v3' does; the older schemes hash them as
+    they are.
+    '''
+    if zero_padding and _has_padding(array.dtype):
+        array = _without_padding(array)
+    order, data = _contiguous(array)
+    h = hashlib.sha256(b'ndarray:')
+    h.update(orjson.dumps([dtype_to_descr(array.dtype), array.shape, order]))
+    h.update(_raw_bytes(data))
+    return h.hexdigest()
+
+
+def _is_raw_array(value):
+    return type(value) is np.ndarray and not value.dtype.hasobject
+
+
+def _has_arrays(value):
+    if isinstance(value, dict):
+        return all(isinstance(k, str) for k in value) and any(_is_raw_array(v) or _has_arrays(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_is_raw_array(v) or _has_arrays(v) for v in value)
+    return False
+
+
+def reduction(value):
+    '''
+    Returns how an object that is not an array, a container or plain data is hashed:
+    a tuple with its kind, its class and the values it is rebuilt from, mirroring
+    the entries of ml_fingerprint.manifest so both give the same digests.
+
+    Raises
+    ------
+    TypeError
+        If the object is not supported.
+    '''
+    if isinstance(value, type):
+        return ('class', _class_path(value))
+    if isinstance(value, base.BaseEstimator):
+        return ('estimator', _class_path(type(value)), value.__dict__)
+    if isinstance(value, np.random.RandomState):
+        return ('randomstate', None, value.get_state())
+    if isinstance(value, np.random.Generator):
+        return ('generator', type(value.bit_generator).__name__, value.bit_generator.state)
+    if isinstance(value, np.ma.MaskedArray):
+        return ('masked', None, value.data, np.ma.getmaskarray(value))
+    if isinstance(value, np.ufunc):
+        return ('global', 'numpy:' + value.__name__)
+    try:
+        reduced = value.__reduce_ex__(4)
+    except Exception:
+        reduced = None
+    if isinstance(reduced, str):
+        # Functions and other objects pickled by reference
+        return ('global', str(getattr(value, '__module__', None)) + ':' + reduced)
+    if isinstance(reduced, tuple) and len(reduced) >= 2 and all(r is None for r in reduced[3:]):
+        state = reduced[2] if len(reduced) > 2 else None
+        if reduced[0] is type(value):
+            return ('reduce', _class_path(type(value)), reduced[1], state)
+        if reduced[0] is copyreg.__newobj__ and reduced[1] == (type(value),):
+            return ('object', _class_path(type(value)), state)
+        if getattr(reduced[0], '__name__', None) == '__pyx_unpickle_' + type(value).__name__ and reduced[1][0] is type(value):
+            return ('cython', _class_path(type(value)), reduced[1][1:], state)
+    raise TypeError("Values of type %s can't be hashed." % _class_path(type(value)))
+
+
+class _Hasher():
+    """
+    Computes the digests of one model. Nested objects are remembered by identity
+    during the whole computation, so those shared by several parents (or listed
+    twice) are only hashed once.
+    """
+    def __init__(self, cache=None, n_jobs=None, scheme=SCHEME):
+        self.cache = cache
+        self.json_options = _JSON_OPTIONS[scheme]
+        self.zero_padding = scheme not in _RAW_PADDING_SCHEMES
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        self.memo = {}
+        self.executor = None
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def digest(self, value, path=(), parallel=True):
+        if _is_raw_array(value):
+            if self.cache is None:
+                return array_digest(value, self.zero_padding)
+            digest, token = self.cache.lookup(path, value)
+            if digest is None:
+                digest = array_digest(value, self.zero_padding)
+                self.cache.store(path, token, digest)
+            return digest
+        if _has_arrays(value):
+            return self.container_digest(value, path, parallel)
+        try:
+            serialized = orjson.dumps(value, option=self.json_options)
+        except TypeError:
+            return self.object_digest(value, path, parallel)
+        return hashlib.sha256(b'json:' + serialized).hexdigest()
+
+    def container_digest(self, value, path, parallel):
+        if isinstance(value, dict):
+            if all(isinstance(k, str) for k in value):
+                h = hashlib.sha256(b'dict:')
+                for k, v in sorted(value.items()):
+                    h.update(orjson.dumps([k, self.digest(v, path + (k,), parallel)]))
+            else:
+                h = hashlib.sha256(b'mapping:')
+                entries = sorted([self.digest(k, path, parallel), self.digest(v, path + (i,), parallel)]
+                                 for i, (k, v) in enumerate(value.items()))
+                h.update(orjson.dumps(entries))
+            return h.hexdigest()
+        if isinstance(value, np.ndarray):
+            h = hashlib.sha256(b'objarray:')
+            h.update(orjson.dumps(value.shape))
+            items = value.ravel()
+        else:
+            h = hashlib.sha256(b'list:' if isinstance(value, list) else b'tuple:')
+            items = value
+        for i, digest in enumerate(self.item_digests(items, path, parallel)):
+            h.update(orjson.dumps([i, digest]))
+        return h.hexdigest()
+
+    def item_digests(self, items, path, parallel):
+        if parallel and self.n_jobs > 1 and len(items) >= PARALLEL_MIN_ITEMS and isinstance(items[0], base.BaseEstimator):
+            # Hashing releases the GIL for large buffers, so the trees of a forest are hashed in threads.
+            # Their own children are hashed sequentially inside each task.
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.n_jobs)
+            return list(self.executor.map(lambda i: self.digest(items[i], path + (i,), False), range(len(items))))
+        return [self.digest(item, path + (i,), parallel) for i, item in enumerate(items)]
+
+    def object_digest(self, value, path, parallel):
+        if isinstance(value, (list, tuple, dict)) or (type(value) is np.ndarray and value.dtype == object):
+            return self.container_digest(value, path, parallel)
+        if type(value) is int:
+            return hashlib.sha256(b'int:' + str(value).encode('ascii')).hexdigest()
+        if isinstance(value, bytes):
+            return hashlib.sha256(b'bytes:' + value).hexdigest()
+        if isinstance(value, np.dtype):
+            return hashlib.sha256(b'dtype:' + orjson.dumps(dtype_to_descr(value))).hexdigest()
+
+        entry = self.memo.get(id(value))
+        if entry is not None:
+            return entry[1]
+        reduce = getattr(value, 'digest_reduction', None)
+        reduced = reduce() if reduce is not None else reduction(value)
+        h = hashlib.sha256(b'object:')
+        h.update(orjson.dumps(list(reduced[:2])))
+        if reduced[0] == 'estimator':
+            digests, _ = self.attribute_digests(reduced[2], [], path, parallel)
+            h.update(orjson.dumps(sorted(digests.items())))
+        else:
+            for i, part in enumerate(reduced[2:]):
+                h.update(orjson.dumps([i, self.digest(part, path + (i,), parallel)]))
+        digest = h.hexdigest()
+        # The object is kept in the memo, so its id can't be reused while hashing
+        self.memo[id(value)] = (value, digest)
+        return digest
+
+    def attribute_digests(self, attributes, excluded=None, path=(), parallel=True):
+        detect = excluded is None
+        if detect:
+            excluded = []
+        digests = {}
+        for k, v in attributes.items():
+            if k == 'ml_fingerprint_data' or (not detect and k in excluded):
+                continue
+            try:
+                digests[k] = self.digest(v, path + (k,), parallel)
+            except TypeError:
+                if not detect:
+                    raise
+                excluded.append(k)
+        return digests, excluded
+
+
+def value_digest(value, cache=None, scheme=SCHEME):
+    '''
+    Returns the hex SHA256 digest of an attribute value.
+
+    Arrays are hashed with array_digest(). Lists, tuples and dicts holding arrays
+    are hashed from the digests of their items, so every array in them can be
+    reused from the cache on its own. Values orjson can serialize are hashed from
+    their serialization, and the rest recursively (see the module description).
+
+    Raises
+    ------
+    TypeError
+        If the value (or part of it) can't be hashed.
+    '''
+    hasher = _Hasher(cache, scheme=scheme)
+    try:
+        return hasher.digest(value)
+    finally:
+        hasher.close()
+
+
+def attribute_digests(attributes, excluded=None, cache=None, n_jobs=None, scheme=SCHEME):
+    '''
+    Computes the digest of every attribute of a model, skipping ml-fingerprint's
+    own data and the excluded attributes.
+
+    Parameters
+    ----------
+    attributes : dict
+        The attributes of the model (its __dict__).
+    excluded : list, optional
+        Names of the attributes to skip. If None, every attribute that can't be
+        hashed is skipped.
+    cache : DigestCache, optional
+        Digests of a previous signature of the same model, which are reused
+        for the arrays that haven't changed (and updated for those that have).
+    n_jobs : int, optional
+        Number of threads used to hash long lists of estimators. Defaults to
+        the number of CPUs.
+    scheme : str, optional
+        Signature scheme the digests are computed for (one of SCHEMES).
+
+    Returns
+    -------
+    digests : dict
+        Hex digest of every attribute, by name.
+    excluded : list
+        Names of the attributes that were skipped.
+    '''
+    hasher = _Hasher(cache, n_jobs, scheme)
+    try:
+        return hasher.attribute_digests(attributes, excluded)
+    finally:
+        hasher.close()
+
+
+def signed_message(fingerprint_data):
+    '''
+    Returns the bytes that are hashed and signed for a model: the scheme, the
+    table of digests and the list of excluded attributes.
+    '''
+    return orjson.dumps({'scheme': fingerprint_data['scheme'],
+                         'digests': fingerprint_data['digests'],
+                         'excluded_data': fingerprint_data['excluded_data']},
+                        option=orjson.OPT_SORT_KEYS)
@@ -13,4 +13,11 @@ class VerificationError(Exception):
     to decrypt the model isn't the counterpart of the private key used to
     sign it.
     """
+    pass
+
+class UnsupportedModel(Exception):
+    """
+    Exception raised when a model can't be represented in the requested format,
+    or a serialized model refers to a class that is not trusted.
+    """
     pass
\ No newline at end of file
@@ -0,0 +1,272 @@
+'''
+Keys used to verify models, loaded once and reused.
+
+Verification services used to parse the public key from PEM (often read from the
+``key`` table of the database) every time, and build a new verifier object for
+every model. A Keyring parses every key once and keeps the key and its verifier,
+indexed by the key's id (the SHA-256 of its public half, in DER). sign() stores
+that id in the model's ml_fingerprint_data, so verifying with a keyring picks
+the right key at once, even while several keys are in use (e.g. during a key
+rotation), instead of trying every one of them.
+
+The key id is not part of the signed message: it only tells which key to try.
+Changing it can only make the verification fail.
+
+Two kinds of keys are supported: RSA (PKCS#1 v1.5 signatures of the SHA-256 of the
+message) and Ed25519 (pure EdDSA, RFC 8032).
+'''
+import hashlib
+import functools
+from Crypto.PublicKey import RSA, ECC
+from Crypto.Hash import SHA256
+from Crypto.Signature import pkcs1_15, eddsa
+from . import exceptions
+
+# DER DigestInfo of SHA-256 (RFC 8017, 9.2 note 1), with and without the NULL parameters
+_SHA256_DIGEST_INFO = (bytes.fromhex('3031300d060960864801650304020105000420'),
+                       bytes.fromhex('302f300b06096086480165030402010420'))
+
+
+def _is_ed25519(key):
+    return isinstance(key, ECC.EccKey) and key.curve in ('Ed25519', 'ed25519')
+
+
+def _public_half(key):
+    return key.public_key() if key.has_private() else key
+
+
+class RSAVerifier():
+    """
+    Verifies PKCS#1 v1.5 signatures (SHA-256) of one RSA public key.
+
+    Everything that depends only on the key (modulus, exponent, padding) is computed
+    once, so checking a signature is a single modular exponentiation and a comparison
+    of the encoded message, as in RFC 8017 8.2.2.
+
+    Attributes
+    ----------
+    key : Crypto.PublicKey.RSA.RsaKey
+        The public key.
+    """
+    def __init__(self, key):
+        self.key = key
+        self.n = int(key.n)
+        self.e = int(key.e)
+        self.size = (self.n.bit_length() + 7) // 8
+        self.prefixes = tuple(b'\x00\x01' + b'\xff' * (self.size - len(info) - 32 - 3) + b'\x00' + info
+                              for info in _SHA256_DIGEST_INFO)
+
+    def verify(self, message, signature):
+        '''
+        Raises ValueError if signature is not a valid signature of message.
+        '''
+        if len(signature) != self.size:
+            raise ValueError("Invalid signature")
+        s = int.from_bytes(signature, 'big')
+        if s >= self.n:
+            raise ValueError("Invalid signature")
+        encoded = pow(s, self.e, self.n).to_bytes(self.size, 'big')
+        digest = hashlib.sha256(message).digest()
+        if encoded not in (prefix + digest for prefix in self.prefixes):
+            raise ValueError("Invalid signature")
+
+
+class Ed25519Verifier():
+    """
+    Verifies Ed25519 (RFC 8032) signatures of one public key.
+
+    Attributes
+    ----------
+    key : Crypto.PublicKey.ECC.EccKey
+        The public key.
+    """
+    def __init__(self, key):
+        self.key = key
+        self.scheme = eddsa.new(key, 'rfc8032')
+
+    def verify(self, message, signature):
+        '''
+        Raises ValueError if signature is not a valid signature of message.
+        '''
+        self.scheme.verify(message, signature)
+
+
+def new_verifier(key):
+    '''
+    Returns the verifier (RSAVerifier or Ed25519Verifier) of a public key.
+    '''
+    key = _public_half(key)
+    if _is_ed25519(key):
+        return Ed25519Verifier(key)
+    if isinstance(key, RSA.RsaKey):
+        return RSAVerifier(key)
+    raise TypeError("Unsupported key type: " + type(key).__name__)
+
+
+def sign_message(private_key, message):
+    '''
+    Signs message with an RSA (PKCS#1 v1.5 over its SHA-256) or Ed25519 private key.
+
+    Returns
+    -------
+    bytes
+        The signature.
+    '''
+    if _is_ed25519(private_key):
+        return eddsa.new(private_key, 'rfc8032').sign(message)
+    return pkcs1_15.new(private_key).sign(SHA256.new(message))
+
+
+def key_id(key):
+    '''
+    Returns the id of a key: the hex SHA-256 of its public half, DER-encoded.
+    A private key and its public key have the same id.
+
+    Parameters
+    ----------
+    key : Crypto.PublicKey.RSA.RsaKey or Crypto.PublicKey.ECC.EccKey
+        A public or private key.
+
+    Returns
+    -------
+    str
+        The id of the key.
+    '''
+    return hashlib.sha256(_public_half(key).export_key(format='DER')).hexdigest()
+
+
+@functools.lru_cache(maxsize=256)
+def _import_key(data):
+    try:
+        return RSA.import_key(data)
+    except ValueError:
+        return ECC.import_key(data)
+
+
+def load_key(data):
+    '''
+    Parses a key (PEM or DER). The same data is only parsed once per process.
+
+    Parameters
+    ----------
+    data : bytes or str
+        The exported key.
+
+    Returns
+    -------
+    Crypto.PublicKey.RSA.RsaKey or Crypto.PublicKey.ECC.EccKey
+        The key.
+    '''
+    if isinstance(data, str):
+        data = data.encode('ascii')
+    return _import_key(bytes(data))
+
+
+class Keyring():
+    """
+    Set of trusted public keys, with their verifiers, indexed by key id.
+
+    A Keyring can be given to verify() (and everything that calls it, like
+    RemoteServer.get_model()) instead of a single public key.
+
+    Attributes
+    ----------
+    keys : dict
+        {key id: public key} of the keys in the keyring.
+    verifiers : dict
+        {key id: verifier} of the keys in the keyring, built once per key.
+    """
+    def __init__(self, keys=()):
+        self.keys = {}
+        self.verifiers = {}
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        '''
+        Adds a key to the keyring, if it isn't there yet.
+
+        Parameters
+        ----------
+        key : Crypto.PublicKey.RSA.RsaKey, Crypto.PublicKey.ECC.EccKey, bytes or str
+            The key (RSA or Ed25519), or its PEM/DER export. Only its public half is kept.
+
+        Returns
+        -------
+        str
+            The id of the key.
+        '''
+        if isinstance(key, (bytes, bytearray, str)):
+            key = load_key(key)
+        key = _public_half(key)
+        kid = key_id(key)
+        if kid not in self.keys:
+            self.keys[kid] = key
+            self.verifiers[kid] = new_verifier(key)
+        return kid
+
+    def remove(self, kid):
+        '''
+        Removes a key (i.e. a revoked key) from the keyring. Models signed
+        with it won't be verified anymore.
+        '''
+        self.keys.pop(kid, None)
+        self.verifiers.pop(kid, None)
+
+    def __contains__(self, kid):
+        return kid in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def candidates(self, fingerprint_data):
+        '''
+        Returns the verifiers that can have signed a model, given its ml_fingerprint_data:
+        the one of its key id, or all of them for models signed without a key id.
+
+        Raises
+        ------
+        ml_fingerprint.exceptions.VerificationError
+            If the model was signed with a key that is not in the keyring.
+        '''
+        kid = fingerprint_data.get('key_id')
+        if kid is None:
+            return list(self.verifiers.values())
+        if kid not in self.verifiers:
+            raise exceptions.VerificationError("The model was signed with a key that is not in the keyring: " + str(kid))
+        return [self.verifiers[kid]]
+
+    @classmethod
+    def from_files(cls, paths):
+        '''
+        Builds a keyring with the keys in the given PEM files.
+        '''
+        keyring = cls()
+        for path in paths:
+            with open(path, 'rb') as f:
+                keyring.add(f.read())
+        return keyring
+
+    @classmethod
+    def from_database(cls, database='ml_fingerprint_database.db'):
+        '''
+        Builds a keyring with the public keys stored in the 'key' table of a
+        database (see ml_fingerprint.remote.put_key_in_db()).
+        '''
+        import sqlite3
+        conn = sqlite3.connect(database)
+        try:
+            rows = conn.execute('select publickey from key').fetchall()
+        finally:
+            conn.close()
+        return cls(row[0] for row in rows)
+
+
+def verifiers(public_key, fingerprint_data):
+    '''
+    Returns the verifiers to check a signature with: those the keyring picks
+    for it, or the verifier of a single public key.
+    '''
+    if isinstance(public_key, Keyring):
+        return public_key.candidates(fingerprint_data)
+    return [new_verifier(public_key)]
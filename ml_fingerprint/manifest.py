@@ -0,0 +1,423 @@
+'''
+Safe format to store and transfer models without pickle.
+
+A model is described by a JSON manifest with the class of the estimator and all
+its attributes. Fitted arrays are not written into the manifest: they are stored
+as raw buffers (like the data section of a .npy file) after it, using the same
+aligned layout as ml_fingerprint.serialization:
+
+    MAGIC | manifest | buffer 0 | buffer 1 | ... | footer | footer length | MAGIC
+
+Loading never runs pickle. Estimators are only created from classes of trusted
+modules (scikit-learn and numpy by default), without calling their constructor.
+Any other object is only created if its class is in CONSTRUCTIBLE_CLASSES, an
+explicit list of the helper classes fitted models hold (trees, losses, kernels...),
+so a manifest can't call things like numpy.memmap that touch files. The signature
+of the model can be checked over the manifest and the buffers before anything is built.
+'''
+import math
+import base64
+import copyreg
+import importlib
+import numpy as np
+import orjson
+from numpy.lib.format import dtype_to_descr, descr_to_dtype
+from sklearn import base
+from . import serialization, exceptions, ml_fingerprint
+
+MAGIC = b'MLFPMAN1'
+FORMAT_VERSION = 1
+TRUSTED_MODULES = ('sklearn', 'numpy')
+
+# Classes (besides the estimators) whose objects can be created when a model is built,
+# by calling them, through their Cython unpickler or from their state.
+_CONSTRUCTIBLE = {
+    'sklearn.tree._tree': ('Tree',),
+    'sklearn.ensemble._hist_gradient_boosting.predictor': ('TreePredictor',),
+    'sklearn._loss.loss': ('AbsoluteError', 'ExponentialLoss', 'HalfBinomialLoss', 'HalfGammaLoss',
+                           'HalfMultinomialLoss', 'HalfPoissonLoss', 'HalfSquaredError', 'HalfTweedieLoss',
+                           'HalfTweedieLossIdentity', 'HuberLoss', 'PinballLoss'),
+    'sklearn._loss.link': ('HalfLogitLink', 'IdentityLink', 'Interval', 'LogLink', 'LogitLink', 'MultinomialLogit'),
+    'sklearn._loss._loss': ('CyAbsoluteError', 'CyExponentialLoss', 'CyHalfBinomialLoss', 'CyHalfGammaLoss',
+                            'CyHalfMultinomialLoss', 'CyHalfPoissonLoss', 'CyHalfSquaredError', 'CyHalfTweedieLoss',
+                            'CyHalfTweedieLossIdentity', 'CyHuberLoss', 'CyPinballLoss'),
+    'sklearn.linear_model._sgd_fast': ('EpsilonInsensitive', 'Hinge', 'Huber', 'Log', 'ModifiedHuber',
+                                       'SquaredEpsilonInsensitive', 'SquaredHinge', 'SquaredLoss'),
+    'sklearn.gaussian_process.kernels': ('CompoundKernel', 'ConstantKernel', 'DotProduct', 'ExpSineSquared',
+                                         'Exponentiation', 'Hyperparameter', 'Matern', 'Product', 'RBF',
+                                         'RationalQuadratic', 'Sum', 'WhiteKernel'),
+    'sklearn.model_selection._split': ('GroupKFold', 'GroupShuffleSplit', 'KFold', 'LeaveOneGroupOut', 'LeaveOneOut',
+                                       'LeavePGroupsOut', 'LeavePOut', 'PredefinedSplit', 'RepeatedKFold',
+                                       'RepeatedStratifiedKFold', 'ShuffleSplit', 'StratifiedGroupKFold',
+                                       'StratifiedKFold', 'StratifiedShuffleSplit', 'TimeSeriesSplit'),
+    'sklearn.metrics._scorer': ('_PassthroughScorer',),
+    'sklearn.calibration': ('_CalibratedClassifier',),
+    'sklearn.neural_network._stochastic_optimizers': ('AdamOptimizer', 'SGDOptimizer'),
+}
+CONSTRUCTIBLE_CLASSES = tuple(module + ':' + name for module, names in _CONSTRUCTIBLE.items() for name in names)
+_BIT_GENERATORS = ('MT19937', 'PCG64', 'PCG64DXSM', 'Philox', 'SFC64')
+
+
+def _class_path(cls):
+    return cls.__module__ + ':' + cls.__qualname__
+
+
+def _encode(value, buffers):
+    '''
+    Returns the manifest entry of a value, appending its raw buffers (if any) to buffers.
+    '''
+    if value is None or isinstance(value, (bool, str)):
+        return {'t': 'json', 'v': value}
+    if type(value) is int:
+        if -2**63 <= value < 2**63:
+            return {'t': 'json', 'v': value}
+        return {'t': 'int', 'v': str(value)}
+    if type(value) is float:
+        if math.isfinite(value):
+            return {'t': 'json', 'v': value}
+        return {'t': 'float', 'v': repr(value)}
+    if isinstance(value, bytes):
+        return {'t': 'bytes', 'v': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, np.ma.MaskedArray):
+        return {'t': 'masked', 'data': _encode(value.data, buffers), 'mask': _encode(np.ma.getmaskarray(value), buffers)}
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            if value.dtype != object:
+                raise exceptions.UnsupportedModel("Structured arrays with Python objects are not supported.")
+            return {'t': 'objarray', 'shape': list(value.shape),
+                    'items': [_encode(item, buffers) for item in value.ravel()]}
+        order = 'C'
+        if value.flags.f_contiguous and not value.flags.c_contiguous:
+            # Stored transposed, so the buffer is still C-contiguous
+            value = value.T
+            order = 'F'
+        flat = np.ascontiguousarray(value).reshape(-1)
+        buffers.append(memoryview(flat.view(np.uint8)))
+        return {'t': 'ndarray', 'dtype': dtype_to_descr(value.dtype), 'shape': list(value.shape),
+                'order': order, 'buffer': len(buffers) - 1}
+    if isinstance(value, np.generic):
+        if value.dtype.hasobject:
+            raise exceptions.UnsupportedModel("Numpy object scalars are not supported.")
+        return {'t': 'scalar', 'dtype': dtype_to_descr(value.dtype),
+                'v': base64.b64encode(value.tobytes()).decode('ascii')}
+    if isinstance(value, np.dtype):
+        return {'t': 'dtype', 'descr': dtype_to_descr(value)}
+    if isinstance(value, (list, tuple)):
+        return {'t': type(value).__name__ if type(value) in (list, tuple) else 'list',
+                'items': [_encode(item, buffers) for item in value]}
+    if isinstance(value, dict):
+        return {'t': 'dict', 'items': [[_encode(k, buffers), _encode(v, buffers)] for k, v in value.items()]}
+    if isinstance(value, type):
+        return {'t': 'class', 'class': _class_path(value)}
+    if isinstance(value, base.BaseEstimator):
+        return {'t': 'estimator', 'class': _class_path(type(value)),
+                'attributes': [[k, _encode(v, buffers)] for k, v in value.__dict__.items()]}
+    if isinstance(value, np.random.RandomState):
+        return {'t': 'randomstate', 'state': _encode(value.get_state(), buffers)}
+    if isinstance(value, np.random.Generator) and type(value.bit_generator).__name__ in _BIT_GENERATORS:
+        return {'t': 'generator', 'bit_generator': type(value.bit_generator).__name__,
+                'state': _encode(value.bit_generator.state, buffers)}
+
+    # Other objects (like the trees of the tree-based estimators or the loss functions)
+    # are supported when they can be rebuilt from their class and their state alone.
+    try:
+        reduced = value.__reduce_ex__(4)
+    except Exception:
+        reduced = None
+    if isinstance(reduced, tuple) and len(reduced) >= 2 and all(r is None for r in reduced[3:]):
+        state = reduced[2] if len(reduced) > 2 else None
+        if reduced[0] is type(value):
+            return {'t': 'reduce', 'class': _class_path(type(value)),
+                    'args': _encode(reduced[1], buffers), 'state': _encode(state, buffers)}
+        if reduced[0] is copyreg.__newobj__ and reduced[1] == (type(value),):
+            return {'t': 'object', 'class': _class_path(type(value)), 'state': _encode(state, buffers)}
+        if getattr(reduced[0], '__name__', None) == '__pyx_unpickle_' + type(value).__name__ and reduced[1][0] is type(value):
+            # Cython extension types without a custom __reduce__
+            return {'t': 'cython', 'class': _class_path(type(value)),
+                    'args': _encode(reduced[1][1:], buffers), 'state': _encode(state, buffers)}
+    raise exceptions.UnsupportedModel("Values of type %s can't be stored in a manifest." % _class_path(type(value)))
+
+
+class _Unbuilt():
+    """
+    Placeholder returned for the objects of a manifest that haven't been built.
+    """
+    def __init__(self, entry, decoder):
+        self.entry = entry
+        self.decoder = decoder
+
+    def digest_reduction(self):
+        '''
+        Returns what ml_fingerprint.digests.reduction() would for the built object,
+        so its digest can be checked without building it. Nested objects are left unbuilt.
+        '''
+        entry = self.entry
+        decode = lambda value: self.decoder.decode(value, build=False)
+        t = entry['t']
+        if t == 'class':
+            return ('class', entry['class'])
+        elif t == 'estimator':
+            return ('estimator', entry['class'], {k: decode(v) for k, v in entry['attributes']})
+        elif t == 'randomstate':
+            return ('randomstate', None, decode(entry['state']))
+        elif t == 'generator':
+            return ('generator', entry['bit_generator'], decode(entry['state']))
+        elif t == 'masked':
+            return ('masked', None, decode(entry['data']), decode(entry['mask']))
+        elif t == 'reduce' or t == 'cython':
+            return (t, entry['class'], decode(entry['args']), decode(entry['state']))
+        elif t == 'object':
+            return ('object', entry['class'], decode(entry['state']))
+        raise exceptions.UnsupportedModel("Unknown manifest entry: " + str(t))
+
+
+class _Decoder():
+    def __init__(self, buffers, trusted_modules, constructible_classes):
+        self.buffers = buffers
+        self.trusted_modules = tuple(trusted_modules)
+        self.constructible_classes = frozenset(constructible_classes)
+
+    def import_class(self, path, construct=False):
+        '''
+        Imports a class of the manifest. If construct is True, objects of the class
+        are going to be created, so it must be in the constructible classes.
+        '''
+        module_name, _, qualname = path.partition(':')
+        if not any(module_name == m or module_name.startswith(m + '.') for m in self.trusted_modules):
+            raise exceptions.UnsupportedModel("The class %s is not from a trusted module." % path)
+        if construct and path not in self.constructible_classes:
+            raise exceptions.UnsupportedModel("Objects of the class %s can't be built from a manifest." % path)
+        obj = importlib.import_module(module_name)
+        for part in qualname.split('.'):
+            obj = getattr(obj, part)
+        if not isinstance(obj, type):
+            raise exceptions.UnsupportedModel("%s is not a class." % path)
+        return obj
+
+    def dtype(self, descr):
+        dtype = descr_to_dtype(_descr_from_json(descr))
+        if dtype.hasobject:
+            raise exceptions.UnsupportedModel("Arrays of Python objects must not be stored as raw buffers.")
+        return dtype
+
+    def decode(self, entry, build=True):
+        '''
+        Returns the value of a manifest entry. Arrays are views over the buffers.
+        If build is False, estimators and other objects are not instantiated
+        (nor their classes imported); a placeholder is returned instead.
+        '''
+        t = entry['t']
+        if t == 'json':
+            return entry['v']
+        elif t == 'int':
+            return int(entry['v'])
+        elif t == 'float':
+            return float(entry['v'])
+        elif t == 'bytes':
+            return base64.b64decode(entry['v'])
+        elif t == 'ndarray':
+            flat = np.frombuffer(self.buffers[entry['buffer']], dtype=self.dtype(entry['dtype']))
+            array = flat.reshape(entry['shape'])
+            return array.T if entry['order'] == 'F' else array
+        elif t == 'objarray':
+            items = [self.decode(item, build) for item in entry['items']]
+            array = np.empty(len(items), dtype=object)
+            array[:] = items
+            return array.reshape(entry['shape'])
+        elif t == 'scalar':
+            return np.frombuffer(base64.b64decode(entry['v']), dtype=self.dtype(entry['dtype']))[0]
+        elif t == 'dtype':
+            return self.dtype(entry['descr'])
+        elif t in ('list', 'tuple'):
+            items = [self.decode(item, build) for item in entry['items']]
+            return items if t == 'list' else tuple(items)
+        elif t == 'dict':
+            return {self.decode(k, build): self.decode(v, build) for k, v in entry['items']}
+        elif not build:
+            return _Unbuilt(entry, self)
+        elif t == 'class':
+            return self.import_class(entry['class'])
+        elif t == 'estimator':
+            cls = self.import_class(entry['class'])
+            if not issubclass(cls, base.BaseEstimator):
+                raise exceptions.UnsupportedModel("%s is not an estimator." % entry['class'])
+            model = cls.__new__(cls)
+            model.__dict__.update((k, self.decode(v)) for k, v in entry['attributes'])
+            return model
+        elif t == 'masked':
+            return np.ma.MaskedArray(self.decode(entry['data']), mask=self.decode(entry['mask']))
+        elif t == 'randomstate':
+            random_state = np.random.RandomState()
+            random_state.set_state(self.decode(entry['state']))
+            return random_state
+        elif t == 'generator':
+            if entry['bit_generator'] not in _BIT_GENERATORS:
+                raise exceptions.UnsupportedModel("Unknown bit generator: " + str(entry['bit_generator']))
+            bit_generator = getattr(np.random, entry['bit_generator'])()
+            bit_generator.state = self.decode(entry['state'])
+            return np.random.Generator(bit_generator)
+        elif t in ('reduce', 'object', 'cython'):
+            cls = self.import_class(entry['class'], construct=True)
+            if t == 'reduce':
+                obj = cls(*self.decode(entry['args']))
+            elif t == 'cython':
+                unpickle = getattr(importlib.import_module(cls.__module__), '__pyx_unpickle_' + cls.__name__)
+                obj = unpickle(cls, *self.decode(entry['args']))
+            else:
+                obj = cls.__new__(cls)
+            state = self.decode(entry['state'])
+            if state is not None:
+                if hasattr(obj, '__setstate__'):
+                    obj.__setstate__(state)
+                elif isinstance(state, tuple):
+                    # (__dict__, __slots__) state of classes with slots
+                    obj.__dict__.update(state[0] or {})
+                    for k, v in (state[1] or {}).items():
+                        setattr(obj, k, v)
+                else:
+                    obj.__dict__.update(state)
+            return obj
+        raise exceptions.UnsupportedModel("Unknown manifest entry: " + str(t))
+
+
+def _descr_from_json(descr):
+    # JSON turns the tuples of structured dtype descriptions into lists:
+    # [name, format] or [name, format, shape], where format can be nested.
+    if isinstance(descr, list):
+        fields = []
+        for field in descr:
+            field = list(field)
+            field[1] = _descr_from_json(field[1])
+            if len(field) > 2:
+                field[2] = tuple(field[2])
+            fields.append(tuple(field))
+        return fields
+    return descr
+
+
+def dumps_manifest(model):
+    '''
+    Describes a model as a manifest and its raw buffers.
+
+    Parameters
+    ----------
+    model : any sklearn estimator
+        The model to be serialized.
+
+    Returns
+    -------
+    manifest : bytes
+        JSON manifest of the model.
+    buffers : list of memoryview
+        Raw bytes of the fitted arrays, referenced by index from the manifest.
+
+    Raises
+    ------
+    ml_fingerprint.exceptions.UnsupportedModel
+        If the model has attributes that can't be represented without pickle.
+    '''
+    buffers = []
+    manifest = {'format': FORMAT_VERSION, 'model': _encode(model, buffers)}
+    return orjson.dumps(manifest), buffers
+
+
+def iter_manifest(model):
+    '''
+    Returns an iterator over the pieces of the serialized model (see iter_oob()
+    in ml_fingerprint.serialization), without joining them in memory.
+    '''
+    manifest, buffers = dumps_manifest(model)
+    return serialization.iter_oob(manifest, buffers, magic=MAGIC)
+
+
+def dumps(model):
+    '''
+    Serializes a model into bytes with the manifest format.
+    '''
+    return b''.join(iter_manifest(model))
+
+
+def loads(data, trusted_modules=TRUSTED_MODULES, constructible_classes=CONSTRUCTIBLE_CLASSES):
+    '''
+    Parses a model serialized with the manifest format, without building it.
+
+    Parameters
+    ----------
+    data : bytes-like
+        The serialized model. Its fitted arrays will be views over this buffer.
+    trusted_modules : tuple of str, optional
+        Packages whose estimators may be instantiated when the model is built.
+    constructible_classes : tuple of str, optional
+        Classes (as module:class) of the other objects that may be created when
+        the model is built. They must be in trusted modules too.
+
+    Returns
+    -------
+    LazyModel
+        Object that can verify the model and then build it.
+    '''
+    manifest, buffers = serialization.read_oob(data, magic=MAGIC)
+    return LazyModel(orjson.loads(manifest), buffers, trusted_modules, constructible_classes)
+
+
+class LazyModel():
+    """
+    A model in manifest format that hasn't been built yet.
+
+    Attributes
+    ----------
+    manifest : dict
+        The parsed manifest.
+    estimator : str
+        Full name of the class of the model (module:class).
+    """
+    def __init__(self, manifest, buffers, trusted_modules=TRUSTED_MODULES, constructible_classes=CONSTRUCTIBLE_CLASSES):
+        if manifest.get('format') != FORMAT_VERSION:
+            raise exceptions.UnsupportedModel("Unsupported manifest format: " + str(manifest.get('format')))
+        if manifest['model']['t'] != 'estimator':
+            raise exceptions.UnsupportedModel("The manifest doesn't describe an estimator.")
+        self.manifest = manifest
+        self.estimator = manifest['model']['class']
+        self._decoder = _Decoder(buffers, trusted_modules, constructible_classes)
+        self._attributes = None
+        self._model = None
+
+    @property
+    def attributes(self):
+        '''
+        The attributes of the model, as they would be in its __dict__. Arrays are views
+        over the serialized buffers and nested objects are left unbuilt.
+        '''
+        if self._attributes is None:
+            self._attributes = {k: self._decoder.decode(v, build=False) for k, v in self.manifest['model']['attributes']}
+        return self._attributes
+
+    def is_signed(self):
+        return 'ml_fingerprint_data' in self.attributes
+
+    def verify(self, public_key):
+        '''
+        Verifies the signature of the model over the manifest and its buffers,
+        without instantiating any class.
+
+        Parameters
+        ----------
+        public_key : Crypto.PublicKey.RSA.RsaKey
+            The public key you want to verify the model with.
+
+        Returns
+        -------
+        bool
+            True if verification succeded. If not, it will raise and exception
+            depending on the cause of the fail.
+        '''
+        return ml_fingerprint.verify_attributes(self.attributes, public_key)
+
+    def load(self):
+        '''
+        Builds the estimator (once) and returns it. Its arrays are views over
+        the serialized buffers.
+        '''
+        if self._model is None:
+            self._model = self._decoder.decode(self.manifest['model'])
+        return self._model
@@ -1,11 +1,218 @@
 from sklearn import base
 from functools import wraps # This convenience func preserves name and docstring
+import os
 import orjson
-from Crypto.PublicKey import RSA
-from Crypto.Hash import SHA256
-from Crypto.Signature import pkcs1_15
-from copy import deepcopy
-from . import exceptions
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from . import exceptions, digests, keyring
+
+
+def _serialize_attributes(attributes, excluded=None):
+    '''
+    Serializes the attributes of a model with orjson, skipping ml-fingerprint's own
+    data and the excluded attributes. This is what models signed before the
+    per-attribute digests (see ml_fingerprint.digests) were hashed from.
+
+    The output is byte for byte the same as orjson.dumps() over a copy of the model's
+    __dict__ without those attributes, but no copy of the model is made: the attributes
+    (including memory-mapped, read-only arrays) are serialized in place.
+
+    Parameters
+    ----------
+    attributes : dict
+        The attributes of the model (its __dict__).
+    excluded : list, optional
+        Names of the attributes to skip. If None, every attribute orjson can't
+        serialize is skipped.
+
+    Returns
+    -------
+    serialized_model : bytes
+        The serialized attributes, as a JSON object.
+    excluded : list
+        Names of the attributes that were skipped.
+    '''
+    detect = excluded is None
+    if detect:
+        excluded = []
+    pieces = []
+    for k, v in attributes.items():
+        if k == 'ml_fingerprint_data' or (not detect and k in excluded):
+            continue
+        try:
+            pieces.append(orjson.dumps(k) + b':' + orjson.dumps(v, option=orjson.OPT_SERIALIZE_NUMPY))
+        except TypeError:
+            if not detect:
+                raise
+            excluded.append(k)
+    return b'{' + b','.join(pieces) + b'}', excluded
+
+
+def _signed_message(attributes):
+    '''
+    Hashes the attributes of a signed model again and returns the message its signature
+    must be valid for, with the model's ml_fingerprint_data.
+
+    Raises
+    ------
+    ml_fingerprint.exceptions.ModelNotSigned
+        If the model hasn't been signed.
+    ml_fingerprint.exceptions.VerificationError
+        If the attributes don't match their signed digests.
+    '''
+    if 'ml_fingerprint_data' not in attributes:
+        raise exceptions.ModelNotSigned("This model has not been signed.")
+    fingerprint_data = attributes['ml_fingerprint_data']
+
+    try:
+        if fingerprint_data.get('scheme') in digests.SCHEMES:
+            # Hashes every attribute again (nothing is reused from previous signatures) and checks
+            # them against the signed table of digests.
+            current, _ = digests.attribute_digests(attributes, fingerprint_data['excluded_data'], scheme=fingerprint_data['scheme'])
+            if current != fingerprint_data['digests']:
+                raise exceptions.VerificationError("The signature is NOT valid.")
+            serialized_model = digests.signed_message(fingerprint_data)
+        elif 'scheme' not in fingerprint_data:
+            # Models signed before the per-attribute digests: serializes the model parameters the same way
+            # sign() did, leaving out ml-fingerprint data and the excluded attributes. The attributes are
+            # read in place, so memory-mapped arrays are not copied.
+            serialized_model, _ = _serialize_attributes(attributes, fingerprint_data['excluded_data'])
+        else:
+            raise exceptions.VerificationError("Unknown signature scheme: " + str(fingerprint_data['scheme']))
+    except TypeError:
+        raise exceptions.VerificationError("The signature is NOT valid.")
+    except (AttributeError, KeyError):
+        raise exceptions.ModelNotSigned("This model has not been signed.")
+    return serialized_model, fingerprint_data
+
+
+def _check_signature(serialized_model, fingerprint_data, public_key):
+    '''
+    Checks the signature in fingerprint_data of the message serialized_model with the public
+    key provided (with a keyring, the key whose id is in the model, or every key for models
+    signed without one). Raises VerificationError if it is not valid.
+    '''
+    for verifier in keyring.verifiers(public_key, fingerprint_data):
+        try:
+            verifier.verify(serialized_model, fingerprint_data['signature'])
+            return True
+        except (ValueError, TypeError):
+            pass
+        except (AttributeError, KeyError):
+            raise exceptions.ModelNotSigned("This model has not been signed.")
+    raise exceptions.VerificationError("The signature is NOT valid.")
+
+
+def verify_attributes(attributes, public_key):
+    '''
+    Verifies the signature of a model given only its attributes, without needing
+    the estimator object itself. This is what BaseEstimator.verify() does, and
+    lets other formats (see ml_fingerprint.manifest) check a model before building it.
+    Unlike verify(), it doesn't print anything, since it runs every time a service
+    loads or re-checks a model.
+
+    Parameters
+    ----------
+    attributes : dict
+        The attributes of the model (its __dict__), including 'ml_fingerprint_data'.
+    public_key : Crypto.PublicKey.RSA.RsaKey, Crypto.PublicKey.ECC.EccKey or ml_fingerprint.keyring.Keyring
+        The public key (RSA or Ed25519) you want to verify the model with, or a keyring
+        with the trusted keys.
+
+    Returns
+    -------
+    bool
+        True if verification succeded. If not, it will raise and exception
+        depending on the cause of the fail.
+    '''
+    serialized_model, fingerprint_data = _signed_message(attributes)
+    _check_signature(serialized_model, fingerprint_data, public_key)
+    return True
+
+
+class BatchVerification():
+    """
+    Result of verify_batch().
+
+    Attributes
+    ----------
+    passed : numpy.ndarray
+        Boolean array, True for every model whose signature is valid.
+    errors : list
+        For every model, the exception that made its verification fail (ModelNotSigned
+        or VerificationError), or None.
+    """
+    def __init__(self, passed, errors):
+        self.passed = passed
+        self.errors = errors
+
+    def __bool__(self):
+        return bool(self.passed.all())
+
+    def __len__(self):
+        return len(self.passed)
+
+    def failed(self):
+        '''
+        Returns the positions of the models that didn't pass the verification.
+        '''
+        return np.flatnonzero(~self.passed)
+
+
+def verify_batch(models, public_key, n_jobs=None):
+    '''
+    Verifies many models at once, i.e. when a service starts.
+
+    The models are hashed concurrently (hashlib releases the GIL on large buffers) and then
+    their signatures are checked one after another. The verifier of every key is built only
+    once: with an RSA key, everything that doesn't depend on the signature is precomputed,
+    so a check costs a single modular exponentiation.
+
+    Parameters
+    ----------
+    models : iterable
+        The models: estimators, or the attributes of models as dicts (e.g. the attributes
+        of a ml_fingerprint.manifest.LazyModel).
+    public_key : Crypto.PublicKey.RSA.RsaKey, Crypto.PublicKey.ECC.EccKey or ml_fingerprint.keyring.Keyring
+        The public key you want to verify the models with, or a keyring with the
+        trusted keys.
+    n_jobs : int, optional
+        Threads used to hash the models (by default, one per CPU).
+
+    Returns
+    -------
+    BatchVerification
+        Which models passed the verification and why the others didn't. Nothing is raised
+        or printed when a model fails.
+    '''
+    if not isinstance(public_key, keyring.Keyring):
+        public_key = keyring.Keyring([public_key])
+    models = list(models)
+
+    def hash_model(model):
+        attributes = model if isinstance(model, dict) else model.__dict__
+        try:
+            return _signed_message(attributes), None
+        except (exceptions.ModelNotSigned, exceptions.VerificationError) as e:
+            return None, e
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1:
+        hashed = [hash_model(model) for model in models]
+    else:
+        with ThreadPoolExecutor(n_jobs) as executor:
+            hashed = list(executor.map(hash_model, models))
+
+    passed = np.zeros(len(models), dtype=bool)
+    errors = [None] * len(models)
+    for i, (signed, error) in enumerate(hashed):
+        if error is None:
+            try:
+                passed[i] = _check_signature(signed[0], signed[1], public_key)
+            except (exceptions.ModelNotSigned, exceptions.VerificationError) as e:
+                error = e
+        errors[i] = error
+    return BatchVerification(passed, errors)
 
 
 def decorate_base_estimator():
@@ -17,11 +224,11 @@ def decorate_base_estimator():
 
     def sign(self, private_key):
         '''
-        Takes a RSA private key and signs the model with it.
+        Takes a RSA (or Ed25519) private key and signs the model with it.
 
         Parameters
         ----------
-        private_key : Crypto.PublicKey.RSA.RsaKey
+        private_key : Crypto.PublicKey.RSA.RsaKey or Crypto.PublicKey.ECC.EccKey
             The private key you want to sign the model with.
         
         Returns
@@ -31,35 +238,21 @@ def decorate_base_estimator():
         '''
         print("Signing model...")
 
-        self.ml_fingerprint_data = {}
-
-        # Make a copy of the model and delete all ml-fingerprint extra data (the signature and the excluded attributes) so they don't affect the hash.
-        # This is necessary because when adding our data we are modifying the model, so the hash done when verifying won't be the same as the one used to sign the model.
-        modelcopy = deepcopy(self)
-        if hasattr(modelcopy, 'ml_fingerprint_data'):
-            del modelcopy.ml_fingerprint_data
-
-        # Checks for any attribute not compatible with orjson (mainly numpy arrays with non-standard data in them).
-        # If any attribute cannot be json serialized, it excludes it from the serialization.
-        self.ml_fingerprint_data['excluded_data'] = []
-        for k in modelcopy.__dict__:
-            try:
-                orjson.dumps(modelcopy.__dict__[k], option=orjson.OPT_SERIALIZE_NUMPY)
-            except TypeError:
-                self.ml_fingerprint_data['excluded_data'].append(k)
-        
-        for elem in self.ml_fingerprint_data['excluded_data']:
-            delattr(modelcopy, elem)
-
-        # Serializes the model parameters using orjson, which provides native numpy compatibility
-        serialized_model = orjson.dumps(modelcopy.__dict__, option=orjson.OPT_SERIALIZE_NUMPY)
-
-        # Hashes the serialized model using SHA256 algorithm
-        hashed_model = SHA256.new(serialized_model)
+        # Every attribute is hashed on its own (numpy arrays from their raw bytes, anything else from its
+        # orjson serialization) and the signature covers the table of digests. The ml-fingerprint data is
+        # left out so it doesn't affect the hash, and so is any attribute not compatible with orjson.
+        # The digests of the arrays are remembered, so signing the model again (i.e. after partial_fit)
+        # only hashes the arrays that changed since.
+        attribute_digests, excluded = digests.attribute_digests(self.__dict__, cache=digests.digest_cache(self))
+        fingerprint_data = {'scheme': digests.SCHEME, 'digests': attribute_digests, 'excluded_data': excluded}
 
-        # Signs the hashed model with the provided private key and then adds the signature to the model object
-        signature = pkcs1_15.new(private_key).sign(hashed_model)
-        self.ml_fingerprint_data['signature'] = signature
+        # Signs the table of digests (RSA: PKCS#1 v1.5 over its SHA256; Ed25519: the message itself)
+        # with the provided private key and then adds the signature to the model object
+        signature = keyring.sign_message(private_key, digests.signed_message(fingerprint_data))
+        fingerprint_data['signature'] = signature
+        # Not signed: only tells verifiers with a keyring which key to use
+        fingerprint_data['key_id'] = keyring.key_id(private_key)
+        self.ml_fingerprint_data = fingerprint_data
         return signature
 
     # Manually add the sign() method, because it need access to self
@@ -67,12 +260,13 @@ def decorate_base_estimator():
 
     def verify(self, public_key):
         '''
-        Takes a RSA public key and verifies the model with it.
+        Takes a RSA (or Ed25519) public key and verifies the model with it.
 
         Parameters
         ----------
-        public_key : Crypto.PublicKey.RSA.RsaKey
-            The public key you want to verify the model with.
+        public_key : Crypto.PublicKey.RSA.RsaKey, Crypto.PublicKey.ECC.EccKey or ml_fingerprint.keyring.Keyring
+            The public key you want to verify the model with, or a keyring with the
+            trusted keys.
         
         Returns
         -------
@@ -81,34 +275,9 @@ def decorate_base_estimator():
             depending on the cause of the fail.
         '''
         print("Validating model...")
-
-        if not hasattr(self, 'ml_fingerprint_data'):
-            raise exceptions.ModelNotSigned("This model has not been signed.")
-
-        # Make a copy of the model and delete ml-fingerprint data so the hash fits the one generated in sign()
-        modelcopy = deepcopy(self)
-        if hasattr(modelcopy, 'ml_fingerprint_data'):
-            del modelcopy.ml_fingerprint_data
-
-        # Deleting all excluded attributes from the copy so it won't serialize them.
-        for elem in self.ml_fingerprint_data['excluded_data']:
-            delattr(modelcopy, elem)
-
-        # Serializes the model parameters using orjson, which provides native numpy compatibility
-        serialized_model = orjson.dumps(modelcopy.__dict__, option=orjson.OPT_SERIALIZE_NUMPY)
-
-        # Hashes the serialized model using SHA256 algorithm
-        hashed_model = SHA256.new(serialized_model)
-
-        # Tries to verify the model with its signature and the public key provided.
-        try:
-            pkcs1_15.new(public_key).verify(hashed_model, self.ml_fingerprint_data['signature'])
-            print("The signature is valid")
-            return True
-        except (ValueError, TypeError):
-            raise exceptions.VerificationError("The signature is NOT valid.")
-        except AttributeError:
-            raise exceptions.ModelNotSigned("This model has not been signed.")
+        verify_attributes(self.__dict__, public_key)
+        print("The signature is valid")
+        return True
 
     # Manually add the verify() method, because it need access to self
     setattr(baseClass, verify.__name__, verify)
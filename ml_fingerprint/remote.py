@@ -1,11 +1,15 @@
-from requests import api
-from . import ml_fingerprint, example_models, exceptions
-from Crypto.PublicKey import RSA
-import sqlite3
+from . import ml_fingerprint, exceptions, serialization, manifest, chunking
 import pickle
-import requests as req
 import json
 import base64
+import os
+import binascii
+import hashlib
+import urllib.parse
+
+# requests and sqlite3 are imported in the functions that use them, so processes that
+# only decode and verify models (decode_model, ModelCache) don't pay for them.
+
 
 class RemoteServer():
     """
@@ -15,13 +19,28 @@ class RemoteServer():
     ----------
     url : str
         URL of the API of the remote server.
+    cache : ModelCache or None
+        Local cache of downloaded models, if a cache directory was given.
+    serializer_bytes : str
+        Format used to upload models (see encode_model()).
+    delta : bool
+        If True, models are sent and received in content-defined chunks (see
+        ml_fingerprint.chunking), and only the chunks the other side doesn't have
+        are transferred. Uploading a new version of a model then only sends the
+        parts that changed, and with a cache directory, downloading it only
+        fetches those parts too.
     """
-    def __init__(self, url, api_key, unsafe_https=False):
+    def __init__(self, url, api_key, unsafe_https=False, cache_dir=None, serializer_bytes='pickle', delta=False):
         if not url.endswith('/'):
             url += "/"
         self.url = url
         self.api_key = api_key
         self.unsafe_https = unsafe_https
+        self.serializer_bytes = serializer_bytes
+        self.delta = delta
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = ModelCache(cache_dir)
 
     
     
@@ -55,8 +74,7 @@ class RemoteServer():
         requests.Response
             Response object returned by the server after the POST petition.
         '''
-
-        b64string_model, serializer_bytes, serializer_text = encode_model(model)
+        import requests as req
 
         estimator = type(model).__name__
         
@@ -65,9 +83,6 @@ class RemoteServer():
             supervised_int = 1
         date_str = date.isoformat()
         data = {'name': name,
-                'serialized_model': b64string_model,
-                'serializer_bytes': serializer_bytes,
-                'serializer_text': serializer_text,
                 'supervised': supervised_int,
                 'type': model_type,
                 'estimator': estimator,
@@ -78,9 +93,121 @@ class RemoteServer():
                 'description': description,
                 'api_key': self.api_key
                 }
-        res = req.post(self.url + 'model/' + name, json=data, verify=not self.unsafe_https)
+        res = self._send_model(req.post, name, model, data)
         if res.status_code != 200:
             print("ERROR: ", res.text)
+        return res
+
+    def _headers(self):
+        '''
+        Headers of the requests with a JSON body. The API key is also sent in a header,
+        so the server can apply its rate limit without reading the body.
+        '''
+        return {'X-API-Key': self.api_key}
+
+    def _send_model(self, send, name, model, data):
+        '''
+        Adds the serialized model to the data of an insert or update and sends it
+        with the given request function (req.post or req.put).
+        With delta uploads, the model is sent as a list of chunks, after uploading
+        those the server doesn't have yet.
+        '''
+        import requests as req
+        url = self.url + 'model/' + name
+        if not self.delta:
+            data['serialized_model'], data['serializer_bytes'], data['serializer_text'] = encode_model(model, self.serializer_bytes)
+            return send(url, json=data, headers=self._headers(), verify=not self.unsafe_https)
+
+        payload = b''.join(serialize_model(model, self.serializer_bytes))
+        chunks = chunking.split(payload)
+        data['serializer_bytes'] = self.serializer_bytes
+        data['serializer_text'] = "base64"
+        data['chunks'] = [[digest, len(chunk)] for digest, chunk in chunks]
+
+        res = req.post(self.url + 'chunks/missing', json={'api_key': self.api_key, 'digests': [digest for digest, _ in chunks]}, headers=self._headers(), verify=not self.unsafe_https)
+        if res.status_code != 200:
+            return res
+        res = self._upload_chunks(chunks, res.json()['missing'])
+        if res is not None and res.status_code != 200:
+            return res
+        res = send(url, json=data, headers=self._headers(), verify=not self.unsafe_https)
+        if res.status_code == 409:
+            # Some chunks were removed by a concurrent delete after being checked. Send them again.
+            res = self._upload_chunks(chunks, res.json()['missing'])
+            if res is not None and res.status_code != 200:
+                return res
+            res = send(url, json=data, headers=self._headers(), verify=not self.unsafe_https)
+        return res
+
+    def _upload_chunks(self, chunks, missing, batch_size=8 * 1024 * 1024):
+        '''
+        Uploads the chunks whose digest is in missing, in requests of about batch_size bytes.
+        Returns the response of the last request (or of the first one that failed),
+        None if there was nothing to upload.
+        '''
+        import requests as req
+        missing = set(missing)
+        res = None
+        batch = []
+        size = 0
+        for i, (digest, chunk) in enumerate(chunks):
+            if digest in missing:
+                missing.discard(digest)
+                batch.append([digest, base64.b64encode(chunk).decode('ascii')])
+                size += len(chunk)
+            if batch and (size >= batch_size or i == len(chunks) - 1):
+                res = req.post(self.url + 'chunks', json={'api_key': self.api_key, 'chunks': batch}, headers=self._headers(), verify=not self.unsafe_https)
+                if res.status_code != 200:
+                    return res
+                batch = []
+                size = 0
+        return res
+
+    def _download_chunks(self, chunks):
+        '''
+        Assembles a payload from its list of chunks [digest, size]. The chunks kept in the
+        cache directory (if any) are reused, and only the others are fetched from the server.
+        Returns None if the server returned an error, and raises KeyError if it doesn't
+        send the chunks that are missing (e.g. they were deleted in the meantime).
+        '''
+        import requests as req
+        payload = bytearray(sum(size for _, size in chunks))
+        offsets = {}
+        sizes = dict(chunks)
+        missing = []
+        pos = 0
+        for digest, size in chunks:
+            offsets.setdefault(digest, []).append(pos)
+            pos += size
+        for digest in offsets:
+            data = self.cache.load_chunk(digest) if self.cache is not None else None
+            if data is None or len(data) != sizes[digest]:
+                missing.append(digest)
+            else:
+                for offset in offsets[digest]:
+                    payload[offset:offset + len(data)] = data
+
+        while missing:
+            res = req.post(self.url + 'chunks/fetch', json={'api_key': self.api_key, 'digests': missing}, headers=self._headers(), verify=not self.unsafe_https)
+            if res.status_code != 200:
+                print("ERROR: ", res.text)
+                return None
+            received = res.json()['chunks']
+            if not received:
+                # Every round must make progress, or this would never end
+                raise KeyError("The server didn't send the chunks " + ", ".join(missing))
+            for digest, content in received:
+                if digest not in missing:
+                    raise exceptions.VerificationError("The server sent a chunk that wasn't requested.")
+                data = base64.b64decode(content)
+                if hashlib.sha256(data).hexdigest() != digest or len(data) != sizes[digest]:
+                    raise exceptions.VerificationError("The content of a chunk doesn't match its digest.")
+                if self.cache is not None:
+                    self.cache.store_chunk(digest, data)
+                for offset in offsets[digest]:
+                    payload[offset:offset + len(data)] = data
+                missing.remove(digest)
+        return payload
 
     def get_model(self, modelname, public_key, version=None):
         '''
@@ -91,8 +218,9 @@ class RemoteServer():
         ----------
         modelname : str
             The name of the model to be retrieved.
-        public_key : Crypto.PublicKey.RSA.RsaKey
-            The public key whose private counterpart was used to sign the model.
+        public_key : Crypto.PublicKey.RSA.RsaKey or ml_fingerprint.keyring.Keyring
+            The public key whose private counterpart was used to sign the model
+            (or a keyring with the trusted keys).
             This is needed to verify the integrity and authenticity of the model.
         version : str, optional
             The version of the model to be retrieved. If not given, it will retrieve
@@ -102,27 +230,68 @@ class RemoteServer():
         -------
         (any sklearn estimator)
             The received model from the server.
+
+        .. note:: If the RemoteServer has a cache directory, downloaded models are saved
+            there, keyed by the digest of their payload, and returned memory-mapped from
+            the cached file. A model requested with an explicit version is only downloaded
+            again if its payload changed on the server (i.e. it was updated). Models are
+            only cached once verified, and cached models are verified every time they
+            are loaded.
         '''
+        import requests as req
 
         params = {}
         params['api_key'] = self.api_key
+        cached_digest = None
         if version != None:
             params['version'] = version
+            if self.cache is not None:
+                cached_digest = self.cache.cached_digest(modelname, version)
+                if cached_digest is not None:
+                    # The server answers 304 if the model is still the same
+                    params['digest'] = cached_digest
+        if self.delta:
+            params['chunked'] = "true"
         res = req.get(self.url + 'model/' + modelname, params=params, verify=not self.unsafe_https)
+        if res.status_code == 304:
+            model = self.cache.load(modelname, version, cached_digest)
+            if model is not None:
+                return self._verify_cached(model, modelname, version, cached_digest, public_key)
+            # Removed from the cache in the meantime
+            del params['digest']
+            res = req.get(self.url + 'model/' + modelname, params=params, verify=not self.unsafe_https)
         if res.status_code != 200:
             print("ERROR: ", res.text)
         else:
             data = res.json()
-            model = decode_model(data['serialized_model'])
-            if ml_fingerprint.isInyected(model):
-                signIsGood = model.verify(public_key)
-                if signIsGood:
-                    return model
-                else:
-                    raise exceptions.VerificationError("Sign verification failed.")
-                
+            serializer_bytes = data.get('serializer_bytes', 'pickle')
+            if 'chunks' in data:
+                payload = self._download_chunks(data['chunks'])
+                if payload is None:
+                    return None
+                model = deserialize_model(payload, serializer_bytes, public_key)
             else:
-                return model
+                model = decode_model(data['serialized_model'], serializer_bytes, public_key)
+            if not (serializer_bytes == "manifest" and hasattr(model, 'ml_fingerprint_data')) and ml_fingerprint.isInyected(model):
+                # Manifests were already verified by decode_model(), before the model was built
+                if not model.verify(public_key):
+                    raise exceptions.VerificationError("Sign verification failed.")
+            if self.cache is not None and data.get('content_digest') is not None:
+                # Keep the mapped copy only, so the arrays are shared with other processes using the cache.
+                self.cache.store(modelname, data['version'], data['content_digest'], model)
+                model = self.cache.load(modelname, data['version'], data['content_digest'])
+                return self._verify_cached(model, modelname, data['version'], data['content_digest'], public_key)
+            return model
+
+    def _verify_cached(self, model, modelname, version, digest, public_key):
+        if not ml_fingerprint.isInyected(model):
+            return model
+        try:
+            model.verify(public_key)
+        except exceptions.VerificationError:
+            self.cache.remove(modelname, version, digest)
+            raise
+        return model
 
     def update_model(self, model, name, supervised, model_type, scores, version, metadata, date, description):
         '''
@@ -159,8 +328,7 @@ class RemoteServer():
         requests.Response
             Response object returned by the server after the PUT petition.
         '''
-
-        b64string_model, serializer_bytes, serializer_text = encode_model(model)
+        import requests as req
 
         estimator = type(model).__name__
         
@@ -171,9 +339,6 @@ class RemoteServer():
         date_str = date.isoformat()
 
         data = {'name': name,
-                'serialized_model': b64string_model,
-                'serializer_bytes': serializer_bytes,
-                'serializer_text': serializer_text,
                 'supervised': supervised_int,
                 'type': model_type,
                 'estimator': estimator,
@@ -184,9 +349,10 @@ class RemoteServer():
                 'description': description,
                 'api_key': self.api_key
                 }
-        res = req.put(self.url + 'model/' + name, json=data, verify=not self.unsafe_https)
+        res = self._send_model(req.put, name, model, data)
         if res.status_code != 200:
             print("ERROR: ", res.text)
+        return res
 
     def delete_model(self, modelname, version=None):
         '''
@@ -205,6 +371,7 @@ class RemoteServer():
         requests.Response
             Response object returned by the server after the PUT petition.
         '''
+        import requests as req
 
         params = {}
         params['api_key'] = self.api_key
@@ -215,6 +382,7 @@ class RemoteServer():
             print("ERROR: ", res.text)
         else:
             print(res.text)
+        return res
 
     def get_list_models(self, modelname=None, type_str=None, allversions=False, doprint=False):
         '''
@@ -237,6 +405,7 @@ class RemoteServer():
         list
             List containing objects with all the metadata of the models.
         '''
+        import requests as req
 
         params = {}
         params['api_key'] = self.api_key
@@ -262,7 +431,179 @@ class RemoteServer():
                         print(str(col) + ": " + str(model[col]))
             return data
 
-def encode_model(model):
+    def search_models(self, query=None, type_str=None, score=None, order='desc', min_score=None, max_score=None,
+                      metadata=None, latest=False, limit=20, offset=0):
+        '''
+        Searches the models of the server. The filtering and sorting are done by the
+        server's search index, so only the matching models are downloaded.
+
+        Parameters
+        ----------
+        query : str, optional
+            Full-text query (SQLite FTS5 syntax) over the name, description and estimator
+            of the models, e.g. "rain*" or "forest OR tree". The best matches go first.
+        type_str : str, optional
+            If specified, only models of that type.
+            If type is "supervised" or "unsupervised", it will filter by that instead.
+        score : str, optional
+            If specified, only models with that score, sorted by it.
+        order : str, optional
+            "desc" (highest score first, the default) or "asc" (i.e. for errors).
+        min_score, max_score : float, optional
+            Only models whose score is in that range. Need score.
+        metadata : dict, optional
+            Only models whose metadata has these values, e.g. {"dataset": "weatherAUS"}.
+        latest : bool, optional
+            If True, only the lastest version of each model.
+        limit : int, optional
+            Maximum number of models returned.
+        offset : int, optional
+            Number of matching models skipped, to get the next pages.
+
+        Returns
+        -------
+        list
+            List containing objects with all the metadata of the models.
+
+        Examples
+        --------
+        Best F1 among the classification models:
+
+        >>> server.search_models(type_str="classification", score="f1", limit=1)
+        '''
+        import requests as req
+
+        params = {'api_key': self.api_key, 'order': order, 'limit': limit, 'offset': offset}
+        if query != None:
+            params['q'] = query
+        if type_str != None:
+            params['type'] = type_str
+        if score != None:
+            params['score'] = score
+        if min_score != None:
+            params['min_score'] = min_score
+        if max_score != None:
+            params['max_score'] = max_score
+        for key, value in (metadata or {}).items():
+            params['metadata.' + key] = value
+        if latest:
+            params['latest'] = "true"
+        res = req.get(self.url + 'search', params=params, verify=not self.unsafe_https)
+        if res.status_code != 200:
+            print("ERROR: ", res.text)
+        else:
+            return res.json()
+
+class ModelCache():
+    """
+    Directory where downloaded models are kept, one file per model version,
+    using the out-of-band layout of ml_fingerprint.serialization. Loading a
+    cached model memory-maps its arrays instead of reading them into memory.
+
+    The files are keyed by the digest of the payload of the model on the server,
+    besides its name and version, so a version updated on the server is never
+    taken for the cached one.
+
+    Attributes
+    ----------
+    directory : str
+        Path of the cache directory.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _prefix(self, modelname, version):
+        return urllib.parse.quote(modelname, safe='') + '@' + urllib.parse.quote(str(version), safe='') + '@'
+
+    def path(self, modelname, version, digest):
+        '''
+        Returns the path of the file of the given model version and payload digest.
+        '''
+        return os.path.join(self.directory, self._prefix(modelname, version) + urllib.parse.quote(digest, safe='') + '.mlfp')
+
+    def _files(self, modelname, version):
+        prefix = self._prefix(modelname, version)
+        return [filename for filename in os.listdir(self.directory) if filename.startswith(prefix) and filename.endswith('.mlfp')]
+
+    def cached_digest(self, modelname, version):
+        '''
+        Returns the payload digest of the cached copy of a model version, None if
+        it isn't cached.
+        '''
+        files = self._files(modelname, version)
+        if not files:
+            return None
+        return urllib.parse.unquote(files[0][len(self._prefix(modelname, version)):-len('.mlfp')])
+
+    def store(self, modelname, version, digest, model):
+        '''
+        Saves a model in the cache, replacing any previous copy of that version.
+        '''
+        path = self.path(modelname, version, digest)
+        serialization.dump(model, path)
+        for filename in self._files(modelname, version):
+            if os.path.join(self.directory, filename) != path:
+                self._remove(os.path.join(self.directory, filename))
+
+    def load(self, modelname, version, digest, mmap_mode='r'):
+        '''
+        Loads a model from the cache, with its arrays memory-mapped read-only.
+        Returns None if that version is not cached with that digest.
+        '''
+        path = self.path(modelname, version, digest)
+        if not os.path.exists(path):
+            return None
+        return serialization.load(path, mmap_mode=mmap_mode)
+
+    def chunk_path(self, digest):
+        '''
+        Returns the path of the file of a chunk downloaded with delta downloads.
+        '''
+        return os.path.join(self.directory, 'chunks', digest[:2], digest)
+
+    def store_chunk(self, digest, data):
+        '''
+        Saves a chunk in the cache, so later versions of the model don't download it again.
+        '''
+        path = self.chunk_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def load_chunk(self, digest):
+        '''
+        Returns the content of a cached chunk, or None if it's not cached or got corrupted.
+        '''
+        try:
+            with open(self.chunk_path(digest), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if hashlib.sha256(data).hexdigest() != digest:
+            return None
+        return data
+
+    def remove(self, modelname, version, digest=None):
+        '''
+        Removes a model version (only the copy with the given digest, if given)
+        from the cache, if present.
+        '''
+        if digest is not None:
+            self._remove(self.path(modelname, version, digest))
+            return
+        for filename in self._files(modelname, version):
+            self._remove(os.path.join(self.directory, filename))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def encode_model(model, serializer_bytes='pickle'):
     '''
     Takes a model, serializes it to bytes using pickle, and then
     converts it into a base64 string.
@@ -271,6 +612,13 @@ def encode_model(model):
     ----------
     model : any sklearn estimator
         The model to be serialized.
+    serializer_bytes : str, optional
+        'pickle' pickles the model into a single stream with the default protocol.
+        'pickle5' uses protocol 5 and keeps the arrays as out-of-band buffers
+        (see ml_fingerprint.serialization), which are base64-encoded straight from
+        the model's memory instead of being copied into the pickle stream first.
+        'manifest' doesn't use pickle at all (see ml_fingerprint.manifest), so the
+        model can be verified before it is built when it is downloaded.
 
     Returns
     -------
@@ -278,21 +626,64 @@ def encode_model(model):
         Base64 string that represents the serialized model.
     serializer_bytes : str
         Name of the package used to serialize the model into bytes.
-        In this case, it is always 'pickle'.
     serializer_text : str
         Name of the package used to convert the serialized bytes into text.
         In this case, it is always 'base64'.
     '''
-    pickled_model = pickle.dumps(model)
-    b64bytes_model = base64.b64encode(pickled_model)
-    b64string_model = b64bytes_model.decode('ascii')
-
-    serializer_bytes = "pickle"
     serializer_text = "base64"
 
+    if serializer_bytes == "pickle":
+        pickled_model = pickle.dumps(model)
+        b64bytes_model = base64.b64encode(pickled_model)
+        b64string_model = b64bytes_model.decode('ascii')
+    else:
+        b64string_model = _b64encode_pieces(serialize_model(model, serializer_bytes))
+
     return b64string_model, serializer_bytes, serializer_text
 
-def decode_model(data):
+def serialize_model(model, serializer_bytes='pickle'):
+    '''
+    Serializes a model into bytes with the given serializer (see encode_model()).
+
+    Returns
+    -------
+    iterator
+        The pieces (bytes-like objects) that, concatenated, form the serialized model.
+        Large arrays are yielded as views over the model's memory.
+    '''
+    if serializer_bytes == "pickle":
+        return iter([pickle.dumps(model)])
+    elif serializer_bytes == "pickle5":
+        pickled_model, buffers = serialization.dumps_oob(model)
+        return serialization.iter_oob(pickled_model, buffers)
+    elif serializer_bytes == "manifest":
+        return manifest.iter_manifest(model)
+    else:
+        raise ValueError("Unknown serializer: " + str(serializer_bytes))
+
+def deserialize_model(data, serializer_bytes='pickle', public_key=None):
+    '''
+    Inverse of serialize_model(): builds the model from its serialized bytes.
+    See decode_model() for the meaning of the parameters.
+    '''
+    if serializer_bytes == "pickle":
+        model = pickle.loads(data)
+    elif serializer_bytes == "pickle5":
+        pickled_model, buffers = serialization.read_oob(data)
+        model = serialization.loads_oob(pickled_model, buffers)
+    elif serializer_bytes == "manifest":
+        lazy_model = manifest.loads(data)
+        if public_key is not None:
+            # Nothing is built from a model that can't be verified
+            if not lazy_model.is_signed():
+                raise exceptions.ModelNotSigned("This model has not been signed.")
+            lazy_model.verify(public_key)
+        model = lazy_model.load()
+    else:
+        raise ValueError("Unknown serializer: " + str(serializer_bytes))
+    return model
+
+def decode_model(data, serializer_bytes='pickle', public_key=None):
     '''
     Takes a base64 string, converts it into bytes, and then
     decodes it into a Python object (the model) using pickle.
@@ -301,16 +692,69 @@ def decode_model(data):
     ----------
     data : str
         Base64 string that represents the serialized model.
+    serializer_bytes : str, optional
+        Format the model was serialized with (see encode_model()).
+        With 'pickle5', the arrays of the model are rebuilt on top of the
+        decoded buffer, without copying them.
+    public_key : Crypto.PublicKey.RSA.RsaKey, optional
+        Only used with 'manifest': if given, the model must be signed, and its
+        signature is verified over the manifest before any object of the model is
+        built. Raises ModelNotSigned or VerificationError otherwise.
     
     Returns
     -------
     model : any sklearn estimator
         The model deserialized.
     '''
-    pickled_model = base64.b64decode(data)
-    model = pickle.loads(pickled_model)
+    if serializer_bytes == "pickle":
+        pickled_model = base64.b64decode(data)
+        model = pickle.loads(pickled_model)
+    else:
+        model = deserialize_model(_b64decode_into(data), serializer_bytes, public_key)
     return model
 
+# Size of the pieces processed at a time by the base64 helpers. Multiple of 3 and 4,
+# so every piece but the last maps to a whole number of base64 characters.
+_B64_CHUNK = 3 * 4 * 64 * 1024
+
+def _b64encode_pieces(pieces):
+    '''
+    Base64-encodes the concatenation of several buffers without concatenating them.
+    '''
+    out = []
+    rest = b''
+    for piece in pieces:
+        view = memoryview(piece).cast('B')
+        if rest:
+            take = min(3 - len(rest), len(view))
+            rest += bytes(view[:take])
+            view = view[take:]
+            if len(rest) < 3:
+                continue
+            out.append(binascii.b2a_base64(rest, newline=False).decode('ascii'))
+            rest = b''
+        usable = len(view) - len(view) % 3
+        for start in range(0, usable, _B64_CHUNK):
+            out.append(binascii.b2a_base64(view[start:min(start + _B64_CHUNK, usable)], newline=False).decode('ascii'))
+        rest = bytes(view[usable:])
+    if rest:
+        out.append(binascii.b2a_base64(rest, newline=False).decode('ascii'))
+    return ''.join(out)
+
+def _b64decode_into(data):
+    '''
+    Decodes a base64 string into a (writable) bytearray, a piece at a time, so the
+    only full-size buffer created is the result.
+    '''
+    padding = len(data[-2:]) - len(data[-2:].rstrip('='))
+    out = bytearray(len(data) // 4 * 3 - padding)
+    pos = 0
+    step = _B64_CHUNK // 3 * 4
+    for start in range(0, len(data), step):
+        chunk = binascii.a2b_base64(data[start:start + step])
+        out[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+    return out
 
 def put_key_in_db(private_key, public_key):
     '''
@@ -328,6 +772,7 @@ def put_key_in_db(private_key, public_key):
     public_key : Crypto.PublicKey.RSA.RsaKey
         The public half of the key.
     '''
+    import sqlite3
     database = 'ml_fingerprint_database.db'
     conn = sqlite3.connect(database)
     c = conn.cursor()
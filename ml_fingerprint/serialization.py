@@ -0,0 +1,201 @@
+'''
+File format used to keep models on local disk so their arrays can be memory-mapped.
+
+Models are pickled with protocol 5 and every large contiguous buffer (mainly
+numpy arrays) is written out-of-band, aligned, after the pickle stream:
+
+    MAGIC | pickle stream | buffer 0 | buffer 1 | ... | footer | footer length | MAGIC
+
+The footer is a JSON object with the offset and size of the pickle stream and of
+every buffer. When the file is loaded with mmap, the arrays of the model point
+straight into the mapped file (read-only), so nothing is copied and all the
+processes that load the same file share the same physical pages.
+'''
+import os
+import mmap
+import hashlib
+import pickle
+import struct
+import tempfile
+import orjson
+
+MAGIC = b'MLFPOOB1'
+ALIGNMENT = 64
+_FOOTER_SIZE = struct.Struct('<Q')
+
+
+def dumps_oob(model):
+    '''
+    Pickles a model with protocol 5, keeping its large buffers out of the pickle stream.
+
+    Parameters
+    ----------
+    model : any sklearn estimator
+        The model to be serialized.
+
+    Returns
+    -------
+    pickled : bytes
+        The pickle stream, which only references the buffers.
+    buffers : list of memoryview
+        Raw bytes of every out-of-band buffer, in the order pickle expects them.
+        They are views over the model's own memory, not copies.
+    '''
+    buffers = []
+    pickled = pickle.dumps(model, protocol=5, buffer_callback=buffers.append)
+    return pickled, [buf.raw() for buf in buffers]
+
+
+def loads_oob(pickled, buffers):
+    '''
+    Inverse of dumps_oob(). Arrays are rebuilt on top of the given buffers
+    without copying them, so read-only buffers produce read-only arrays.
+    '''
+    return pickle.loads(pickled, buffers=buffers)
+
+
+def _padding(offset):
+    return (-offset) % ALIGNMENT
+
+
+def iter_oob(pickled, buffers, magic=MAGIC):
+    '''
+    Returns an iterator over the pieces of the layout described in this module for a pickle
+    stream and its out-of-band buffers. The buffers are yielded as they are, so the
+    pieces can be written, hashed or encoded one by one without joining them in memory.
+    '''
+    offset = 0
+    pieces = []
+
+    def emit(data):
+        nonlocal offset
+        pieces.append(data)
+        offset += len(data)
+
+    def align():
+        pad = _padding(offset)
+        if pad:
+            emit(b'\0' * pad)
+
+    emit(magic)
+    align()
+    footer = {'pickle': [offset, len(pickled)], 'buffers': []}
+    emit(pickled)
+    for buf in buffers:
+        align()
+        footer['buffers'].append([offset, memoryview(buf).nbytes])
+        emit(buf)
+    footer_bytes = orjson.dumps(footer)
+    emit(footer_bytes)
+    emit(_FOOTER_SIZE.pack(len(footer_bytes)))
+    emit(magic)
+    return iter(pieces)
+
+
+def write_oob(fileobj, pickled, buffers):
+    '''
+    Writes a pickle stream and its out-of-band buffers to a binary file object
+    using the layout described in this module, without joining them in memory.
+
+    Returns
+    -------
+    int
+        Number of bytes written.
+    '''
+    written = 0
+    for piece in iter_oob(pickled, buffers):
+        fileobj.write(piece)
+        written += len(piece)
+    return written
+
+
+def digest_oob(pickled, buffers, algorithm='sha256'):
+    '''
+    Hashes the layout of a pickle stream and its out-of-band buffers piece by piece.
+    The result is the same as hashing the file written by write_oob().
+
+    Returns
+    -------
+    str
+        Hex digest.
+    '''
+    h = hashlib.new(algorithm)
+    for piece in iter_oob(pickled, buffers):
+        h.update(piece)
+    return h.hexdigest()
+
+
+def read_oob(data, magic=MAGIC):
+    '''
+    Splits a buffer written by write_oob() into the pickle stream and the
+    out-of-band buffers. The returned pieces are views over `data`.
+
+    Raises
+    ------
+    ValueError
+        If data doesn't follow the expected layout.
+    '''
+    view = memoryview(data)
+    if len(view) < 2 * len(magic) + _FOOTER_SIZE.size or bytes(view[:len(magic)]) != magic or bytes(view[-len(magic):]) != magic:
+        raise ValueError("The data is not a ml-fingerprint out-of-band pickle.")
+    end = len(view) - len(magic)
+    footer_size, = _FOOTER_SIZE.unpack(view[end - _FOOTER_SIZE.size:end])
+    footer_end = end - _FOOTER_SIZE.size
+    footer = orjson.loads(bytes(view[footer_end - footer_size:footer_end]))
+    offset, size = footer['pickle']
+    pickled = view[offset:offset + size]
+    buffers = [view[offset:offset + size] for offset, size in footer['buffers']]
+    return pickled, buffers
+
+
+def dump(model, path):
+    '''
+    Saves a model to a file with the out-of-band layout. The file is written to a
+    temporary name and then renamed, so concurrent readers never see it half written.
+
+    Parameters
+    ----------
+    model : any sklearn estimator
+        The model to be saved.
+    path : str
+        Destination file.
+    '''
+    pickled, buffers = dumps_oob(model)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_oob(f, pickled, buffers)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load(path, mmap_mode='r'):
+    '''
+    Loads a model saved with dump().
+
+    Parameters
+    ----------
+    path : str
+        File to be loaded.
+    mmap_mode : str or None, optional
+        'r' maps the file read-only and builds the arrays on top of the mapping.
+        None reads the whole file into memory instead.
+
+    Returns
+    -------
+    model : any sklearn estimator
+        The loaded model.
+    '''
+    with open(path, 'rb') as f:
+        if mmap_mode is None:
+            data = f.read()
+        elif mmap_mode == 'r':
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            raise ValueError("Unsupported mmap_mode: " + str(mmap_mode))
+    pickled, buffers = read_oob(data)
+    return loads_oob(pickled, buffers)
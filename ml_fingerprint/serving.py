@@ -0,0 +1,475 @@
+'''
+Serving predictions from the models of a registry.
+
+A ModelPool keeps verified models in memory, keyed by name and version, and
+answers predict() calls with them:
+
+    - Models are downloaded with RemoteServer.get_model() and verified again by
+      the pool with ml_fingerprint.verify_attributes(), whether or not
+      decorate_base_estimator() was called. Unsigned models are refused, so
+      everything the pool serves has a valid signature.
+    - A background thread asks the server for the latest version of every model
+      every poll_interval seconds. A new version is downloaded and verified first
+      and only then replaces the old one, in a single assignment: requests in
+      flight finish with the model they started with, and a version that fails
+      verification is never served (the old one stays, and the error is kept in
+      ModelPool.errors). Versions that couldn't be downloaded (a timeout, a server
+      error...) are tried again on the next poll.
+    - Concurrent predict() calls on the same model are coalesced: a thread per
+      model and method stacks the pending requests into one NumPy (or pandas)
+      batch, calls the estimator once and hands every caller its rows. Estimators
+      spend most of a small predict() in validation and dispatch, so one call on
+      64 rows costs about the same as one call on a single row.
+
+Example
+-------
+    >>> server = RemoteServer('https://registry.example.com/', api_key)
+    >>> pool = ModelPool(server, public_key, ['rain_classifier'], poll_interval=30)
+    >>> pool.start()
+    >>> pool.predict('rain_classifier', X)
+'''
+import sys
+import mmap
+import time
+import queue
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import Future
+from . import exceptions
+
+# Errors that downloading the same version again won't fix. Any other is retried.
+PERMANENT_ERRORS = (exceptions.VerificationError, exceptions.ModelNotSigned, exceptions.UnsupportedModel)
+
+
+class ServedModel():
+    """
+    A verified model in the pool.
+
+    Attributes
+    ----------
+    name : str
+        Name of the model in the registry.
+    version : str
+        Its version.
+    model : (any sklearn estimator)
+        The verified estimator.
+    loaded_at : float
+        When it was loaded (time.time()).
+    nbytes : int
+        Estimate of the memory it uses (see estimate_nbytes()).
+    """
+    def __init__(self, name, version, model):
+        self.name = name
+        self.version = version
+        self.model = model
+        self.loaded_at = time.time()
+        self.nbytes = estimate_nbytes(model)
+
+
+def estimate_nbytes(obj, seen=None):
+    '''
+    Estimates the memory used by an estimator: the size of its NumPy arrays plus
+    the size of the other objects it refers to. Objects that hold their state in
+    C, like the trees of scikit-learn, are measured through __getstate__().
+    '''
+    if seen is None:
+        seen = {}
+    if id(obj) in seen:
+        return 0
+    # Keeps obj alive, so the id of a temporary state can't be reused by the next one
+    seen[id(obj)] = obj
+    if isinstance(obj, np.ndarray):
+        # Includes the data if the array owns it. Views of a buffer (i.e. arrays of a
+        # 'manifest' or 'pickle5' payload) count the buffer, once. Arrays over memory
+        # owned by another object (the nodes of a tree) count their own data.
+        size = sys.getsizeof(obj)
+        if isinstance(obj.base, (np.ndarray, bytes, bytearray, memoryview, mmap.mmap)):
+            size += estimate_nbytes(obj.base, seen)
+        elif obj.base is not None:
+            size += obj.nbytes
+        if obj.dtype == object:
+            size += sum(estimate_nbytes(item, seen) for item in obj.flat)
+        return size
+    if isinstance(obj, memoryview):
+        return sys.getsizeof(obj) + obj.nbytes
+    if isinstance(obj, mmap.mmap):
+        return len(obj)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool, type(None))):
+        return size
+    if isinstance(obj, dict):
+        return size + sum(estimate_nbytes(key, seen) + estimate_nbytes(value, seen) for key, value in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(estimate_nbytes(item, seen) for item in obj)
+    if hasattr(obj, '__dict__'):
+        return size + estimate_nbytes(obj.__dict__, seen)
+    if hasattr(obj, '__getstate__') and hasattr(obj, '__reduce__'):
+        try:
+            state = obj.__getstate__()
+        except Exception:
+            return size
+        if state is not obj:
+            return size + estimate_nbytes(state, seen)
+    return size
+
+
+class _Request():
+    def __init__(self, X, single):
+        self.X = X
+        self.single = single
+        self.future = Future()
+
+
+class _Batcher(threading.Thread):
+    """
+    Coalesces the predict requests of one model, version and method. Exits after
+    idle_timeout seconds without requests.
+    """
+    def __init__(self, pool, key):
+        name, version, method = key
+        super().__init__(daemon=True, name='ModelPool batcher %s %s.%s' % (name, version or 'latest', method))
+        self.pool = pool
+        self.key = key
+        self.name = name
+        self.version = version
+        self.method = method
+        self.requests = queue.Queue()
+
+    def run(self):
+        while True:
+            try:
+                first = self.requests.get(timeout=self.pool.idle_timeout)
+            except queue.Empty:
+                if self.pool._retire(self):
+                    return
+                continue
+            if first is None:
+                return
+            batch = [first]
+            rows = len(first.X)
+            deadline = time.perf_counter() + self.pool.max_delay
+            stop = False
+            while rows < self.pool.max_batch_size:
+                try:
+                    # Take what is already waiting, then wait at most max_delay for more
+                    timeout = deadline - time.perf_counter()
+                    request = self.requests.get_nowait() if timeout <= 0 else self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+                rows += len(request.X)
+            self.run_batch(batch)
+            if stop:
+                return
+
+    def run_batch(self, batch):
+        try:
+            # The model is looked up for every batch, so a hot swap applies to the next one
+            function = getattr(self.pool.get(self.name, self.version), self.method)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        self.pool.count_batch(len(batch), sum(len(request.X) for request in batch))
+        if len(batch) > 1:
+            try:
+                result = function(_concatenate([request.X for request in batch]))
+            except Exception:
+                # Maybe a single bad request (i.e. a wrong number of features): run them
+                # one by one, so only that one fails
+                result = None
+            if result is not None:
+                start = 0
+                for request in batch:
+                    stop = start + len(request.X)
+                    _resolve(request, result[start:stop])
+                    start = stop
+                return
+        for request in batch:
+            try:
+                _resolve(request, function(request.X))
+            except Exception as e:
+                request.future.set_exception(e)
+
+
+def _concatenate(arrays):
+    if hasattr(arrays[0], 'iloc'):
+        import pandas
+        return pandas.concat(arrays, ignore_index=True)
+    return np.concatenate(arrays)
+
+
+def _resolve(request, result):
+    request.future.set_result(result[0] if request.single else result)
+
+
+class ModelPool():
+    """
+    Process-local pool of verified models, with hot reload of new versions and
+    batched predictions.
+
+    Attributes
+    ----------
+    server : ml_fingerprint.remote.RemoteServer
+        Registry the models are downloaded from.
+    public_key : Crypto.PublicKey.RSA.RsaKey or ml_fingerprint.keyring.Keyring
+        Key (or keyring) the models are verified with.
+    poll_interval : float
+        Seconds between two checks for new versions.
+    max_batch_size : int
+        Largest number of rows sent to the estimator in one call.
+    max_delay : float
+        Seconds a batch waits for more requests once it has one. With 0, only the
+        requests that arrived while the previous batch ran are coalesced.
+    max_models : int or None
+        If given, the least recently used versions are dropped from models when there
+        are more (the latest versions are kept in latest anyway).
+    max_bytes : int or None
+        If given, the same when the estimated size of the models (ServedModel.nbytes)
+        is larger. The last model loaded is always kept.
+    idle_timeout : float
+        Seconds a batcher thread waits for requests before exiting.
+    models : collections.OrderedDict
+        {(name, version): ServedModel} of the loaded models, least recently used first.
+    latest : dict
+        {name: ServedModel} served when no version is requested.
+    nbytes : int
+        Estimated size of the models in models.
+    errors : dict
+        {(name, version): exception} of the versions that failed verification or couldn't
+        be decoded (PERMANENT_ERRORS). They are not downloaded again.
+    """
+    def __init__(self, server, public_key, names=(), poll_interval=60.0, max_batch_size=256, max_delay=0.001,
+                 max_models=None, max_bytes=None, idle_timeout=60.0):
+        self.server = server
+        self.public_key = public_key
+        self.poll_interval = poll_interval
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.idle_timeout = idle_timeout
+        self.models = OrderedDict()
+        self.latest = {}
+        self.errors = {}
+        self.stats = {'batches': 0, 'requests': 0, 'rows': 0, 'swaps': 0}
+        self._lock = threading.Lock()
+        self._batchers = {}
+        self._stopped = threading.Event()
+        self._poller = None
+        for name in names:
+            self.load(name)
+
+    def load(self, name, version=None):
+        '''
+        Downloads and verifies a model and adds it to the pool. Without a version,
+        the latest one is loaded and served from then on for that name.
+
+        Returns
+        -------
+        ServedModel
+            The loaded model.
+
+        Raises
+        ------
+        ml_fingerprint.exceptions.VerificationError
+            If the model fails verification.
+        ml_fingerprint.exceptions.ModelNotSigned
+            If the model isn't signed.
+        KeyError
+            If the model can't be downloaded.
+        '''
+        if version is not None:
+            return self._fetch(name, version)
+        served = self._fetch(name, self.latest_version(name))
+        self._swap(served)
+        return served
+
+    def _fetch(self, name, version):
+        from . import ml_fingerprint
+        try:
+            model = self.server.get_model(name, self.public_key, version)
+            if model is None:
+                raise KeyError("Couldn't download model %s %s" % (name, version))
+            if not hasattr(model, 'ml_fingerprint_data'):
+                raise exceptions.ModelNotSigned("Model %s %s isn't signed." % (name, version))
+            # get_model() only verifies estimators patched by decorate_base_estimator()
+            ml_fingerprint.verify_attributes(model.__dict__, self.public_key)
+        except PERMANENT_ERRORS as e:
+            self.errors[(name, version)] = e
+            raise
+        served = ServedModel(name, version, model)
+        with self._lock:
+            previous = self.models.pop((name, version), None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self.models[(name, version)] = served
+            self.nbytes += served.nbytes
+            self.errors.pop((name, version), None)
+            while len(self.models) > 1 and ((self.max_models is not None and len(self.models) > self.max_models) or
+                                            (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+                self.nbytes -= self.models.popitem(last=False)[1].nbytes
+        return served
+
+    def _swap(self, served):
+        with self._lock:
+            previous = self.latest.get(served.name)
+            # A single assignment: requests already running keep their reference to the old model
+            self.latest[served.name] = served
+            if previous is not None and previous.version != served.version:
+                dropped = self.models.pop((served.name, previous.version), None)
+                if dropped is not None:
+                    self.nbytes -= dropped.nbytes
+                self.stats['swaps'] += 1
+
+    def latest_version(self, name):
+        '''
+        Asks the server for the latest version of a model.
+        '''
+        versions = self.server.get_list_models(modelname=name)
+        if not versions:
+            raise KeyError("Model not found: " + name)
+        # /modellist/<name> lists the versions newest first (by version_key only)
+        return versions[0]['version']
+
+    def get(self, name, version=None):
+        '''
+        Returns the estimator of a model in the pool: the given version (loaded
+        if needed) or the latest one.
+        '''
+        if version is None:
+            served = self.latest.get(name)
+            if served is None:
+                served = self.load(name)
+            return served.model
+        with self._lock:
+            served = self.models.get((name, version))
+            if served is not None:
+                self.models.move_to_end((name, version))
+        if served is None:
+            error = self.errors.get((name, version))
+            if error is not None:
+                raise error
+            served = self.load(name, version)
+        return served.model
+
+    def check_updates(self):
+        '''
+        Loads the new versions of the served models, if there are any, and swaps them in
+        once verified. Called periodically by the polling thread.
+
+        Returns
+        -------
+        list
+            (name, version) of the models swapped.
+        '''
+        swapped = []
+        for name, current in list(self.latest.items()):
+            try:
+                version = self.latest_version(name)
+                if version == current.version or (name, version) in self.errors:
+                    # Up to date, or a version that already failed: keep serving the current one
+                    continue
+                served = self._fetch(name, version)
+            except Exception as e:
+                print("ERROR: couldn't load a new version of " + name + ": " + str(e))
+                continue
+            self._swap(served)
+            swapped.append((name, version))
+        return swapped
+
+    def start(self):
+        '''
+        Starts the thread that polls the server for new versions.
+        '''
+        if self._poller is None:
+            self._stopped.clear()
+            self._poller = threading.Thread(target=self._poll, daemon=True, name='ModelPool poller')
+            self._poller.start()
+
+    def _poll(self):
+        while not self._stopped.wait(self.poll_interval):
+            self.check_updates()
+
+    def stop(self):
+        '''
+        Stops the polling thread and the batchers.
+        '''
+        self._stopped.set()
+        if self._poller is not None:
+            self._poller.join()
+            self._poller = None
+        with self._lock:
+            batchers = list(self._batchers.values())
+            self._batchers = {}
+        for batcher in batchers:
+            batcher.requests.put(None)
+            batcher.join()
+
+    def submit(self, name, X, method='predict', version=None):
+        '''
+        Queues a prediction of a model.
+
+        Parameters
+        ----------
+        name : str
+            Name of the model.
+        X : array-like or pandas.DataFrame
+            Samples, or a single sample as a 1-D array.
+        method : str, optional
+            Method of the estimator, i.e. 'predict', 'predict_proba' or 'transform'.
+        version : str, optional
+            Version of the model. The latest one if not given.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future of the result (the result of a single sample for a 1-D X).
+        '''
+        if not hasattr(X, 'iloc'):
+            X = np.asarray(X)
+        single = not hasattr(X, 'iloc') and X.ndim == 1
+        request = _Request(X.reshape(1, -1) if single else X, single)
+        key = (name, version, method)
+        with self._lock:
+            # Under the lock, so the batcher can't retire between the lookup and the put
+            batcher = self._batchers.get(key)
+            if batcher is None:
+                batcher = self._batchers[key] = _Batcher(self, key)
+                batcher.start()
+            batcher.requests.put(request)
+        return request.future
+
+    def predict(self, name, X, method='predict', timeout=None, version=None):
+        '''
+        Predicts with a model (by default its latest version), batched together
+        with the concurrent requests to the same model (see submit()).
+        '''
+        return self.submit(name, X, method, version).result(timeout)
+
+    def _retire(self, batcher):
+        with self._lock:
+            if self._batchers.get(batcher.key) is not batcher:
+                return True
+            if not batcher.requests.empty():
+                return False
+            del self._batchers[batcher.key]
+            return True
+
+    def count_batch(self, requests, rows):
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['requests'] += requests
+            self.stats['rows'] += rows
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,30 @@
+import unittest
+import numpy as np
+from ml_fingerprint import chunking
+
+
+class ChunkingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data = np.random.RandomState(0).bytes(2 * 1024 * 1024)
+
+    def test_split_covers_data(self):
+        chunks = chunking.split(self.data)
+        self.assertEqual(b''.join(chunk for _, chunk in chunks), self.data)
+        for _, chunk in chunks[:-1]:
+            self.assertTrue(chunking.MIN_SIZE <= len(chunk) <= chunking.MAX_SIZE)
+
+    def test_local_edit_keeps_other_chunks(self):
+        edited = self.data[:1000000] + b'inserted bytes' + self.data[1000000:]
+        before = set(digest for digest, _ in chunking.split(self.data))
+        after = [digest for digest, _ in chunking.split(edited)]
+        new = [digest for digest in after if digest not in before]
+        self.assertTrue(0 < len(new) <= 2)
+
+    def test_constant_data_uses_max_size(self):
+        chunks = chunking.split(bytes(1024 * 1024))
+        self.assertEqual([len(chunk) for _, chunk in chunks], [chunking.MAX_SIZE] * 4)
+
+    def test_average_size(self):
+        # Without the minimum and maximum sizes the chunks are avg_size long on average
+        chunks = chunking.split(self.data, min_size=1, avg_size=4096, max_size=len(self.data))
+        self.assertAlmostEqual(len(self.data) / len(chunks) / 4096, 1, delta=0.2)
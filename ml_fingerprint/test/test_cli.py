@@ -0,0 +1,120 @@
+import os
+import io
+import json
+import tempfile
+import unittest
+import contextlib
+from Crypto.PublicKey import RSA
+from ml_fingerprint import cli, example_models, keyring, ml_fingerprint, remote
+
+
+class Response():
+    def __init__(self, status_code, text=''):
+        self.status_code = status_code
+        self.text = text
+
+
+class LocalRegistry():
+    """
+    Stands in for RemoteServer: keeps the encoded models in memory.
+    """
+    def __init__(self):
+        self.models = {}
+
+    def insert_model(self, model, name, supervised, model_type, scores, version, metadata, date, description):
+        if name in self.models:
+            return Response(400, "The model already exists.")
+        self.models[name] = remote.encode_model(model, 'pickle')[0]
+        return Response(200)
+
+    def get_list_models(self):
+        return [{'name': name} for name in self.models]
+
+    def get_model(self, modelname, public_key, version=None):
+        model = remote.decode_model(self.models[modelname], 'pickle')
+        model.verify(public_key)
+        return model
+
+
+class CLITestCase(unittest.TestCase):
+    def setUp(self):
+        ml_fingerprint.decorate_base_estimator()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.models = os.path.join(self.tmp.name, 'models')
+        key = RSA.generate(1024)
+        self.private_key = os.path.join(self.tmp.name, 'private.pem')
+        self.public_key = os.path.join(self.tmp.name, 'public.pem')
+        with open(self.private_key, 'wb') as f:
+            f.write(key.export_key())
+        with open(self.public_key, 'wb') as f:
+            f.write(key.publickey().export_key())
+        model = example_models.vanderplas_regression()
+        for name in ('a.joblib', 'b.pkl', 'nested/c.mlfp'):
+            cli.save_model(model, os.path.join(self.models, name))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_cli(self, *argv):
+        '''
+        Runs the command, returning its exit status and the status of every file.
+        '''
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            status = cli.main(list(argv))
+        files = {}
+        for line in out.getvalue().splitlines()[:-1]:
+            fields = line.split()
+            files[os.path.basename(fields[5])] = fields[0]
+        return status, files
+
+    def test_sign_and_verify_directory(self):
+        report = os.path.join(self.tmp.name, 'report.json')
+        status, files = self.run_cli('verify', '--key', self.public_key, '-j', '1', self.models)
+        self.assertEqual(status, 1)
+        self.assertEqual(files, {'a.joblib': 'invalid', 'b.pkl': 'invalid', 'c.mlfp': 'invalid'})
+
+        status, files = self.run_cli('sign', '--key', self.private_key, '-j', '2', self.models)
+        self.assertEqual(status, 0)
+        self.assertEqual(set(files.values()), {'signed'})
+        status, files = self.run_cli('verify', '--key', self.public_key, '-j', '2', '--report', report, self.models)
+        self.assertEqual(status, 0)
+        with open(report) as f:
+            results = json.load(f)
+        self.assertEqual(results['statuses'], {'valid': 3})
+        self.assertEqual(len(results['results']), 3)
+
+        # A model changed after it was signed
+        path = os.path.join(self.models, 'b.pkl')
+        model = cli.load_model(path)
+        model.coef_[0] += 1
+        cli.save_model(model, path)
+        status, files = self.run_cli('verify', '--key', self.public_key, '-j', '1', self.models)
+        self.assertEqual(status, 1)
+        self.assertEqual(files, {'a.joblib': 'valid', 'b.pkl': 'invalid', 'c.mlfp': 'valid'})
+
+    def test_sign_to_output_directory(self):
+        output = os.path.join(self.tmp.name, 'signed')
+        status, files = self.run_cli('sign', '--key', self.private_key, '-j', '1', '--output', output, self.models)
+        self.assertEqual(status, 0)
+        self.assertTrue(os.path.exists(os.path.join(output, 'nested', 'c.mlfp')))
+        self.assertFalse(hasattr(cli.load_model(os.path.join(self.models, 'a.joblib')), 'ml_fingerprint_data'))
+
+    def test_push_and_pull(self):
+        registry = LocalRegistry()
+        paths = cli.find_models([self.models])
+        self.assertEqual(cli.push_file(registry, paths[0], '1.0')['status'], 'failed')
+        self.run_cli('sign', '--key', self.private_key, '-j', '1', self.models)
+        self.assertEqual([cli.push_file(registry, path, '1.0')['status'] for path in paths], ['pushed'] * 3)
+        self.assertEqual(cli.push_file(registry, paths[0], '1.0')['status'], 'exists')
+
+        pulled = os.path.join(self.tmp.name, 'pulled')
+        key = keyring.Keyring.from_files([self.public_key])
+        results = [cli.pull_model(registry, name, pulled, key) for name in ('a', 'b', 'c')]
+        self.assertEqual([result['status'] for result in results], ['pulled'] * 3)
+        self.assertEqual(sorted(os.listdir(pulled)), ['a.joblib', 'b.joblib', 'c.joblib'])
+        self.assertEqual(cli.pull_model(registry, 'a', pulled, key, skip_existing=True)['status'], 'exists')
+
+
+if __name__ == '__main__':
+    unittest.main()
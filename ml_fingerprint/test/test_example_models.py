@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from ml_fingerprint import example_models
+
+
+def write_weather(path, rows=300):
+    '''
+    Writes a small CSV with the columns of the weatherAUS dataset.
+    '''
+    rng = np.random.RandomState(0)
+    columns = {'Date': pd.date_range('2010-01-01', periods=rows).strftime('%Y-%m-%d'),
+               'Location': rng.choice(['Albury', 'Cobar', 'Perth', None], rows)}
+    for col in ('Rainfall', 'WindGustSpeed', 'WindSpeed3pm', 'Humidity3pm', 'Pressure9am', 'Pressure3pm', 'Cloud3pm', 'MinTemp'):
+        values = rng.exponential(10, rows)
+        values[rng.rand(rows) < 0.1] = np.nan
+        columns[col] = values
+    columns['RainTomorrow'] = np.where(columns['Humidity3pm'] > 8, 'Yes', 'No')
+    pd.DataFrame(columns).to_csv(path, index=False)
+
+
+class ExampleModelsTestCase(unittest.TestCase):
+    def test_dataset_is_cached(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'weather.csv')
+            write_weather(path)
+            first = example_models.read_dataset(path, parse_dates=['Date'])
+            cached = os.listdir(os.path.join(tmp, '.cache'))
+            self.assertEqual(len(cached), 1)
+            second = example_models.read_dataset(path, parse_dates=['Date'])
+            pd.testing.assert_frame_equal(first, second)
+            self.assertTrue(pd.api.types.is_datetime64_any_dtype(second['Date']))
+
+    def test_rain_classifier(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'weatherAUS.csv')
+            write_weather(path)
+            model, scores = example_models.rain_classifier(path)
+            # 10 numerical columns and 3 locations
+            self.assertEqual(model.coef_.shape, (1, 13))
+            self.assertGreater(scores['Accuracy'], 0.5)
+
+    def test_large_models_have_the_requested_size(self):
+        self.assertEqual(example_models.large_svc(n_support_vectors=300, n_features=40).support_vectors_.shape, (300, 40))
+        self.assertEqual(len(example_models.large_random_forest(n_trees=7, n_samples=300).estimators_), 7)
+        self.assertEqual([c.shape for c in example_models.large_mlp((64, 32), n_samples=300).coefs_], [(20, 64), (64, 32), (32, 1)])
+        self.assertEqual(example_models.large_kmeans(n_clusters=30, n_features=8).cluster_centers_.shape, (30, 8))
+        self.assertEqual(len(example_models.large_text_pipeline(vocabulary_size=3000, n_documents=100)[0].vocabulary_), 3000)
+
+    def test_large_models_are_deterministic(self):
+        first = example_models.large_random_forest(n_trees=3, n_samples=300)
+        second = example_models.large_random_forest(n_trees=3, n_samples=300)
+        for a, b in zip(first.estimators_, second.estimators_):
+            np.testing.assert_array_equal(a.tree_.threshold, b.tree_.threshold)
+        np.testing.assert_array_equal(example_models.large_mlp((16,), n_samples=300).coefs_[0],
+                                      example_models.large_mlp((16,), n_samples=300).coefs_[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import os
+import sys
+import json
+import unittest
+import subprocess
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+
+def loaded_modules(code):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    out = subprocess.check_output([sys.executable, '-c', code + '; import sys, json; print(json.dumps(sorted(sys.modules)))'], env=env)
+    return set(json.loads(out.decode().strip().splitlines()[-1]))
+
+
+class ImportsTestCase(unittest.TestCase):
+    def test_remote_loads_only_what_verification_needs(self):
+        modules = loaded_modules('import ml_fingerprint.remote')
+        for name in ('requests', 'sqlite3', 'ml_fingerprint.example_models', 'sklearn.svm', 'sklearn.cluster'):
+            self.assertNotIn(name, modules)
+
+    def test_lazy_submodules(self):
+        modules = loaded_modules('import ml_fingerprint; ml_fingerprint.serialization')
+        self.assertIn('ml_fingerprint.serialization', modules)
+        self.assertNotIn('ml_fingerprint.remote', modules)
+        self.assertNotIn('sklearn', modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
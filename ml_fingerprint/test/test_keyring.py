@@ -0,0 +1,42 @@
+import unittest
+from ml_fingerprint import ml_fingerprint, example_models, exceptions, keyring
+from Crypto.PublicKey import RSA
+
+
+class KeyringTestCase(unittest.TestCase):
+    def setUp(self):
+        ml_fingerprint.decorate_base_estimator()
+        self.old_key = RSA.generate(1024)
+        self.new_key = RSA.generate(1024)
+        self.model = example_models.vanderplas_regression()
+        self.model.sign(self.new_key)
+
+    def test_verify_picks_key_by_id(self):
+        self.assertEqual(self.model.ml_fingerprint_data['key_id'], keyring.key_id(self.new_key.publickey()))
+        ring = keyring.Keyring([self.old_key.publickey(), self.new_key.publickey().export_key()])
+        self.assertEqual(len(ring.candidates(self.model.ml_fingerprint_data)), 1)
+        self.assertTrue(self.model.verify(ring))
+
+    def test_key_not_in_keyring(self):
+        ring = keyring.Keyring([self.old_key.publickey()])
+        with self.assertRaises(exceptions.VerificationError):
+            self.model.verify(ring)
+
+    def test_revoked_key(self):
+        ring = keyring.Keyring([self.old_key, self.new_key])
+        ring.remove(keyring.key_id(self.new_key))
+        with self.assertRaises(exceptions.VerificationError):
+            self.model.verify(ring)
+
+    def test_signature_without_key_id(self):
+        del self.model.ml_fingerprint_data['key_id']
+        ring = keyring.Keyring([self.old_key.publickey(), self.new_key.publickey()])
+        self.assertTrue(self.model.verify(ring))
+
+    def test_load_key_parses_once(self):
+        pem = self.new_key.publickey().export_key()
+        self.assertIs(keyring.load_key(pem), keyring.load_key(pem.decode()))
+
+
+if __name__ == '__main__':
+    unittest.main()
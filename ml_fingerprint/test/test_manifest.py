@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+import orjson
+import numpy as np
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from ml_fingerprint import ml_fingerprint, example_models, exceptions, manifest, remote, serialization
+from Crypto.PublicKey import RSA
+
+
+class ManifestTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.key = RSA.generate(2048)
+        ml_fingerprint.decorate_base_estimator()
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.X = rng.randn(100, 4)
+        self.y = rng.randint(0, 3, 100)
+
+    def assertSamePredictions(self, model, other):
+        np.testing.assert_array_equal(model.predict(self.X), other.predict(self.X))
+
+    def test_roundtrip(self):
+        for model in (make_pipeline(MinMaxScaler(), LogisticRegression()).fit(self.X, self.y),
+                      RandomForestClassifier(n_estimators=3, random_state=0).fit(self.X, self.y)):
+            self.assertSamePredictions(model, manifest.loads(manifest.dumps(model)).load())
+
+    def test_verify_before_building(self):
+        model = example_models.vanderplas_regression()
+        model.sign(self.key)
+        lazy_model = manifest.loads(manifest.dumps(model))
+        self.assertEqual(lazy_model.estimator, 'sklearn.linear_model._base:LinearRegression')
+        self.assertTrue(lazy_model.verify(self.key.publickey()))
+        self.assertIsNone(lazy_model._model)
+        self.assertTrue(lazy_model.load().verify(self.key.publickey()))
+
+    def test_altered_buffer(self):
+        model = example_models.vanderplas_regression()
+        model.sign(self.key)
+        data = bytearray(manifest.dumps(model))
+        lazy_model = manifest.loads(data)
+        lazy_model.attributes['coef_'][0] = -4.0
+        with self.assertRaises(exceptions.VerificationError):
+            lazy_model.verify(self.key.publickey())
+
+    def test_untrusted_class(self):
+        model = LogisticRegression().fit(self.X, self.y)
+        lazy_model = manifest.loads(manifest.dumps(model), trusted_modules=('numpy',))
+        with self.assertRaises(exceptions.UnsupportedModel):
+            lazy_model.load()
+
+    def memmap_manifest(self, model, path):
+        '''
+        Serializes the model with an extra attribute that creates the file at path when built.
+        '''
+        description, buffers = manifest.dumps_manifest(model)
+        description = orjson.loads(description)
+        args = [{'t': 'json', 'v': v} for v in (path, 'uint8', 'w+', 0)] + [{'t': 'tuple', 'items': [{'t': 'json', 'v': 16}]}]
+        description['model']['attributes'].append(['mapped_', {'t': 'reduce', 'class': 'numpy:memmap',
+                                                               'args': {'t': 'tuple', 'items': args},
+                                                               'state': {'t': 'json', 'v': None}}])
+        return b''.join(serialization.iter_oob(orjson.dumps(description), buffers, magic=manifest.MAGIC))
+
+    def test_only_allowed_classes_are_built(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'created')
+            data = self.memmap_manifest(example_models.vanderplas_regression(), path)
+            with self.assertRaises(exceptions.UnsupportedModel):
+                manifest.loads(data).load()
+            self.assertFalse(os.path.exists(path))
+
+    def test_unsigned_model_with_key(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'created')
+            data = self.memmap_manifest(example_models.vanderplas_regression(), path)
+            # Rejected before anything is built (building it would fail with UnsupportedModel)
+            with self.assertRaises(exceptions.ModelNotSigned):
+                remote.deserialize_model(data, 'manifest', self.key.publickey())
+            self.assertFalse(os.path.exists(path))
+
+    def test_encode_decode(self):
+        model = example_models.vanderplas_classifier()
+        model.sign(self.key)
+        b64string_model, serializer_bytes, _ = remote.encode_model(model, 'manifest')
+        decoded = remote.decode_model(b64string_model, serializer_bytes, self.key.publickey())
+        np.testing.assert_array_equal(decoded.support_vectors_, model.support_vectors_)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,13 @@
 import unittest
-from ml_fingerprint import ml_fingerprint, example_models, exceptions
-from Crypto.PublicKey import RSA
+import numpy as np
+from ml_fingerprint import ml_fingerprint, example_models, exceptions, digests, keyring
+from Crypto.PublicKey import RSA, ECC
+from Crypto.Hash import SHA256
+from Crypto.Signature import pkcs1_15
+from sklearn.linear_model import SGDRegressor
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.ensemble import RandomForestClassifier
 
 class VerificationTestCase(unittest.TestCase):
     def setUp(self):
@@ -57,5 +64,96 @@ TwIDAQAB
         with self.assertRaises(exceptions.VerificationError):
             self.model.verify(self.public_key)
 
+    def test_resign_after_partial_fit(self):
+        rng = np.random.RandomState(0)
+        X, y = rng.rand(50, 4), rng.rand(50)
+        model = SGDRegressor().partial_fit(X, y)
+        model.sign(self.private_key)
+        model.partial_fit(X, y)
+        with self.assertRaises(exceptions.VerificationError):
+            model.verify(self.public_key)
+        model.sign(self.private_key)
+        self.assertTrue(model.verify(self.public_key))
+
+    def test_resign_after_inplace_change(self):
+        self.model.sign(self.private_key)
+        self.model.coef_[0] = -4.0
+        self.model.sign(self.private_key)
+        self.assertTrue(self.model.verify(self.public_key))
+
+    def test_nested_estimators_are_signed(self):
+        rng = np.random.RandomState(0)
+        X, y = rng.rand(60, 3), rng.rand(60) > 0.5
+        model = make_pipeline(MinMaxScaler(), RandomForestClassifier(n_estimators=40, max_depth=3, random_state=0)).fit(X, y)
+        model.sign(self.private_key)
+        self.assertEqual(model.ml_fingerprint_data['excluded_data'], [])
+        self.assertTrue(model.verify(self.public_key))
+
+        model.steps[0][1].scale_[0] += 1.0
+        with self.assertRaises(exceptions.VerificationError):
+            model.verify(self.public_key)
+        model.steps[0][1].scale_[0] -= 1.0
+        model.steps[1][1].estimators_[30].tree_.threshold[0] += 1.0
+        with self.assertRaises(exceptions.VerificationError):
+            model.verify(self.public_key)
+
+    def test_legacy_signature(self):
+        serialized_model, excluded = ml_fingerprint._serialize_attributes(self.model.__dict__)
+        signature = pkcs1_15.new(self.private_key).sign(SHA256.new(serialized_model))
+        self.model.ml_fingerprint_data = {'excluded_data': excluded, 'signature': signature}
+        self.assertTrue(self.model.verify(self.public_key))
+        self.model.coef_[0] = -4.0
+        with self.assertRaises(exceptions.VerificationError):
+            self.model.verify(self.public_key)
+
+    def test_padding_is_hashed_as_zeros(self):
+        # Like the nodes of a tree: 7 bytes of padding after the last field
+        dtype = np.dtype({'names': ['left', 'threshold', 'missing'], 'formats': ['<i8', '<f8', 'u1'],
+                          'offsets': [0, 8, 16], 'itemsize': 24})
+        nodes = np.zeros(5, dtype=dtype)
+        nodes['threshold'] = np.arange(5)
+        garbage = nodes.copy()
+        garbage.view(np.uint8).reshape(5, 24)[:, 17:] = 0xAB
+        self.assertEqual(digests.array_digest(nodes), digests.array_digest(garbage))
+        self.assertNotEqual(digests.array_digest(nodes, zero_padding=False), digests.array_digest(garbage, zero_padding=False))
+        garbage['missing'][0] = 1
+        self.assertNotEqual(digests.array_digest(nodes), digests.array_digest(garbage))
+
+        self.model.nodes_ = garbage
+        self.model.sign(self.private_key)
+        self.assertEqual(self.model.ml_fingerprint_data['scheme'], 'attributes-v3')
+        self.assertTrue(self.model.verify(self.public_key))
+
+        # Models signed with attributes-v2 hashed the padding as it was
+        attribute_digests, excluded = digests.attribute_digests(self.model.__dict__, scheme='attributes-v2')
+        fingerprint_data = {'scheme': 'attributes-v2', 'digests': attribute_digests, 'excluded_data': excluded}
+        fingerprint_data['signature'] = keyring.sign_message(self.private_key, digests.signed_message(fingerprint_data))
+        self.model.ml_fingerprint_data = fingerprint_data
+        self.assertTrue(self.model.verify(self.public_key))
+        self.model.nodes_ = nodes
+        with self.assertRaises(exceptions.VerificationError):
+            self.model.verify(self.public_key)
+
+    def test_verify_batch(self):
+        rng = np.random.RandomState(0)
+        models = [SGDRegressor(random_state=i).partial_fit(rng.rand(20, 3), rng.rand(20)) for i in range(6)]
+        for model in models[:5]:
+            model.sign(self.private_key)
+        models[2].coef_[0] += 1.0
+        result = ml_fingerprint.verify_batch(models, self.public_key, n_jobs=2)
+        self.assertEqual(result.passed.tolist(), [True, True, False, True, True, False])
+        self.assertIsInstance(result.errors[2], exceptions.VerificationError)
+        self.assertIsInstance(result.errors[5], exceptions.ModelNotSigned)
+        self.assertEqual(result.failed().tolist(), [2, 5])
+        self.assertFalse(result)
+
+    def test_ed25519_signature(self):
+        key = ECC.generate(curve='ed25519')
+        self.model.sign(key)
+        self.assertTrue(self.model.verify(key.public_key()))
+        self.assertTrue(ml_fingerprint.verify_batch([self.model], key.public_key()))
+        with self.assertRaises(exceptions.VerificationError):
+            self.model.verify(self.public_key)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,94 @@
+import os
+import base64
+import hashlib
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from ml_fingerprint import ml_fingerprint, example_models, serialization, remote, exceptions
+from Crypto.PublicKey import RSA
+
+
+class SerializationTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.key = RSA.generate(2048)
+        ml_fingerprint.decorate_base_estimator()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.model = example_models.vanderplas_classifier()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_oob_roundtrip(self):
+        pickled, buffers = serialization.dumps_oob(self.model)
+        self.assertTrue(len(buffers) > 0)
+        model = serialization.loads_oob(pickled, buffers)
+        np.testing.assert_array_equal(model.support_vectors_, self.model.support_vectors_)
+
+    def test_mmap_load_is_mapped_and_verifies(self):
+        self.model.sign(self.key)
+        path = os.path.join(self.tmp.name, 'model.mlfp')
+        serialization.dump(self.model, path)
+        model = serialization.load(path)
+        self.assertFalse(model.support_vectors_.flags.writeable)
+        self.assertFalse(model.support_vectors_.flags.owndata)
+        self.assertTrue(model.verify(self.key.publickey()))
+
+    def test_encode_decode_pickle5(self):
+        self.model.sign(self.key)
+        b64string_model, serializer_bytes, serializer_text = remote.encode_model(self.model, 'pickle5')
+        self.assertEqual(serializer_bytes, 'pickle5')
+        model = remote.decode_model(b64string_model, serializer_bytes)
+        self.assertTrue(model.support_vectors_.flags.writeable)
+        self.assertTrue(model.verify(self.key.publickey()))
+
+    def test_model_cache(self):
+        cache = remote.ModelCache(self.tmp.name)
+        self.assertIsNone(cache.cached_digest('svc', '1.0'))
+        self.assertIsNone(cache.load('svc', '1.0', 'a1'))
+        cache.store('svc', '1.0', 'a1', self.model)
+        self.assertEqual(cache.cached_digest('svc', '1.0'), 'a1')
+        model = cache.load('svc', '1.0', 'a1')
+        np.testing.assert_array_equal(model.predict(model.support_vectors_), self.model.predict(self.model.support_vectors_))
+        # The version was updated on the server: the old copy is replaced
+        cache.store('svc', '1.0', 'id:3:1', self.model)
+        self.assertEqual(cache.cached_digest('svc', '1.0'), 'id:3:1')
+        self.assertIsNone(cache.load('svc', '1.0', 'a1'))
+        cache.store('svc', '1.01', 'b2', self.model)
+        cache.remove('svc', '1.0')
+        self.assertIsNone(cache.cached_digest('svc', '1.0'))
+        self.assertEqual(cache.cached_digest('svc', '1.01'), 'b2')
+
+    def test_chunks_not_sent_by_the_server(self):
+        chunks = [b'first chunk', b'second chunk']
+        chunk_list = [[hashlib.sha256(chunk).hexdigest(), len(chunk)] for chunk in chunks]
+        server = remote.RemoteServer('http://registry.invalid/', 'key')
+        def fetch(responses):
+            # Answers every /chunks/fetch with the next of the given lists of [digest, content]
+            responses = iter(responses)
+            def post(url, json=None, **kwargs):
+                response = mock.Mock(status_code=200)
+                response.json.return_value = {'chunks': [[digest, base64.b64encode(content).decode('ascii')]
+                                                         for digest, content in next(responses)]}
+                return response
+            return mock.patch('requests.post', post)
+        # Sent over two rounds
+        with fetch([[(chunk_list[0][0], chunks[0])], [(chunk_list[1][0], chunks[1])]]):
+            self.assertEqual(server._download_chunks(chunk_list), b''.join(chunks))
+        # A chunk deleted from the server: it must not ask again forever
+        with fetch([[(chunk_list[0][0], chunks[0])], []]):
+            with self.assertRaises(KeyError):
+                server._download_chunks(chunk_list)
+        with fetch([[(chunk_list[0][0], chunks[1])]]):
+            with self.assertRaises(exceptions.VerificationError):
+                server._download_chunks(chunk_list)
+        with fetch([[(hashlib.sha256(b'other').hexdigest(), b'other')]]):
+            with self.assertRaises(exceptions.VerificationError):
+                server._download_chunks(chunk_list)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import time
+import unittest
+import numpy as np
+from ml_fingerprint import ml_fingerprint, example_models, exceptions, remote, serving, digests, keyring
+from Crypto.PublicKey import RSA
+from sklearn.linear_model import LinearRegression
+
+
+class LocalRegistry():
+    """
+    Stands in for RemoteServer: keeps the encoded models in memory.
+    """
+    def __init__(self):
+        self.models = {}
+
+    def publish(self, name, version, model):
+        self.models.setdefault(name, {})[version] = remote.encode_model(model, 'manifest')[0]
+
+    def get_list_models(self, modelname=None):
+        return [{'name': modelname, 'version': version} for version in sorted(self.models[modelname], reverse=True)]
+
+    def get_model(self, modelname, public_key, version=None):
+        return remote.decode_model(self.models[modelname][version], 'manifest', public_key)
+
+
+class ServingTestCase(unittest.TestCase):
+    def setUp(self):
+        ml_fingerprint.decorate_base_estimator()
+        self.key = RSA.generate(1024)
+        self.registry = LocalRegistry()
+        self.model = example_models.vanderplas_regression()
+        self.model.sign(self.key)
+        self.registry.publish('regression', '1.0', self.model)
+        self.pool = serving.ModelPool(self.registry, self.key.publickey(), ['regression'], max_delay=0.05)
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def test_predictions_are_batched(self):
+        X = np.linspace(0, 10, 80).reshape(-1, 2)
+        futures = [self.pool.submit('regression', x) for x in X]
+        bad = self.pool.submit('regression', np.ones((1, 3)))
+        np.testing.assert_allclose([f.result(10) for f in futures], self.model.predict(X))
+        with self.assertRaises(ValueError):
+            bad.result(10)
+        self.assertLess(self.pool.stats['batches'], 41)
+        self.assertEqual(self.pool.stats['requests'], 41)
+
+    def test_hot_swap(self):
+        new_model = LinearRegression().fit([[0, 0], [1, 0], [0, 1]], [1, 3, 1])
+        new_model.sign(self.key)
+        self.registry.publish('regression', '2.0', new_model)
+        self.assertEqual(self.pool.check_updates(), [('regression', '2.0')])
+        self.assertEqual(self.pool.predict('regression', [[1, 0]], timeout=10)[0], 3)
+        # A tampered version is not served
+        new_model.coef_[0] = 100
+        self.registry.publish('regression', '3.0', new_model)
+        self.assertEqual(self.pool.check_updates(), [])
+        self.assertIsInstance(self.pool.errors[('regression', '3.0')], exceptions.VerificationError)
+        self.assertEqual(self.pool.latest['regression'].version, '2.0')
+        # Pinned versions are still available, and their batchers exit when idle
+        self.pool.idle_timeout = 0.05
+        self.assertEqual(self.pool.predict('regression', [[1, 0]], version='1.0', timeout=10), self.model.predict([[1, 0]]))
+        time.sleep(0.5)
+        self.assertNotIn(('regression', '1.0', 'predict'), self.pool._batchers)
+
+    def test_download_errors_are_retried(self):
+        new_model = LinearRegression().fit([[0, 0], [1, 0], [0, 1]], [1, 3, 1])
+        new_model.sign(self.key)
+        self.registry.publish('regression', '2.0', new_model)
+        get_model = self.registry.get_model
+        failures = [ConnectionError("Connection reset by peer")]
+        def flaky_get_model(*args, **kwargs):
+            if failures:
+                raise failures.pop()
+            return get_model(*args, **kwargs)
+        self.registry.get_model = flaky_get_model
+        self.assertEqual(self.pool.check_updates(), [])
+        self.assertNotIn(('regression', '2.0'), self.pool.errors)
+        self.assertEqual(self.pool.check_updates(), [('regression', '2.0')])
+
+
+
+class ObjectRegistry():
+    """
+    Returns the estimators as they are, like RemoteServer.get_model() does for
+    pickled models whose class wasn't patched by decorate_base_estimator().
+    """
+    def __init__(self, models):
+        self.models = models
+
+    def get_list_models(self, modelname=None):
+        return [{'name': modelname, 'version': version} for version in sorted(self.models[modelname], reverse=True)]
+
+    def get_model(self, modelname, public_key, version=None):
+        return self.models[modelname][version]
+
+
+class UnpatchedServingTestCase(unittest.TestCase):
+    def test_forged_signature_is_refused(self):
+        key = RSA.generate(1024)
+        model = LinearRegression().fit([[0, 0], [1, 0], [0, 1]], [1, 3, 1])
+        # Signed without decorate_base_estimator()
+        attribute_digests, excluded = digests.attribute_digests(model.__dict__)
+        fingerprint_data = {'scheme': digests.SCHEME, 'digests': attribute_digests, 'excluded_data': excluded}
+        fingerprint_data['signature'] = keyring.sign_message(key, digests.signed_message(fingerprint_data))
+        model.ml_fingerprint_data = fingerprint_data
+        forged = LinearRegression().fit([[0, 0], [1, 0], [0, 1]], [1, 30, 1])
+        forged.ml_fingerprint_data = fingerprint_data
+        pool = serving.ModelPool(ObjectRegistry({'regression': {'1.0': model, '2.0': forged}}), key.publickey())
+        try:
+            self.assertEqual(pool.predict('regression', [[1, 0]], version='1.0', timeout=10)[0], 3)
+            with self.assertRaises(exceptions.VerificationError):
+                pool.load('regression')
+            self.assertNotIn('regression', pool.latest)
+        finally:
+            pool.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,4 +8,5 @@ setup(
    author_email='j.solsonaa@alumnos.urjc.es',
    packages=['ml_fingerprint'],
    install_requires=['scikit-learn', 'orjson', 'pycryptodome', 'pandas'],
+   entry_points={'console_scripts': ['ml-fingerprint = ml_fingerprint.cli:main']},
 )
\ No newline at end of file